@@ -0,0 +1,133 @@
+# Run this from the project root
+#
+# python examples/benchmark_compression.py
+#
+# Compares request body sizes with and without compression, using payloads
+# shaped like real `fill_pdf`, `generate_pdf` and `create_etch_packet` calls.
+# Nothing is sent to the API. zstd results need `pip install zstandard`.
+
+import base64
+import json
+import random
+import string
+import time
+import zlib
+from tabulate import tabulate
+
+from python_anvil.constants import COMPRESSIONS
+from python_anvil.http import get_compressor
+
+
+random.seed(0)
+
+
+def _words(count):
+    return " ".join(
+        "".join(random.choices(string.ascii_lowercase, k=random.randint(2, 9)))
+        for _ in range(count)
+    )
+
+
+def fill_pdf_payload(rows=2000):
+    """A fill with a large repeating table, e.g. a statement or invoice."""
+    return {
+        "title": "Monthly statement",
+        "fontSize": 10,
+        "textColor": "#333333",
+        "data": {
+            "name": {"firstName": "Robin", "mi": "W", "lastName": "Smith"},
+            "email": "robin@example.com",
+            "lineItems": [
+                {
+                    "date": f"2024-{random.randint(1, 12):02}-"
+                    f"{random.randint(1, 28):02}",
+                    "description": random.choice(
+                        ["Consulting", "Hosting", "Support", "License fee"]
+                    ),
+                    "quantity": random.randint(1, 10),
+                    "amount": f"{random.uniform(10, 1000):.2f}",
+                }
+                for _ in range(rows)
+            ],
+        },
+    }
+
+
+def generate_pdf_payload(sections=300):
+    """A generated PDF with many sections of text."""
+    return {
+        "title": "Terms of service",
+        "type": "markdown",
+        "data": [
+            {"label": f"Section {i}", "content": _words(80)} for i in range(sections)
+        ],
+    }
+
+
+def etch_packet_payload(pdf_size=2 * 1024 * 1024):
+    """An Etch packet with a base64 PDF inside the GraphQL variables.
+
+    PDF content streams are usually deflated, so most of the file is
+    incompressible, but base64 only uses 6 bits of each byte.
+    """
+    stream = zlib.compress(_words(pdf_size // 4).encode())[: pdf_size // 2]
+    pdf = b"%PDF-1.7\n" + stream + b"\n%%EOF" + _words(pdf_size // 40).encode()
+    return {
+        "query": "mutation CreateEtchPacket(...) { ... }",
+        "variables": {
+            "name": "Packet name",
+            "files": [
+                {
+                    "id": "contract",
+                    "title": "Contract",
+                    "file": {
+                        "data": base64.b64encode(pdf).decode(),
+                        "filename": "contract.pdf",
+                        "mimetype": "application/pdf",
+                    },
+                }
+            ],
+        },
+    }
+
+
+def main():
+    compressors = {}
+    for name in COMPRESSIONS:
+        try:
+            compressors[name] = get_compressor(name)
+        except ImportError as e:
+            print(f"Skipping {name}: {e}")
+
+    rows = []
+    for label, payload in [
+        ("fill_pdf", fill_pdf_payload()),
+        ("generate_pdf", generate_pdf_payload()),
+        ("create_etch_packet", etch_packet_payload()),
+    ]:
+        body = json.dumps(payload, separators=(",", ":")).encode()
+        for name, compress in compressors.items():
+            start = time.perf_counter()
+            compressed = compress(body)
+            elapsed = time.perf_counter() - start
+            rows.append(
+                [
+                    label,
+                    name,
+                    f"{len(body) / 1024:,.0f} KiB",
+                    f"{len(compressed) / 1024:,.0f} KiB",
+                    f"{1 - len(compressed) / len(body):.0%}",
+                    f"{elapsed * 1000:.1f} ms",
+                ]
+            )
+
+    print(
+        tabulate(
+            rows,
+            headers=["Payload", "Encoding", "Original", "Compressed", "Saved", "Time"],
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,92 @@
 import logging
-from gql import gql
+from concurrent.futures import ThreadPoolExecutor
+from gql.transport.exceptions import TransportQueryError
 from graphql import DocumentNode
-from typing import Any, AnyStr, Callable, Dict, List, Optional, Tuple, Union
-
-from .api_resources.mutations import (
-    BaseQuery,
-    CreateEtchPacket,
-    ForgeSubmit,
-    GenerateEtchSigningURL,
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AnyStr,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
 )
+
+from .api_resources.mutations import BaseQuery, CreateEtchPacket
 from .api_resources.payload import (
     CreateEtchPacketPayload,
     FillPDFPayload,
     ForgeSubmitPayload,
     GeneratePDFPayload,
 )
-from .api_resources.requests import FullyQualifiedRequest, PlainRequest, RestRequest
-from .http import GQLClient, HTTPClient
-
+from .api_resources.requests import (
+    FullyQualifiedRequest,
+    PlainRequest,
+    RestRequest,
+    UrlRequest,
+    is_anvil_url,
+    is_relative_url,
+)
+from .breaker import CircuitBreaker
+from .bulk import (
+    CAST,
+    ETCH_PACKET,
+    SIGNER,
+    WELD_DATA,
+    BulkField,
+    BulkItem,
+    bulk_queries,
+    bulk_results,
+    query_errors,
+)
+from .casts import LAZY_CAST_FIELDS, Cast, casts_missing
+from .constants import (
+    ANVIL_HOST,
+    DEFAULT_BULK_CHUNK_SIZE,
+    DEFAULT_COMPRESSION_THRESHOLD,
+    DEFAULT_DOWNLOAD_WORKERS,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_TIMEOUT,
+    GRAPHQL_ENDPOINT,
+)
+from .hedge import HedgePolicy
+from .http import GQLClient, HTTPClient, NoAuth, Timeout
+from .limiter import BaseLimiter, create_limiter
+from .loader import Loader
+from .operations import (
+    CURRENT_USER_QUERY,
+    ETCH_PACKET_DOCUMENT_GROUP_QUERY,
+    WELD_QUERY,
+    WELDS_QUERY,
+    cast_query,
+    casts_query,
+    create_etch_packet_mutation,
+    document_file_outputs,
+    document_file_urls,
+    fill_pdf_request,
+    forge_submit_mutation,
+    generate_etch_signing_url_mutation,
+    generate_pdf_request,
+    get_casts_data,
+    get_return,
+    get_welds_data,
+    item_data,
+    make_parent_dir,
+    to_document,
+    update_casts,
+    validation,
+)
+from .retry import RetryPolicy
+from .zipstream import ZipMember, iter_zip_members
 
-logger = logging.getLogger(__name__)
 
+if TYPE_CHECKING:
+    from .batch import Batch  # pylint: disable=cyclic-import
 
-def _get_return(res: Dict, get_data: Callable[[Dict], Union[Dict, List]]):
-    """Process response and get data from path if provided."""
-    _res = res
-    if "response" in res and "headers" in res:
-        _res = res["response"]
-        return {"response": get_data(_res), "headers": res["headers"]}
-    return get_data(_res)
+logger = logging.getLogger(__name__)
 
 
 class Anvil:
@@ -53,21 +111,130 @@ class Anvil:
         api_key: Optional[str] = None,
         environment="dev",
         endpoint_url=None,
+        limiter: Optional[BaseLimiter] = None,
+        limiter_backend: str = "memory",
+        limiter_path: Optional[str] = None,
+        adaptive_rate_limit: bool = False,
+        retry_policy: Optional[RetryPolicy] = None,
+        pool_connections: int = DEFAULT_POOL_SIZE,
+        pool_maxsize: int = DEFAULT_POOL_SIZE,
+        keep_alive: bool = True,
+        timeout: Timeout = DEFAULT_TIMEOUT,
+        http2: bool = False,
+        http2_connections: int = 1,
+        http2_max_streams: Optional[int] = None,
+        compression: Optional[str] = None,
+        compression_threshold: int = DEFAULT_COMPRESSION_THRESHOLD,
+        hedge_policy: Optional[HedgePolicy] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        validate_queries: bool = True,
+        coalesce_window: Optional[float] = None,
     ):
         if not api_key:
             raise ValueError('`api_key` must be a valid string')
 
-        self.client = HTTPClient(api_key=api_key, environment=environment)
+        # Only close limiters created here, a limiter that was passed in may
+        # be shared with other clients.
+        self._owns_limiter = not limiter
+        if not limiter:
+            limiter = create_limiter(
+                limiter_backend,
+                environment=environment,
+                api_key=api_key,
+                path=limiter_path,
+                adaptive=adaptive_rate_limit,
+            )
+
+        self.client = HTTPClient(
+            api_key=api_key,
+            environment=environment,
+            limiter=limiter,
+            retry_policy=retry_policy,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            keep_alive=keep_alive,
+            timeout=timeout,
+            http2=http2,
+            http2_connections=http2_connections,
+            http2_max_streams=http2_max_streams,
+            compression=compression,
+            compression_threshold=compression_threshold,
+            hedge_policy=hedge_policy,
+            circuit_breaker=circuit_breaker,
+        )
+        self.endpoint_url = endpoint_url or GRAPHQL_ENDPOINT
         self.gql_client = GQLClient.get_client(
             api_key=api_key,
             environment=environment,
             endpoint_url=endpoint_url,
+            http_client=self.client,
+            validate_queries=validate_queries,
         )
+        # Opt-in, since every lookup waits for the window to pass.
+        self.loader: Optional[Loader] = None
+        if coalesce_window is not None:
+            self.loader = Loader(self._load_batch, window=coalesce_window)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Close pooled connections and release the client's resources.
+
+        Usage:
+            >> with Anvil(api_key="my_key") as anvil:
+            >>     anvil.fill_pdf("the_template_id", payload)
+        """
+        self.client.close()
+        if self._owns_limiter:
+            self.client.limiter.close()
+
+    def batch(self, **kwargs) -> "Batch":
+        """Queue GraphQL operations, and send them together.
+
+        Operations queued in the `with` block are merged into one request,
+        or two with both queries and mutations, when the block exits. Each
+        returns a future for its own result. See `Batch`.
+
+        Usage:
+            >> with anvil.batch() as b:
+            >>     cast = b.get_cast(cast_eid)
+            >>     weld = b.get_weld(weld_eid)
+            >>     user = b.get_current_user()
+            >> print(cast.result()["title"])
+
+        :param kwargs: Request options for the merged requests, e.g.
+            `timeout`.
+        """
+        # pylint: disable=import-outside-toplevel,cyclic-import
+        from .batch import Batch
+
+        return Batch(self, **kwargs)
+
+    def warmup(self):
+        """Open connections to the REST and GraphQL hosts ahead of time.
+
+        Call this on startup so that the first request doesn't have to wait
+        for the TCP and TLS handshakes.
+        """
+        self.client.warmup([ANVIL_HOST, self.endpoint_url])
+
+    def estimated_wait(self) -> float:
+        """Estimate how long a new request would currently wait to be sent.
+
+        This includes the wait for the rate limiter and any cooldown after a
+        rate-limited response.
+        """
+        return self.client.estimated_wait()
 
     def query(
         self,
         query: Union[str, DocumentNode],
         variables: Optional[Dict[str, Any]] = None,
+        validate: bool = True,
         **kwargs,
     ):
         """Execute a GraphQL query.
@@ -76,18 +243,25 @@ class Anvil:
         :type query: Union[str, DocumentNode]
         :param variables:
         :type variables: Optional[Dict[str, Any]]
+        :param validate: Validate the query against the schema first. Turn
+            this off for hot paths with queries that are known to be valid.
+        :type validate: bool
         :param kwargs:
         :return:
         """
         # Remove `debug` for now.
         kwargs.pop("debug", None)
-        if isinstance(query, str):
-            query = gql(query)
-
-        return self.gql_client.execute(query, variable_values=variables, **kwargs)
+        with validation(validate):
+            return self.gql_client.execute(
+                to_document(query), variable_values=variables, **kwargs
+            )
 
     def mutate(
-        self, query: Union[str, BaseQuery], variables: Dict[str, Any], **kwargs
+        self,
+        query: Union[str, BaseQuery],
+        variables: Dict[str, Any],
+        validate: bool = True,
+        **kwargs,
     ) -> Dict[str, Any]:
         """
         Execute a GraphQL mutation.
@@ -100,18 +274,17 @@ class Anvil:
         :type query: Union[str, BaseQuery]
         :param variables:
         :type variables: Dict[str, Any]
+        :param validate: Validate the mutation against the schema first.
+        :type validate: bool
         :param kwargs:
         :return:
         """
         # Remove `debug` for now.
         kwargs.pop("debug", None)
-        if isinstance(query, str):
-            use_query = gql(query)
-        else:
-            mutation = query.get_mutation()
-            use_query = gql(mutation)
-
-        return self.gql_client.execute(use_query, variable_values=variables, **kwargs)
+        with validation(validate):
+            return self.gql_client.execute(
+                to_document(query), variable_values=variables, **kwargs
+            )
 
     def request_rest(self, options: Optional[dict] = None):
         api = RestRequest(self.client, options=options)
@@ -137,53 +310,15 @@ class Anvil:
             not provided, the latest _published_ version will be used.
         :type kwargs.version_number: int
         """
-        try:
-            if isinstance(payload, dict):
-                data = FillPDFPayload(**payload)
-            elif isinstance(payload, str):
-                data = FillPDFPayload.model_validate_json(payload)
-            elif isinstance(payload, FillPDFPayload):
-                data = payload
-            else:
-                raise ValueError("`payload` must be a valid JSON string or a dict")
-        except KeyError as e:
-            logger.exception(e)
-            raise ValueError(
-                "`payload` validation failed. Please make sure all required "
-                "fields are set. "
-            ) from e
-
-        version_number = kwargs.pop("version_number", None)
-        if version_number:
-            kwargs["params"] = dict(versionNumber=version_number)
-
+        path, data = fill_pdf_request(template_id, payload, kwargs)
         api = RestRequest(client=self.client)
-        return api.post(
-            f"fill/{template_id}.pdf",
-            data.model_dump(by_alias=True, exclude_none=True) if data else {},
-            **kwargs,
-        )
+        return api.post(path, data, **kwargs)
 
     def generate_pdf(self, payload: Union[AnyStr, Dict, GeneratePDFPayload], **kwargs):
-        if not payload:
-            raise ValueError("`payload` must be a valid JSON string or a dict")
-
-        if isinstance(payload, dict):
-            data = GeneratePDFPayload(**payload)
-        elif isinstance(payload, str):
-            data = GeneratePDFPayload.model_validate_json(payload)
-        elif isinstance(payload, GeneratePDFPayload):
-            data = payload
-        else:
-            raise ValueError("`payload` must be a valid JSON string or a dict")
-
+        data = generate_pdf_request(payload, kwargs)
         # Any data errors would come from here
         api = RestRequest(client=self.client)
-        return api.post(
-            "generate-pdf",
-            data=data.model_dump(by_alias=True, exclude_none=True),
-            **kwargs,
-        )
+        return api.post("generate-pdf", data=data, **kwargs)
 
     def get_cast(
         self,
@@ -193,174 +328,234 @@ class Anvil:
         cast_args: Optional[List[Tuple[str, str]]] = None,
         **kwargs,
     ) -> Dict[str, Any]:
-
-        if not fields:
-            # Use default fields
-            fields = ["eid", "title", "fieldInfo"]
-
-        if not cast_args:
-            cast_args = []
-
-        cast_args.append(("eid", f'"{eid}"'))
-
-        # If `version_number` isn't provided, the API will default to the
-        # latest published version.
-        if version_number:
-            cast_args.append(("versionNumber", str(version_number)))
-
-        arg_str = ""
-        if len(cast_args):
-            joined_args = [(":".join(arg)) for arg in cast_args]
-            arg_str = f"({','.join(joined_args)})"
-
-        res = self.query(
-            gql(
-                f"""{{
-              cast {arg_str} {{
-                {" ".join(fields)}
-              }}
-            }}"""
-            ),
-            **kwargs,
-        )
-
-        def get_data(r: dict) -> Dict[str, Any]:
-            return r["cast"]
-
-        return _get_return(res, get_data=get_data)
+        if self.loader is not None and not cast_args and not kwargs:
+            return self._get_one(CAST, eid, fields, dict(versionNumber=version_number))
+        res = self.query(cast_query(eid, fields, version_number, cast_args), **kwargs)
+        return get_return(res, get_data=lambda r: r["cast"])
 
     def get_casts(
         self, fields: Optional[List[str]] = None, show_all: bool = False, **kwargs
     ) -> List[Dict[str, Any]]:
         """Retrieve all Cast objects for the current user across all organizations.
 
+        By default, only each cast's `eid` and `title` are fetched. Other
+        fields, like `fieldInfo`, are fetched when they're used, see `Cast`
+        and `load_cast_fields`.
+
         :param fields: List of fields to retrieve for each cast object
         :type fields: Optional[List[str]]
         :param show_all: Boolean to show all Cast objects.
             Defaults to showing only templates.
         :type show_all: bool
         :param kwargs:
-        :return:
+        :return: A `Cast` for each cast.
         """
-        if not fields:
-            # Use default fields
-            fields = ["eid", "title", "fieldInfo"]
+        res = self.query(casts_query(fields, show_all), **kwargs)
+        return get_return(
+            res,
+            get_data=lambda r: [
+                Cast(c, self.load_cast_fields) for c in get_casts_data(r)
+            ],
+        )
 
-        cast_args = "" if show_all else "(isTemplate: true)"
+    def load_cast_fields(
+        self,
+        casts: Iterable[Cast],
+        fields: Iterable[str] = LAZY_CAST_FIELDS,
+        chunk_size: int = DEFAULT_BULK_CHUNK_SIZE,
+        **kwargs,
+    ) -> Dict[str, BulkItem]:
+        """Fetch fields left out of `get_casts` results, for many casts at once.
+
+        Only casts that don't have `fields` yet are fetched, `chunk_size`
+        per request, with `get_casts_by_eid`. The fields are stored in each
+        `Cast`.
+
+        Usage:
+            >> casts = anvil.get_casts()
+            >> anvil.load_cast_fields([c for c in casts if wanted(c)])
+
+        :param casts: Casts from `get_casts`.
+        :type casts: Iterable[Cast]
+        :param fields: Fields to fetch. Defaults to `fieldInfo`.
+        :type fields: Iterable[str]
+        :param chunk_size: Number of casts fetched per request.
+        :type chunk_size: int
+        :param kwargs:
+        :return: The `get_casts_by_eid` result of each fetched cast, with
+            the errors of casts that couldn't be fetched.
+        """
+        fields = list(fields)
+        missing = casts_missing(casts, fields)
+        results = self.get_casts_by_eid(
+            [cast["eid"] for cast in missing],
+            fields=["eid", *fields],
+            chunk_size=chunk_size,
+            **kwargs,
+        )
+        update_casts(missing, fields, results)
+        return results
 
-        res = self.query(
-            gql(
-                f"""{{
-              currentUser {{
-                organizations {{
-                  casts {cast_args} {{
-                    {" ".join(fields)}
-                  }}
-                }}
-              }}
-            }}"""
-            ),
+    def get_casts_by_eid(
+        self,
+        eids: Iterable[str],
+        fields: Optional[List[str]] = None,
+        version_number: Optional[int] = None,
+        chunk_size: int = DEFAULT_BULK_CHUNK_SIZE,
+        **kwargs,
+    ) -> Dict[str, BulkItem]:
+        """Retrieve many Cast objects by eid, `chunk_size` per request.
+
+        Each request fetches a chunk of casts with one aliased query, so
+        200 casts take 4 requests instead of 200. A cast that can't be
+        fetched doesn't fail the others.
+
+        :param eids: Eids of the casts. Duplicates are fetched once.
+        :type eids: Iterable[str]
+        :param fields: List of fields to retrieve for each cast object
+        :type fields: Optional[List[str]]
+        :param version_number: Version of every cast, as in `get_cast`.
+        :type version_number: Optional[int]
+        :param chunk_size: Number of casts fetched per request.
+        :type chunk_size: int
+        :param kwargs:
+        :return: A `BulkItem` for each eid, with the cast's `data` or an
+            `error`.
+        """
+        return self._get_by_eid(
+            CAST,
+            eids,
+            fields,
+            dict(versionNumber=version_number),
+            chunk_size,
             **kwargs,
         )
 
-        def get_data(r: dict):
-            orgs = r["currentUser"]["organizations"]
-            return [item for org in orgs for item in org["casts"]]
+    def get_etch_packets(
+        self,
+        eids: Iterable[str],
+        fields: Optional[List[str]] = None,
+        chunk_size: int = DEFAULT_BULK_CHUNK_SIZE,
+        **kwargs,
+    ) -> Dict[str, BulkItem]:
+        """Retrieve many Etch packets by eid. See `get_casts_by_eid`."""
+        return self._get_by_eid(ETCH_PACKET, eids, fields, None, chunk_size, **kwargs)
 
-        return _get_return(res, get_data=get_data)
+    def get_signers(
+        self,
+        eids: Iterable[str],
+        fields: Optional[List[str]] = None,
+        chunk_size: int = DEFAULT_BULK_CHUNK_SIZE,
+        **kwargs,
+    ) -> Dict[str, BulkItem]:
+        """Retrieve many signers by eid. See `get_casts_by_eid`."""
+        return self._get_by_eid(SIGNER, eids, fields, None, chunk_size, **kwargs)
 
-    def get_current_user(self, **kwargs):
-        """Retrieve current user data.
+    def get_weld_datas(
+        self,
+        eids: Iterable[str],
+        fields: Optional[List[str]] = None,
+        chunk_size: int = DEFAULT_BULK_CHUNK_SIZE,
+        **kwargs,
+    ) -> Dict[str, BulkItem]:
+        """Retrieve many WeldData objects by eid. See `get_casts_by_eid`."""
+        return self._get_by_eid(WELD_DATA, eids, fields, None, chunk_size, **kwargs)
+
+    def get_etch_packet(
+        self, eid: str, fields: Optional[List[str]] = None, **kwargs
+    ) -> Optional[Dict[str, Any]]:
+        """Retrieve an Etch packet.
 
+        With `coalesce_window`, concurrent lookups are sent together. See
+        `get_signer`.
+        """
+        return self._get_one(ETCH_PACKET, eid, fields, None, **kwargs)
+
+    def get_signer(
+        self, eid: str, fields: Optional[List[str]] = None, **kwargs
+    ) -> Optional[Dict[str, Any]]:
+        """Retrieve a signer.
+
+        If the client was created with `coalesce_window`, lookups made
+        from other threads within that window, including `get_cast`, are
+        sent with this one as a single aliased query. Lookups with request
+        options in `kwargs` are sent on their own.
+
+        :param eid: Eid of the signer.
+        :type eid: str
+        :param fields: List of fields to retrieve. Defaults to the signer's
+            `eid`, `name`, `email`, `status` and `routingOrder`.
+        :type fields: Optional[List[str]]
         :param kwargs:
         :return:
         """
-        res = self.query(
-            gql(
-                """{
-              currentUser {
-                name
-                email
-                eid
-                role
-                organizations {
-                  eid
-                  name
-                  slug
-                  casts {
-                    eid
-                    name
-                  }
-                }
-              }
-            }"""
-            ),
-            **kwargs,
-        )
+        return self._get_one(SIGNER, eid, fields, None, **kwargs)
 
-        return _get_return(res, get_data=lambda r: r["currentUser"])
+    def get_weld_data(
+        self, eid: str, fields: Optional[List[str]] = None, **kwargs
+    ) -> Optional[Dict[str, Any]]:
+        """Retrieve a WeldData object. See `get_signer`."""
+        return self._get_one(WELD_DATA, eid, fields, None, **kwargs)
 
-    def get_welds(self, **kwargs) -> Union[List, Tuple[List, Dict]]:
-        res = self.query(
-            gql(
-                """{
-              currentUser {
-                organizations {
-                  welds {
-                    eid
-                    slug
-                    name
-                    forges {
-                      eid
-                      name
-                    }
-                  }
-                }
-              }
-            }"""
-            ),
-            **kwargs,
-        )
+    def _get_one(
+        self,
+        field: BulkField,
+        eid: str,
+        fields: Optional[List[str]],
+        arguments: Optional[Dict[str, Any]],
+        **kwargs,
+    ) -> Optional[Dict[str, Any]]:
+        if self.loader is not None and not kwargs:
+            item = self.loader.load(field, eid, fields, arguments)
+        else:
+            item = self._get_by_eid(field, [eid], fields, arguments, 1, **kwargs)[eid]
+        return item_data(item)
 
-        def get_data(r: dict):
-            orgs = r["currentUser"]["organizations"]
-            return [item for org in orgs for item in org["welds"]]
+    def _load_batch(
+        self,
+        field: BulkField,
+        eids: List[str],
+        fields: Optional[List[str]],
+        arguments: Dict[str, Any],
+    ) -> Dict[str, BulkItem]:
+        return self._get_by_eid(field, eids, fields, arguments, len(eids))
+
+    def _get_by_eid(
+        self,
+        field: BulkField,
+        eids: Iterable[str],
+        fields: Optional[List[str]],
+        arguments: Optional[Dict[str, Any]],
+        chunk_size: int,
+        **kwargs,
+    ) -> Dict[str, BulkItem]:
+        results: Dict[str, BulkItem] = {}
+        for document, variables, chunk in bulk_queries(
+            field, eids, fields, arguments, chunk_size
+        ):
+            try:
+                data, errors = self.query(document, variables=variables, **kwargs), None
+            except TransportQueryError as e:
+                data, errors = query_errors(e)
+            results.update(bulk_results(chunk, data, errors))
+        return results
 
-        return _get_return(res, get_data=get_data)
+    def get_current_user(self, **kwargs):
+        """Retrieve current user data.
 
-    def get_weld(self, eid: str, **kwargs):
-        res = self.query(
-            gql(
-                """
-            query WeldQuery(
-                #$organizationSlug: String!,
-                #$slug: String!
-                $eid: String!
-            ) {
-                weld(
-                    #organizationSlug: $organizationSlug,
-                    #slug: $slug
-                    eid: $eid
-                ) {
-                    eid
-                    slug
-                    name
-                    forges {
-                        eid
-                        name
-                        slug
-                    }
-                }
-            }"""
-            ),
-            variables=dict(eid=eid),
-            **kwargs,
-        )
+        :param kwargs:
+        :return:
+        """
+        res = self.query(CURRENT_USER_QUERY, **kwargs)
+        return get_return(res, get_data=lambda r: r["currentUser"])
 
-        def get_data(r: dict):
-            return r["weld"]
+    def get_welds(self, **kwargs) -> Union[List, Tuple[List, Dict]]:
+        res = self.query(WELDS_QUERY, **kwargs)
+        return get_return(res, get_data=get_welds_data)
 
-        return _get_return(res, get_data=get_data)
+    def get_weld(self, eid: str, **kwargs):
+        res = self.query(WELD_QUERY, variables=dict(eid=eid), **kwargs)
+        return get_return(res, get_data=lambda r: r["weld"])
 
     def create_etch_packet(
         self,
@@ -376,46 +571,115 @@ class Anvil:
         **kwargs,
     ):
         """Create etch packet via a graphql mutation."""
-        # Create an etch packet payload instance excluding signers and files
-        # (if any). We'll need to add those separately. below.
-        if not any([payload, json]):
-            raise TypeError('One of the arguments `payload` or `json` must exist')
-
-        if json:
-            payload = CreateEtchPacketPayload.model_validate_json(json)
-
-        if isinstance(payload, dict):
-            mutation = CreateEtchPacket.create_from_dict(payload)
-        elif isinstance(payload, CreateEtchPacketPayload):
-            mutation = CreateEtchPacket(payload=payload)
-        elif isinstance(payload, CreateEtchPacket):
-            mutation = payload
-        else:
-            raise ValueError(
-                "`payload` must be a valid CreateEtchPacket instance or dict"
-            )
-
-        payload = mutation.create_payload()
-        variables = payload.model_dump(by_alias=True, exclude_none=True)
-
+        mutation, variables = create_etch_packet_mutation(payload, json)
         return self.mutate(mutation, variables=variables, upload_files=True, **kwargs)
 
     def generate_etch_signing_url(self, signer_eid: str, client_user_id: str, **kwargs):
         """Generate a signing URL for a given user."""
-        mutation = GenerateEtchSigningURL(
-            signer_eid=signer_eid,
-            client_user_id=client_user_id,
-        )
-        payload = mutation.create_payload()
-        return self.mutate(
-            mutation, variables=payload.model_dump(by_alias=True), **kwargs
+        mutation, variables = generate_etch_signing_url_mutation(
+            signer_eid, client_user_id
         )
+        return self.mutate(mutation, variables=variables, **kwargs)
 
     def download_documents(self, document_group_eid: str, **kwargs):
-        """Retrieve all completed documents in zip form."""
+        """Retrieve all completed documents in zip form.
+
+        Pass `output` to stream the zip to a file path or file object. With
+        `resume=True` and a file path, an interrupted download is resumed
+        instead of restarted, and the file is verified before it is saved.
+        See `HTTPClient.download`.
+        """
         api = PlainRequest(client=self.client)
         return api.get(f"document-group/{document_group_eid}.zip", **kwargs)
 
+    def extract_documents(
+        self, document_group_eid: str, **kwargs
+    ) -> Iterator[Tuple[str, ZipMember]]:
+        """Yield each completed document while the zip is still downloading.
+
+        Each item is a `(filename, member)` tuple. The member's contents can
+        be read in chunks by iterating over it, or saved with `write_to()`,
+        and must be read before moving on to the next document.
+
+        Usage:
+            >> for filename, member in anvil.extract_documents(eid):
+            >>     upload(filename, iter(member))
+        """
+        kwargs.pop("output", None)
+        kwargs.pop("resume", None)
+        content = self.download_documents(document_group_eid, stream=True, **kwargs)
+        with content:
+            for member in iter_zip_members(content):
+                if not member.name.endswith("/"):
+                    yield member.name, member
+
+    def get_etch_packet_document_group(
+        self, etch_packet_eid: str, **kwargs
+    ) -> Dict[str, Any]:
+        """Retrieve the document group of an Etch packet, with its file listing.
+
+        :return: The document group's `eid`, `status` and `files`, as
+            accepted by `download_document_files()`.
+        """
+        res = self.query(
+            ETCH_PACKET_DOCUMENT_GROUP_QUERY,
+            variables=dict(eid=etch_packet_eid),
+            **kwargs,
+        )
+        return get_return(res, get_data=lambda r: r["etchPacket"]["documentGroup"])
+
+    def download_document_files(
+        self,
+        document_group: Union[str, Dict[str, Any]],
+        filenames: Optional[List[str]] = None,
+        output_dir: Optional[str] = None,
+        max_workers: int = DEFAULT_DOWNLOAD_WORKERS,
+        **kwargs,
+    ) -> Dict[str, Any]:
+        """Download some of the files of a document group, in parallel.
+
+        Only the requested files are downloaded, instead of the whole zip
+        from `download_documents()`. Downloads share the client's rate
+        limiter. If one fails, the others are cancelled and its error is
+        raised.
+
+        :param document_group: A document group with its `files` listing,
+            e.g. from `get_etch_packet_document_group()`, or just its eid.
+        :param filenames: The `filename`s of the files to download. Defaults
+            to all files in the listing. Required with an eid, which can't
+            be checked against a listing.
+        :param output_dir: Directory to save the files to, under their
+            relative paths. By default, the files' contents are returned
+            instead.
+        :param max_workers: Maximum number of files to download at a time.
+        :return: A dict of each file's contents, or path with `output_dir`,
+            by filename.
+        """
+        urls = document_file_urls(document_group, filenames)
+        outputs = document_file_outputs(output_dir, list(urls))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                name: executor.submit(
+                    self._download_document_file, url, output=outputs[name], **kwargs
+                )
+                for name, url in urls.items()
+            }
+            try:
+                return {name: future.result() for name, future in futures.items()}
+            except BaseException:
+                for future in futures.values():
+                    future.cancel()
+                raise
+
+    def _download_document_file(self, url: str, **kwargs):
+        make_parent_dir(kwargs.get("output"))
+        if is_relative_url(url):
+            return PlainRequest(client=self.client).get(url, **kwargs)
+        if not is_anvil_url(url):
+            # The API key is only sent to Anvil.
+            kwargs["auth"] = NoAuth()
+        return UrlRequest(self.client).get(url, **kwargs)
+
     def forge_submit(
         self,
         payload: Optional[Union[Dict[str, Any], ForgeSubmitPayload]] = None,
@@ -423,25 +687,5 @@ class Anvil:
         **kwargs,
     ) -> Dict[str, Any]:
         """Create a Webform (forge) submission via a graphql mutation."""
-        if not any([json, payload]):
-            raise TypeError('One of arguments `json` or `payload` are required')
-
-        if json:
-            payload = ForgeSubmitPayload.model_validate_json(json)
-
-        if isinstance(payload, dict):
-            mutation = ForgeSubmit.create_from_dict(payload)
-        elif isinstance(payload, ForgeSubmitPayload):
-            mutation = ForgeSubmit(payload=payload)
-        else:
-            raise ValueError(
-                "`payload` must be a valid ForgeSubmitPayload instance or dict"
-            )
-
-        return self.mutate(
-            mutation,
-            variables=mutation.create_payload().model_dump(
-                by_alias=True, exclude_none=True
-            ),
-            **kwargs,
-        )
+        mutation, variables = forge_submit_mutation(payload, json)
+        return self.mutate(mutation, variables=variables, **kwargs)
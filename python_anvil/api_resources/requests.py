@@ -1,7 +1,39 @@
-from typing import Any, Dict
+import os
+from typing import TYPE_CHECKING, Any, Dict
+from urllib.parse import urlsplit
 
+from python_anvil.async_http import AsyncStreamedContent
 from python_anvil.constants import VALID_HOSTS
-from python_anvil.http import HTTPClient
+from python_anvil.exceptions import exception_for_status
+from python_anvil.http import HTTPClient, StreamedContent
+
+
+if TYPE_CHECKING:
+    from python_anvil.async_http import AsyncHTTPClient
+
+
+# Keyword arguments that are passed through to `HTTPClient.request`.
+REQUEST_OPTIONS = (
+    "auth",
+    "idempotent",
+    "timeout",
+    "deadline",
+    "stream",
+    "chunk_size",
+)
+
+_ANVIL_NETLOCS = frozenset(urlsplit(host).netloc for host in VALID_HOSTS)
+
+
+def is_anvil_url(url: str) -> bool:
+    """Check that `url` is an HTTPS URL on one of Anvil's hosts."""
+    parts = urlsplit(url)
+    return parts.scheme == "https" and parts.netloc in _ANVIL_NETLOCS
+
+
+def is_relative_url(url: str) -> bool:
+    parts = urlsplit(url)
+    return not parts.scheme and not parts.netloc
 
 
 class AnvilRequest:
@@ -11,7 +43,7 @@ class AnvilRequest:
     def get_url(self):
         raise NotImplementedError
 
-    def _request(self, method, url, **kwargs):
+    def _full_url(self, method, url) -> str:
         if not self._client:
             raise AssertionError(
                 "Client has not been initialized. Please use the constructors "
@@ -21,9 +53,10 @@ class AnvilRequest:
         if method.upper() not in ["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"]:
             raise ValueError("Invalid HTTP method provided")
 
-        full_url = "/".join([self.get_url(), url]) if len(url) > 0 else self.get_url()
+        return "/".join([self.get_url(), url]) if len(url) > 0 else self.get_url()
 
-        return self._client.request(method, full_url, **kwargs)
+    def _request(self, method, url, **kwargs):
+        return self._client.request(method, self._full_url(method, url), **kwargs)
 
     def handle_error(self, response, status_code, headers):
         extra = None
@@ -35,8 +68,9 @@ class AnvilRequest:
         else:
             message = f"Error: {status_code}: {response} {extra}"
 
-        # pylint: disable=broad-exception-raised
-        raise Exception(message)
+        raise exception_for_status(
+            status_code, message, headers=headers, response=response
+        )
 
     def process_response(self, response, status_code, headers, **kwargs):
         res = response
@@ -63,19 +97,72 @@ class BaseAnvilHttpRequest(AnvilRequest):
     def get_url(self):
         raise NotImplementedError
 
+    @staticmethod
+    def _pop_request_options(kwargs) -> Dict[str, Any]:
+        """Take the options meant for `HTTPClient.request` out of `kwargs`.
+
+        Passing an `output` file or path streams the response into it.
+        """
+        if kwargs.get("output") is not None:
+            kwargs["stream"] = True
+        return {key: kwargs.pop(key) for key in REQUEST_OPTIONS if key in kwargs}
+
+    @staticmethod
+    def _finish_stream(content, status_code, kwargs):
+        """Read a streamed error body, or write a streamed body to `output`."""
+        output = kwargs.pop("output", None)
+        if not isinstance(content, StreamedContent):
+            return content
+        if not 200 <= status_code < 300:
+            return content.read()
+        if output is not None:
+            content.write_to(output)
+            return output
+        return content
+
+    @staticmethod
+    def _pop_download_options(kwargs) -> Dict[str, Any]:
+        """Take the options for a resumable download out of `kwargs`."""
+        output = kwargs.pop("output", None)
+        if not isinstance(output, (str, os.PathLike)):
+            raise ValueError("`resume` requires `output` to be a file path")
+        options = BaseAnvilHttpRequest._pop_request_options(kwargs)
+        options.pop("stream", None)
+        return dict(path=output, sha256=kwargs.pop("sha256", None), **options)
+
     def get(self, url, params=None, **kwargs):
         retry = kwargs.pop("retry", True)
+        if kwargs.pop("resume", False):
+            content, status_code, headers = self._client.download(
+                self._full_url("GET", url),
+                params=params,
+                retry=retry,
+                **self._pop_download_options(kwargs),
+            )
+            return self.process_response(content, status_code, headers, **kwargs)
+
         content, status_code, headers = self._request(
-            "GET", url, params=params, retry=retry
+            "GET",
+            url,
+            params=params,
+            retry=retry,
+            **self._pop_request_options(kwargs),
         )
+        content = self._finish_stream(content, status_code, kwargs)
         return self.process_response(content, status_code, headers, **kwargs)
 
     def post(self, url, data=None, **kwargs):
         retry = kwargs.pop("retry", True)
         params = kwargs.pop("params", None)
         content, status_code, headers = self._request(
-            "POST", url, json=data, retry=retry, params=params
+            "POST",
+            url,
+            json=data,
+            retry=retry,
+            params=params,
+            **self._pop_request_options(kwargs),
         )
+        content = self._finish_stream(content, status_code, kwargs)
         return self.process_response(content, status_code, headers, **kwargs)
 
 
@@ -164,14 +251,26 @@ class PlainRequest(BaseAnvilHttpRequest):
         return f"{self.API_HOST}/{self.API_BASE}"
 
 
-class FullyQualifiedRequest(BaseAnvilHttpRequest):
-    """A request class that validates URLs point to Anvil domains."""
+class UrlRequest(BaseAnvilHttpRequest):
+    """A request to an absolute URL, on any host.
+
+    Pass `auth=NoAuth()` to leave out the API key for hosts other than
+    Anvil's.
+    """
 
     def get_url(self):
         return ""  # Not used since we expect full URLs
 
+    def _full_url(self, method, url) -> str:
+        super()._full_url(method, "")
+        return url
+
+
+class FullyQualifiedRequest(UrlRequest):
+    """A request class that validates URLs point to Anvil domains."""
+
     def _validate_url(self, url):
-        if not any(url.startswith(host) for host in VALID_HOSTS):
+        if not is_anvil_url(url):
             raise ValueError(f"URL must start with one of: {', '.join(VALID_HOSTS)}")
 
     def get(self, url, params=None, **kwargs):
@@ -181,3 +280,93 @@ class FullyQualifiedRequest(BaseAnvilHttpRequest):
     def post(self, url, data=None, **kwargs):
         self._validate_url(url)
         return super().post(url, data, **kwargs)
+
+
+class AsyncRequestMixin:
+    """Make the `get` and `post` methods of a request class coroutines.
+
+    Used with an `AsyncHTTPClient`, e.g. `AsyncRestRequest`.
+    """
+
+    _client: "AsyncHTTPClient"
+
+    async def _request(self, method, url, **kwargs):
+        full_url = self._full_url(method, url)  # type: ignore
+        return await self._client.request(method, full_url, **kwargs)
+
+    @staticmethod
+    async def _finish_stream(content, status_code, kwargs):
+        output = kwargs.pop("output", None)
+        if not isinstance(content, AsyncStreamedContent):
+            return content
+        if not 200 <= status_code < 300:
+            return await content.read()
+        if output is not None:
+            await content.write_to(output)
+            return output
+        return content
+
+    async def get(self, url, params=None, **kwargs):
+        retry = kwargs.pop("retry", True)
+        if kwargs.pop("resume", False):
+            content, status_code, headers = await self._client.download(
+                self._full_url("GET", url),  # type: ignore
+                params=params,
+                retry=retry,
+                **BaseAnvilHttpRequest._pop_download_options(kwargs),
+            )
+            return self.process_response(  # type: ignore
+                content, status_code, headers, **kwargs
+            )
+
+        content, status_code, headers = await self._request(
+            "GET",
+            url,
+            params=params,
+            retry=retry,
+            **BaseAnvilHttpRequest._pop_request_options(kwargs),
+        )
+        content = await self._finish_stream(content, status_code, kwargs)
+        return self.process_response(  # type: ignore
+            content, status_code, headers, **kwargs
+        )
+
+    async def post(self, url, data=None, **kwargs):
+        retry = kwargs.pop("retry", True)
+        params = kwargs.pop("params", None)
+        content, status_code, headers = await self._request(
+            "POST",
+            url,
+            json=data,
+            retry=retry,
+            params=params,
+            **BaseAnvilHttpRequest._pop_request_options(kwargs),
+        )
+        content = await self._finish_stream(content, status_code, kwargs)
+        return self.process_response(  # type: ignore
+            content, status_code, headers, **kwargs
+        )
+
+
+class AsyncRestRequest(AsyncRequestMixin, RestRequest):  # type: ignore
+    pass
+
+
+class AsyncPlainRequest(AsyncRequestMixin, PlainRequest):  # type: ignore
+    pass
+
+
+class AsyncUrlRequest(AsyncRequestMixin, UrlRequest):  # type: ignore
+    pass
+
+
+class AsyncFullyQualifiedRequest(  # type: ignore
+    AsyncRequestMixin, FullyQualifiedRequest
+):
+    async def get(self, url, params=None, **kwargs):
+        self._validate_url(url)
+        return await super().get(url, params, **kwargs)
+
+    async def post(self, url, data=None, **kwargs):
+        self._validate_url(url)
+        return await super().post(url, data, **kwargs)
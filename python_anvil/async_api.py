@@ -0,0 +1,543 @@
+import asyncio
+import logging
+from gql.transport.exceptions import TransportQueryError
+from graphql import DocumentNode
+from typing import (
+    Any,
+    AnyStr,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from .api_resources.mutations import BaseQuery, CreateEtchPacket
+from .api_resources.payload import (
+    CreateEtchPacketPayload,
+    FillPDFPayload,
+    ForgeSubmitPayload,
+    GeneratePDFPayload,
+)
+from .api_resources.requests import (
+    AsyncFullyQualifiedRequest,
+    AsyncPlainRequest,
+    AsyncRestRequest,
+    AsyncUrlRequest,
+    is_anvil_url,
+    is_relative_url,
+)
+from .async_http import AsyncGQLClient, AsyncHTTPClient
+from .batch import AsyncBatch
+from .breaker import CircuitBreaker
+from .bulk import (
+    CAST,
+    ETCH_PACKET,
+    SIGNER,
+    WELD_DATA,
+    BulkField,
+    BulkItem,
+    bulk_queries,
+    bulk_results,
+    query_errors,
+)
+from .casts import LAZY_CAST_FIELDS, Cast, casts_missing
+from .constants import (
+    ANVIL_HOST,
+    DEFAULT_BULK_CHUNK_SIZE,
+    DEFAULT_COMPRESSION_THRESHOLD,
+    DEFAULT_DOWNLOAD_WORKERS,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_TIMEOUT,
+    GRAPHQL_ENDPOINT,
+)
+from .hedge import HedgePolicy
+from .http import NoAuth, Timeout
+from .limiter import BaseLimiter, create_limiter
+from .loader import AsyncLoader
+from .operations import (
+    CURRENT_USER_QUERY,
+    ETCH_PACKET_DOCUMENT_GROUP_QUERY,
+    WELD_QUERY,
+    WELDS_QUERY,
+    cast_query,
+    casts_query,
+    create_etch_packet_mutation,
+    document_file_outputs,
+    document_file_urls,
+    fill_pdf_request,
+    forge_submit_mutation,
+    generate_etch_signing_url_mutation,
+    generate_pdf_request,
+    get_casts_data,
+    get_return,
+    get_welds_data,
+    item_data,
+    make_parent_dir,
+    to_document,
+    update_casts,
+    validation,
+)
+from .retry import RetryPolicy
+from .zipstream import AsyncZipMember, aiter_zip_members
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncAnvil:
+    """asyncio version of the main Anvil API class.
+
+    Every `Anvil` method is available as a coroutine, taking the same
+    arguments and returning the same data. Requires the `httpx` package.
+
+    Usage:
+        >> async with AsyncAnvil(api_key="my_key") as anvil:
+        >>     pdf_data = await anvil.fill_pdf("the_template_id", payload)
+    """
+
+    # Version number to use for latest versions (usually drafts)
+    VERSION_LATEST = -1
+    # Version number to use for the latest published version.
+    # This is the default when a version is not provided.
+    VERSION_LATEST_PUBLISHED = -2
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        environment="dev",
+        endpoint_url=None,
+        limiter: Optional[BaseLimiter] = None,
+        limiter_backend: str = "memory",
+        limiter_path: Optional[str] = None,
+        adaptive_rate_limit: bool = False,
+        retry_policy: Optional[RetryPolicy] = None,
+        pool_maxsize: int = DEFAULT_POOL_SIZE,
+        keep_alive: bool = True,
+        timeout: Timeout = DEFAULT_TIMEOUT,
+        http2: bool = False,
+        compression: Optional[str] = None,
+        compression_threshold: int = DEFAULT_COMPRESSION_THRESHOLD,
+        hedge_policy: Optional[HedgePolicy] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        validate_queries: bool = True,
+        coalesce_window: Optional[float] = None,
+    ):
+        if not api_key:
+            raise ValueError('`api_key` must be a valid string')
+
+        self._owns_limiter = not limiter
+        if not limiter:
+            limiter = create_limiter(
+                limiter_backend,
+                environment=environment,
+                api_key=api_key,
+                path=limiter_path,
+                adaptive=adaptive_rate_limit,
+            )
+
+        self.client = AsyncHTTPClient(
+            api_key=api_key,
+            environment=environment,
+            limiter=limiter,
+            retry_policy=retry_policy,
+            pool_maxsize=pool_maxsize,
+            keep_alive=keep_alive,
+            timeout=timeout,
+            http2=http2,
+            compression=compression,
+            compression_threshold=compression_threshold,
+            hedge_policy=hedge_policy,
+            circuit_breaker=circuit_breaker,
+        )
+        self.endpoint_url = endpoint_url or GRAPHQL_ENDPOINT
+        self.gql_client = AsyncGQLClient.get_client(
+            http_client=self.client,
+            endpoint_url=endpoint_url,
+            validate_queries=validate_queries,
+        )
+        self.loader: Optional[AsyncLoader] = None
+        if coalesce_window is not None:
+            self.loader = AsyncLoader(self._load_batch, window=coalesce_window)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        """Close pooled connections and release the client's resources."""
+        await self.client.close()
+        if self._owns_limiter:
+            self.client.limiter.close()
+
+    async def warmup(self):
+        """Open connections to the REST and GraphQL hosts ahead of time."""
+        await self.client.warmup([ANVIL_HOST, self.endpoint_url])
+
+    def estimated_wait(self) -> float:
+        """Estimate how long a new request would currently wait to be sent."""
+        return self.client.estimated_wait()
+
+    def batch(self, **kwargs) -> AsyncBatch:
+        """Queue GraphQL operations, and send them together.
+
+        Usage:
+            >> async with anvil.batch() as b:
+            >>     cast = b.get_cast(cast_eid)
+            >>     user = b.get_current_user()
+            >> print((await cast)["title"])
+
+        The futures are `asyncio.Future`s, so they can be awaited. See
+        `Anvil.batch`.
+        """
+        return AsyncBatch(self, **kwargs)
+
+    async def query(
+        self,
+        query: Union[str, DocumentNode],
+        variables: Optional[Dict[str, Any]] = None,
+        validate: bool = True,
+        **kwargs,
+    ):
+        """Execute a GraphQL query."""
+        kwargs.pop("debug", None)
+        with validation(validate):
+            return await self.gql_client.execute_async(
+                to_document(query), variable_values=variables, **kwargs
+            )
+
+    async def mutate(
+        self,
+        query: Union[str, BaseQuery],
+        variables: Dict[str, Any],
+        validate: bool = True,
+        **kwargs,
+    ) -> Dict[str, Any]:
+        """Execute a GraphQL mutation.
+
+        Files in `variables` are sent with the multipart spec, like
+        `Anvil.mutate`.
+        """
+        kwargs.pop("debug", None)
+        with validation(validate):
+            return await self.gql_client.execute_async(
+                to_document(query), variable_values=variables, **kwargs
+            )
+
+    def request_rest(self, options: Optional[dict] = None):
+        return AsyncRestRequest(self.client, options=options)
+
+    def request_fully_qualified(self, options: Optional[dict] = None):
+        return AsyncFullyQualifiedRequest(self.client, options=options)
+
+    async def fill_pdf(
+        self, template_id: str, payload: Union[dict, AnyStr, FillPDFPayload], **kwargs
+    ):
+        """Fill an existing template with provided payload data."""
+        path, data = fill_pdf_request(template_id, payload, kwargs)
+        api = AsyncRestRequest(client=self.client)
+        return await api.post(path, data, **kwargs)
+
+    async def generate_pdf(
+        self, payload: Union[AnyStr, Dict, GeneratePDFPayload], **kwargs
+    ):
+        data = generate_pdf_request(payload, kwargs)
+        api = AsyncRestRequest(client=self.client)
+        return await api.post("generate-pdf", data=data, **kwargs)
+
+    async def get_cast(
+        self,
+        eid: str,
+        fields: Optional[List[str]] = None,
+        version_number: Optional[int] = None,
+        cast_args: Optional[List[Tuple[str, str]]] = None,
+        **kwargs,
+    ) -> Dict[str, Any]:
+        if self.loader is not None and not cast_args and not kwargs:
+            return await self._get_one(
+                CAST, eid, fields, dict(versionNumber=version_number)
+            )
+        res = await self.query(
+            cast_query(eid, fields, version_number, cast_args), **kwargs
+        )
+        return get_return(res, get_data=lambda r: r["cast"])
+
+    async def get_casts(
+        self, fields: Optional[List[str]] = None, show_all: bool = False, **kwargs
+    ) -> List[Dict[str, Any]]:
+        """Retrieve all Cast objects for the current user across all organizations.
+
+        Fields left out by default, like `fieldInfo`, can't be fetched on
+        access. Fetch them with `load_cast_fields`.
+        """
+        res = await self.query(casts_query(fields, show_all), **kwargs)
+        return get_return(res, get_data=lambda r: [Cast(c) for c in get_casts_data(r)])
+
+    async def load_cast_fields(
+        self,
+        casts: Iterable[Cast],
+        fields: Iterable[str] = LAZY_CAST_FIELDS,
+        chunk_size: int = DEFAULT_BULK_CHUNK_SIZE,
+        **kwargs,
+    ) -> Dict[str, BulkItem]:
+        """Fetch fields left out of `get_casts` results.
+
+        See `Anvil.load_cast_fields`.
+        """
+        fields = list(fields)
+        missing = casts_missing(casts, fields)
+        results = await self.get_casts_by_eid(
+            [cast["eid"] for cast in missing],
+            fields=["eid", *fields],
+            chunk_size=chunk_size,
+            **kwargs,
+        )
+        update_casts(missing, fields, results)
+        return results
+
+    async def get_casts_by_eid(
+        self,
+        eids: Iterable[str],
+        fields: Optional[List[str]] = None,
+        version_number: Optional[int] = None,
+        chunk_size: int = DEFAULT_BULK_CHUNK_SIZE,
+        **kwargs,
+    ) -> Dict[str, BulkItem]:
+        """Retrieve many Cast objects by eid. See `Anvil.get_casts_by_eid`."""
+        return await self._get_by_eid(
+            CAST,
+            eids,
+            fields,
+            dict(versionNumber=version_number),
+            chunk_size,
+            **kwargs,
+        )
+
+    async def get_etch_packets(
+        self,
+        eids: Iterable[str],
+        fields: Optional[List[str]] = None,
+        chunk_size: int = DEFAULT_BULK_CHUNK_SIZE,
+        **kwargs,
+    ) -> Dict[str, BulkItem]:
+        """Retrieve many Etch packets by eid."""
+        return await self._get_by_eid(
+            ETCH_PACKET, eids, fields, None, chunk_size, **kwargs
+        )
+
+    async def get_signers(
+        self,
+        eids: Iterable[str],
+        fields: Optional[List[str]] = None,
+        chunk_size: int = DEFAULT_BULK_CHUNK_SIZE,
+        **kwargs,
+    ) -> Dict[str, BulkItem]:
+        """Retrieve many signers by eid."""
+        return await self._get_by_eid(SIGNER, eids, fields, None, chunk_size, **kwargs)
+
+    async def get_weld_datas(
+        self,
+        eids: Iterable[str],
+        fields: Optional[List[str]] = None,
+        chunk_size: int = DEFAULT_BULK_CHUNK_SIZE,
+        **kwargs,
+    ) -> Dict[str, BulkItem]:
+        """Retrieve many WeldData objects by eid."""
+        return await self._get_by_eid(
+            WELD_DATA, eids, fields, None, chunk_size, **kwargs
+        )
+
+    async def get_etch_packet(
+        self, eid: str, fields: Optional[List[str]] = None, **kwargs
+    ) -> Optional[Dict[str, Any]]:
+        """Retrieve an Etch packet. See `Anvil.get_signer`."""
+        return await self._get_one(ETCH_PACKET, eid, fields, None, **kwargs)
+
+    async def get_signer(
+        self, eid: str, fields: Optional[List[str]] = None, **kwargs
+    ) -> Optional[Dict[str, Any]]:
+        """Retrieve a signer.
+
+        With `coalesce_window`, lookups made by other tasks within that
+        window are sent together. See `Anvil.get_signer`.
+        """
+        return await self._get_one(SIGNER, eid, fields, None, **kwargs)
+
+    async def get_weld_data(
+        self, eid: str, fields: Optional[List[str]] = None, **kwargs
+    ) -> Optional[Dict[str, Any]]:
+        """Retrieve a WeldData object. See `Anvil.get_signer`."""
+        return await self._get_one(WELD_DATA, eid, fields, None, **kwargs)
+
+    async def _get_one(
+        self,
+        field: BulkField,
+        eid: str,
+        fields: Optional[List[str]],
+        arguments: Optional[Dict[str, Any]],
+        **kwargs,
+    ) -> Optional[Dict[str, Any]]:
+        if self.loader is not None and not kwargs:
+            item = await self.loader.load(field, eid, fields, arguments)
+        else:
+            results = await self._get_by_eid(
+                field, [eid], fields, arguments, 1, **kwargs
+            )
+            item = results[eid]
+        return item_data(item)
+
+    async def _load_batch(
+        self,
+        field: BulkField,
+        eids: List[str],
+        fields: Optional[List[str]],
+        arguments: Dict[str, Any],
+    ) -> Dict[str, BulkItem]:
+        return await self._get_by_eid(field, eids, fields, arguments, len(eids))
+
+    async def _get_by_eid(
+        self,
+        field: BulkField,
+        eids: Iterable[str],
+        fields: Optional[List[str]],
+        arguments: Optional[Dict[str, Any]],
+        chunk_size: int,
+        **kwargs,
+    ) -> Dict[str, BulkItem]:
+        results: Dict[str, BulkItem] = {}
+        for document, variables, chunk in bulk_queries(
+            field, eids, fields, arguments, chunk_size
+        ):
+            try:
+                data = await self.query(document, variables=variables, **kwargs)
+                errors = None
+            except TransportQueryError as e:
+                data, errors = query_errors(e)
+            results.update(bulk_results(chunk, data, errors))
+        return results
+
+    async def get_current_user(self, **kwargs):
+        """Retrieve current user data."""
+        res = await self.query(CURRENT_USER_QUERY, **kwargs)
+        return get_return(res, get_data=lambda r: r["currentUser"])
+
+    async def get_welds(self, **kwargs) -> Union[List, Tuple[List, Dict]]:
+        res = await self.query(WELDS_QUERY, **kwargs)
+        return get_return(res, get_data=get_welds_data)
+
+    async def get_weld(self, eid: str, **kwargs):
+        res = await self.query(WELD_QUERY, variables=dict(eid=eid), **kwargs)
+        return get_return(res, get_data=lambda r: r["weld"])
+
+    async def create_etch_packet(
+        self,
+        payload: Optional[
+            Union[
+                dict,
+                CreateEtchPacketPayload,
+                CreateEtchPacket,
+                AnyStr,
+            ]
+        ] = None,
+        json=None,
+        **kwargs,
+    ):
+        """Create etch packet via a graphql mutation."""
+        mutation, variables = create_etch_packet_mutation(payload, json)
+        return await self.mutate(
+            mutation, variables=variables, upload_files=True, **kwargs
+        )
+
+    async def generate_etch_signing_url(
+        self, signer_eid: str, client_user_id: str, **kwargs
+    ):
+        """Generate a signing URL for a given user."""
+        mutation, variables = generate_etch_signing_url_mutation(
+            signer_eid, client_user_id
+        )
+        return await self.mutate(mutation, variables=variables, **kwargs)
+
+    async def download_documents(self, document_group_eid: str, **kwargs):
+        """Retrieve all completed documents in zip form."""
+        api = AsyncPlainRequest(client=self.client)
+        return await api.get(f"document-group/{document_group_eid}.zip", **kwargs)
+
+    async def extract_documents(
+        self, document_group_eid: str, **kwargs
+    ) -> AsyncIterator[Tuple[str, AsyncZipMember]]:
+        """Yield each completed document while the zip is still downloading.
+
+        Like `Anvil.extract_documents`, but used with `async for`.
+        """
+        kwargs.pop("output", None)
+        kwargs.pop("resume", None)
+        content = await self.download_documents(
+            document_group_eid, stream=True, **kwargs
+        )
+        async with content:
+            async for member in aiter_zip_members(content):
+                if not member.name.endswith("/"):
+                    yield member.name, member
+
+    async def get_etch_packet_document_group(
+        self, etch_packet_eid: str, **kwargs
+    ) -> Dict[str, Any]:
+        """Retrieve the document group of an Etch packet, with its file listing."""
+        res = await self.query(
+            ETCH_PACKET_DOCUMENT_GROUP_QUERY,
+            variables=dict(eid=etch_packet_eid),
+            **kwargs,
+        )
+        return get_return(res, get_data=lambda r: r["etchPacket"]["documentGroup"])
+
+    async def download_document_files(
+        self,
+        document_group: Union[str, Dict[str, Any]],
+        filenames: Optional[List[str]] = None,
+        output_dir: Optional[str] = None,
+        max_workers: int = DEFAULT_DOWNLOAD_WORKERS,
+        **kwargs,
+    ) -> Dict[str, Any]:
+        """Download some of the files of a document group, concurrently.
+
+        See `Anvil.download_document_files`.
+        """
+        urls = document_file_urls(document_group, filenames)
+        outputs = document_file_outputs(output_dir, list(urls))
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def download(name, url):
+            async with semaphore:
+                options = dict(kwargs, output=outputs[name])
+                make_parent_dir(options["output"])
+                if is_relative_url(url):
+                    api = AsyncPlainRequest(client=self.client)
+                else:
+                    if not is_anvil_url(url):
+                        # The API key is only sent to Anvil.
+                        options["auth"] = NoAuth()
+                    api = AsyncUrlRequest(self.client)
+                return await api.get(url, **options)
+
+        tasks = [asyncio.ensure_future(download(*item)) for item in urls.items()]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        return dict(zip(urls, results))
+
+    async def forge_submit(
+        self,
+        payload: Optional[Union[Dict[str, Any], ForgeSubmitPayload]] = None,
+        json=None,
+        **kwargs,
+    ) -> Dict[str, Any]:
+        """Create a Webform (forge) submission via a graphql mutation."""
+        mutation, variables = forge_submit_mutation(payload, json)
+        return await self.mutate(mutation, variables=variables, **kwargs)
@@ -0,0 +1,627 @@
+"""asyncio HTTP and GraphQL clients, used by `AsyncAnvil`.
+
+These require the optional `httpx` package.
+"""
+
+import asyncio
+import os
+from gql import Client
+from graphql import DocumentNode, ExecutionResult
+from logging import getLogger
+from time import monotonic
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Union
+
+from python_anvil.exceptions import (
+    AnvilConnectionError,
+    AnvilDownloadError,
+    AnvilRateLimitException,
+    AnvilRequestException,
+    AnvilTimeoutError,
+)
+
+from .breaker import CircuitBreaker
+from .constants import (
+    ANVIL_HOST,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_COMPRESSION_THRESHOLD,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_TIMEOUT,
+    GRAPHQL_ENDPOINT,
+    IDEMPOTENT_METHODS,
+    RETRIES_LIMIT,
+)
+from .download import ERROR, WRITE, ResumableDownload
+from .gql_transport import is_query
+from .hedge import HedgePolicy, should_hedge
+from .http import (
+    Output,
+    Timeout,
+    _cap_timeout,
+    _compress_body,
+    _open_output,
+    get_compressor,
+    parse_retry_after,
+)
+from .limiter import BaseLimiter, create_limiter
+from .query_cache import print_query
+from .retry import RetryPolicy
+from .schema import DEFAULT_INTROSPECTION_TTL, create_client
+
+
+try:
+    import httpx
+    from gql.transport.httpx import HTTPXAsyncTransport
+except ImportError:  # pragma: no cover
+    httpx = None  # type: ignore
+    HTTPXAsyncTransport = object  # type: ignore
+
+
+logger = getLogger(__name__)
+
+
+def _require_httpx():
+    if httpx is None:
+        raise ImportError(
+            "The async client requires the `httpx` package. "
+            "Install it with `pip install python-anvil[async]`."
+        )
+
+
+def _httpx_timeout(timeout: Timeout) -> "httpx.Timeout":
+    """Convert a `requests` style timeout into an `httpx.Timeout`."""
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
+
+
+def _wrap_request_error(e: Exception) -> AnvilRequestException:
+    """Convert an `httpx` exception into a typed Anvil exception."""
+    if isinstance(e, httpx.TimeoutException):
+        return AnvilTimeoutError(f"Request timed out: {e}")
+    return AnvilConnectionError(f"Connection failed: {e}")
+
+
+def _request_not_sent(e: Exception) -> bool:
+    """Check whether a failed request is known to never have reached the server."""
+    return isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+
+class AsyncHTTPClient:
+    """asyncio version of `HTTPClient`, built on `httpx.AsyncClient`.
+
+    Requests share the same rate limiter, retry policy, timeout and deadline
+    handling as `HTTPClient`. The rate limiter is waited on without blocking
+    the event loop.
+    """
+
+    def __init__(
+        self,
+        api_key=None,
+        environment="dev",
+        limiter: Optional[BaseLimiter] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        pool_maxsize: int = DEFAULT_POOL_SIZE,
+        keep_alive: bool = True,
+        timeout: Timeout = DEFAULT_TIMEOUT,
+        http2: bool = False,
+        compression: Optional[str] = None,
+        compression_threshold: int = DEFAULT_COMPRESSION_THRESHOLD,
+        hedge_policy: Optional[HedgePolicy] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+    ):
+        """Create an async HTTP client.
+
+        :param pool_maxsize: Maximum number of open connections.
+        :param keep_alive: Whether to reuse connections between requests.
+        :param timeout: Default timeout in seconds for each request, either a
+            number or a `(connect, read)` tuple. `None` waits forever.
+        :param http2: Use HTTP/2, so that concurrent requests share a few
+            multiplexed connections. Requires the `h2` package.
+        :param compression: Compress JSON request bodies with `gzip` or
+            `zstd`. See `HTTPClient`.
+        :param compression_threshold: Minimum size in bytes of a request body
+            to compress.
+        :param hedge_policy: Send a second copy of slow reads. See
+            `HedgePolicy`.
+        :param circuit_breaker: Fail fast while an endpoint keeps failing.
+            See `CircuitBreaker`.
+        """
+        _require_httpx()
+        if compression is not None:
+            get_compressor(compression)
+        self.api_key = api_key
+        self._session = httpx.AsyncClient(
+            http2=http2,
+            auth=httpx.BasicAuth(api_key, "") if api_key else None,
+            limits=httpx.Limits(
+                max_connections=pool_maxsize,
+                max_keepalive_connections=pool_maxsize if keep_alive else 0,
+            ),
+        )
+        self.limiter = limiter or create_limiter(environment=environment)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.timeout = timeout
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self.hedge_policy = hedge_policy
+        self.circuit_breaker = circuit_breaker
+
+    async def close(self):
+        """Close all pooled connections."""
+        await self._session.aclose()
+
+    async def warmup(self, urls: Iterable[str] = (ANVIL_HOST, GRAPHQL_ENDPOINT)):
+        """Open a connection to each of `urls` ahead of the first real request."""
+
+        async def _warmup(url):
+            try:
+                await self.do_request("HEAD", url, retry=False)
+            except AnvilRequestException as e:
+                logger.warning("Unable to warm up connection to %s: %s", url, e)
+
+        await asyncio.gather(*(_warmup(url) for url in urls))
+
+    def estimated_wait(self) -> float:
+        """Estimate how long a new request would wait for the rate limiter."""
+        return self.limiter.estimated_wait()
+
+    async def _send(self, req: "httpx.Request", hedge: bool, **kwargs):
+        """Send one attempt of a request, hedging it if it is slow."""
+        policy = self.hedge_policy
+        if not policy or not hedge:
+            return await self._session.send(req, **kwargs)
+
+        policy.budget.record_request()
+        started = monotonic()
+        pending = {asyncio.ensure_future(self._session.send(req, **kwargs))}
+        done, _ = await asyncio.wait(pending, timeout=policy.delay())
+        if (
+            not done
+            and policy.budget.try_spend()
+            and await self.limiter.acquire_async(timeout=0)
+        ):
+            logger.debug("Request is slow, sending a hedged copy.")
+            pending.add(asyncio.ensure_future(self._session.send(req, **kwargs)))
+
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        policy.record(monotonic() - started)
+                        return task.result()
+                    error = error or task.exception()
+            raise error  # type: ignore
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def do_request(
+        self,
+        method,
+        url,
+        headers=None,
+        data=None,
+        auth=None,
+        params=None,
+        retry=True,
+        files=None,
+        idempotent: Optional[bool] = None,
+        timeout: Timeout = DEFAULT_TIMEOUT,
+        deadline: Optional[float] = None,
+        hedge: Optional[bool] = None,
+        **kwargs,
+    ) -> "httpx.Response":
+        """Send a request, waiting for the rate limiter and retrying failures.
+
+        Takes the same options as `HTTPClient.do_request`.
+        """
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.timeout
+        stream = kwargs.pop("stream", False)
+        hedge = should_hedge(method, hedge) and not stream
+
+        deadline_at = None if deadline is None else monotonic() + deadline
+
+        def remaining() -> Optional[float]:
+            if deadline_at is None:
+                return None
+            return deadline_at - monotonic()
+
+        def out_of_time(wait: float = 0) -> bool:
+            left = remaining()
+            return left is not None and wait >= left
+
+        policy = self.retry_policy
+        policy.budget.record_request()
+        attempt = 0
+        rate_limited = 0
+
+        uncompressed = None
+        if self.compression and not files:
+            compressed = _compress_body(
+                self.compression, self.compression_threshold, headers, data, kwargs
+            )
+            if compressed:
+                uncompressed = (data, headers, kwargs.pop("json", None))
+                kwargs["content"], headers = compressed
+                data = None
+
+        breaker = self.circuit_breaker
+        while True:
+            ticket = breaker.before_request(url) if breaker else None
+            if out_of_time() or not await self.limiter.acquire_async(
+                timeout=remaining()
+            ):
+                if ticket:
+                    breaker.cancel(ticket)  # type: ignore
+                raise AnvilTimeoutError(
+                    f"Deadline of {deadline:g} seconds exceeded before the "
+                    "request could be sent."
+                )
+            started = monotonic()
+            try:
+                req = self._session.build_request(
+                    method,
+                    url,
+                    headers=headers,
+                    data=data,
+                    params=params,
+                    files=files,
+                    timeout=_httpx_timeout(_cap_timeout(timeout, remaining())),
+                    **kwargs,
+                )
+                res = await self._send(
+                    req,
+                    hedge,
+                    stream=stream,
+                    auth=auth if auth is not None else httpx.USE_CLIENT_DEFAULT,
+                )
+            except httpx.TransportError as e:
+                if ticket:
+                    breaker.record(ticket, monotonic() - started)  # type: ignore
+                error = _wrap_request_error(e)
+                if (
+                    retry
+                    and (idempotent or _request_not_sent(e))
+                    and policy.should_retry(attempt)
+                ):
+                    wait = policy.backoff(attempt)
+                    if not out_of_time(wait):
+                        attempt += 1
+                        logger.warning(
+                            "Request failed (%s). Retrying in %.2f seconds.", e, wait
+                        )
+                        await asyncio.sleep(wait)
+                        continue
+                raise error from e
+            except BaseException:
+                # Don't hold on to a half-open probe that never completed.
+                if ticket:
+                    breaker.cancel(ticket)  # type: ignore
+                raise
+
+            if ticket:
+                breaker.record(  # type: ignore
+                    ticket, monotonic() - started, res.status_code
+                )
+            self.limiter.observe(res.status_code, res.headers)
+
+            if res.status_code == 415 and uncompressed:
+                logger.warning(
+                    "Server rejected the %s request body, sending it uncompressed.",
+                    self.compression,
+                )
+                data, headers, kwargs["json"] = uncompressed
+                del kwargs["content"]
+                uncompressed = None
+                await res.aclose()
+                continue
+
+            if res.status_code == 429:
+                time_to_wait = parse_retry_after(res.headers.get("Retry-After"))
+                rate_limited += 1
+                if not retry or out_of_time(time_to_wait):
+                    await res.aclose()
+                    raise AnvilRateLimitException(
+                        f"Rate limit exceeded. Retry after {time_to_wait:g} seconds.",
+                        retry_after=time_to_wait,
+                        headers=res.headers,
+                    )
+
+                logger.warning(
+                    "Rate-limited: request not accepted. Retrying in %g second%s.",
+                    time_to_wait,
+                    's' if time_to_wait != 1 else '',
+                )
+                await self.limiter.pause_async(time_to_wait)
+
+                if rate_limited < RETRIES_LIMIT:
+                    await res.aclose()
+                    continue
+
+            elif (
+                retry
+                and idempotent
+                and res.status_code in policy.retry_statuses
+                and policy.should_retry(attempt)
+            ):
+                wait = policy.backoff(attempt)
+                if "Retry-After" in res.headers:
+                    wait = max(wait, parse_retry_after(res.headers["Retry-After"]))
+                if not out_of_time(wait):
+                    attempt += 1
+                    logger.warning(
+                        "Request failed with status %i. Retrying in %.2f seconds.",
+                        res.status_code,
+                        wait,
+                    )
+                    await res.aclose()
+                    await asyncio.sleep(wait)
+                    continue
+
+            return res
+
+    async def request(
+        self,
+        method,
+        url,
+        headers=None,
+        data=None,
+        auth=None,
+        params=None,
+        retry=True,
+        files=None,
+        **kwargs,
+    ):
+        """Make an HTTP request.
+
+        :return: A `(content, status_code, headers)` tuple, like
+            `HTTPClient.request`. With `stream=True`, the content is an
+            `AsyncStreamedContent`.
+        """
+        parse_json = kwargs.pop("parse_json", False)
+        chunk_size = kwargs.pop("chunk_size", DEFAULT_CHUNK_SIZE)
+        res = await self.do_request(
+            method,
+            url,
+            headers=headers,
+            data=data,
+            auth=auth,
+            params=params,
+            retry=retry,
+            files=files,
+            **kwargs,
+        )
+
+        if kwargs.get("stream"):
+            content = AsyncStreamedContent(res, chunk_size=chunk_size)
+        elif parse_json and res.headers.get("Content-Type") == "application/json":
+            content = res.json()
+        else:
+            content = res.content
+
+        return content, res.status_code, res.headers
+
+    async def download(
+        self,
+        url,
+        path: Union[str, "os.PathLike[str]"],
+        sha256: Optional[str] = None,
+        headers=None,
+        retry=True,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        deadline: Optional[float] = None,
+        **kwargs,
+    ):
+        """Download `url` to `path`, resuming where it left off after failures.
+
+        See `HTTPClient.download`.
+        """
+        download = ResumableDownload(path, sha256=sha256)
+        deadline_at = None if deadline is None else monotonic() + deadline
+        policy = self.retry_policy
+        attempt = 0
+
+        while True:
+            offset = download.offset
+            res = await self.do_request(
+                "GET",
+                url,
+                headers={**(headers or {}), **download.request_headers()},
+                retry=retry,
+                stream=True,
+                deadline=None if deadline_at is None else deadline_at - monotonic(),
+                **kwargs,
+            )
+            try:
+                try:
+                    action = download.start(res.status_code, res.headers)
+                    if action == ERROR:
+                        return await res.aread(), res.status_code, res.headers
+                    if action == WRITE:
+                        async for chunk in res.aiter_bytes(chunk_size):
+                            download.write(chunk)
+                finally:
+                    await res.aclose()
+                return download.finish(), res.status_code, res.headers
+            except (httpx.TransportError, AnvilDownloadError) as e:
+                download.close()
+                if download.offset > offset:
+                    attempt = 0
+                error = (
+                    e if isinstance(e, AnvilDownloadError) else _wrap_request_error(e)
+                )
+                wait = policy.backoff(attempt)
+                if (
+                    not retry
+                    or (deadline_at is not None and monotonic() + wait >= deadline_at)
+                    or not policy.should_retry(attempt)
+                ):
+                    raise error from e
+                attempt += 1
+                logger.warning(
+                    "Download interrupted at %i bytes (%s). Resuming in %.2f seconds.",
+                    download.offset,
+                    e,
+                    wait,
+                )
+                await asyncio.sleep(wait)
+
+
+class AsyncStreamedContent:
+    """Body of a streamed response, like `StreamedContent` but read with `async for`.
+
+    Usage:
+        >> async with await anvil.download_documents(eid, stream=True) as content:
+        >>     async for chunk in content:
+        >>         await upload_part(chunk)
+    """
+
+    def __init__(
+        self, response: "httpx.Response", chunk_size: int = DEFAULT_CHUNK_SIZE
+    ):
+        self.response = response
+        self.chunk_size = chunk_size
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in self.response.aiter_bytes(self.chunk_size):
+                yield chunk
+        finally:
+            await self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def read(self) -> bytes:
+        """Read the whole body into memory."""
+        return b"".join([chunk async for chunk in self])
+
+    async def write_to(self, output: Output) -> int:
+        """Write the body to a file path or a binary file object.
+
+        :return: The number of bytes written.
+        """
+        written = 0
+        with _open_output(output) as file:
+            async for chunk in self:
+                file.write(chunk)
+                written += len(chunk)
+        return written
+
+    async def close(self):
+        await self.response.aclose()
+
+
+class _AsyncHTTPClientSession:
+    """Minimal `httpx.AsyncClient` stand-in that sends through an `AsyncHTTPClient`."""
+
+    def __init__(self, client: AsyncHTTPClient):
+        self.client = client
+
+    async def post(self, url, **kwargs) -> "httpx.Response":
+        return await self.client.do_request("POST", url, **kwargs)
+
+
+class AsyncHTTPClientTransport(HTTPXAsyncTransport):  # type: ignore
+    """gql async transport that sends GraphQL requests through an `AsyncHTTPClient`."""
+
+    def __init__(self, http_client: AsyncHTTPClient, url: str, **kwargs):
+        super().__init__(url=url, **kwargs)
+        self.http_client = http_client
+        self.client = _AsyncHTTPClientSession(http_client)
+
+    async def connect(self):
+        # `Client.execute_async` connects and closes the transport around
+        # every request, including concurrent ones. The session only wraps
+        # the long-lived `AsyncHTTPClient`, so it stays open throughout.
+        pass
+
+    async def close(self):
+        # The connection pool belongs to the `AsyncHTTPClient`.
+        pass
+
+    async def execute(  # type: ignore
+        self,
+        document: DocumentNode,
+        variable_values: Optional[Dict[str, Any]] = None,
+        operation_name: Optional[str] = None,
+        extra_args: Optional[Dict[str, Any]] = None,
+        upload_files: bool = False,
+        timeout: Timeout = DEFAULT_TIMEOUT,
+        deadline: Optional[float] = None,
+    ) -> ExecutionResult:
+        query = is_query(document, operation_name)
+        extra_args = {"idempotent": query, "hedge": query, **(extra_args or {})}
+        if timeout is not DEFAULT_TIMEOUT:
+            extra_args["timeout"] = timeout
+        if deadline is not None:
+            extra_args["deadline"] = deadline
+        return await super().execute(
+            document,
+            variable_values=variable_values,
+            operation_name=operation_name,
+            extra_args=extra_args,
+            upload_files=upload_files,
+        )
+
+    def _prepare_request(
+        self,
+        document: DocumentNode,
+        variable_values: Optional[Dict[str, Any]] = None,
+        operation_name: Optional[str] = None,
+        extra_args: Optional[Dict[str, Any]] = None,
+        upload_files: bool = False,
+    ) -> Dict[str, Any]:
+        # Like `HTTPXAsyncTransport._prepare_request`, but with the query
+        # from `print_query`. See `HTTPClientTransport.execute`.
+        payload: Dict[str, Any] = {"query": print_query(document)}
+        if operation_name:
+            payload["operationName"] = operation_name
+
+        if upload_files:
+            post_args = self._prepare_file_uploads(variable_values, payload)
+        else:
+            if variable_values:
+                payload["variables"] = variable_values
+            post_args = {"json": payload}
+
+        post_args.update(extra_args or {})
+        return post_args
+
+
+class AsyncGQLClient:
+    """Async GraphQL client factory class."""
+
+    @staticmethod
+    def get_client(
+        http_client: AsyncHTTPClient,
+        endpoint_url: Optional[str] = None,
+        fetch_schema_from_transport: bool = False,
+        force_local_schema: bool = False,
+        introspection_ttl: float = DEFAULT_INTROSPECTION_TTL,
+        validate_queries: bool = True,
+    ) -> Client:
+        endpoint_url = endpoint_url or GRAPHQL_ENDPOINT
+        transport = AsyncHTTPClientTransport(http_client, url=endpoint_url)
+
+        return create_client(
+            transport,
+            url=endpoint_url,
+            fetch_schema_from_transport=fetch_schema_from_transport,
+            force_local_schema=force_local_schema,
+            introspection_ttl=introspection_ttl,
+            validate_queries=validate_queries,
+            # Timeouts and deadlines are handled by the `AsyncHTTPClient`.
+            execute_timeout=None,
+        )
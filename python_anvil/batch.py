@@ -0,0 +1,555 @@
+"""Send several GraphQL operations as one request."""
+
+import asyncio
+from concurrent.futures import Future
+from gql.transport.exceptions import TransportQueryError
+from graphql import (
+    DocumentNode,
+    FieldNode,
+    FragmentDefinitionNode,
+    FragmentSpreadNode,
+    NameNode,
+    Node,
+    OperationDefinitionNode,
+    OperationType,
+    SelectionSetNode,
+    VariableNode,
+    Visitor,
+    visit,
+)
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AnyStr,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+from .api_resources.mutations import BaseQuery, CreateEtchPacket
+from .api_resources.payload import CreateEtchPacketPayload, ForgeSubmitPayload
+from .bulk import (
+    ETCH_PACKET,
+    SIGNER,
+    WELD_DATA,
+    BulkField,
+    bulk_query,
+)
+from .casts import Cast, CastLoader
+from .exceptions import graphql_error_message
+from .operations import (
+    CURRENT_USER_QUERY,
+    ETCH_PACKET_DOCUMENT_GROUP_QUERY,
+    WELD_QUERY,
+    WELDS_QUERY,
+    cast_query,
+    casts_query,
+    create_etch_packet_mutation,
+    forge_submit_mutation,
+    generate_etch_signing_url_mutation,
+    get_casts_data,
+    get_welds_data,
+    to_document,
+)
+
+
+if TYPE_CHECKING:
+    from .api import Anvil
+    from .async_api import AsyncAnvil  # pylint: disable=cyclic-import
+
+
+# Name of the merged operations.
+BATCH_OPERATION = "Batch"
+
+_Transform = Callable[[Dict[str, Any]], Any]
+_N = TypeVar("_N", bound=Node)
+
+
+def _replace(node: _N, **changes: Any) -> _N:
+    """Copy an AST node with some of its attributes changed.
+
+    Depending on the graphql-core version, nodes are either frozen
+    dataclasses or `__slots__` classes, so they're rebuilt from `keys`.
+    """
+    attributes = {key: getattr(node, key) for key in node.keys}
+    attributes.update(changes)
+    return node.__class__(**attributes)
+
+
+class _Renamer(Visitor):
+    """Prefix the variables and fragments of one queued operation."""
+
+    def __init__(self, prefix: str):
+        super().__init__()
+        self.prefix = prefix
+
+    def _name(self, node: NameNode) -> NameNode:
+        return NameNode(value=self.prefix + node.value)
+
+    def leave_variable(self, node: VariableNode, *_):
+        return VariableNode(name=self._name(node.name))
+
+    def leave_fragment_spread(self, node: FragmentSpreadNode, *_):
+        return _replace(node, name=self._name(node.name))
+
+    def leave_fragment_definition(self, node: FragmentDefinitionNode, *_):
+        return _replace(node, name=self._name(node.name))
+
+
+def _operation(
+    document: DocumentNode, operation_name: Optional[str]
+) -> OperationDefinitionNode:
+    operations = [
+        d
+        for d in document.definitions
+        if isinstance(d, OperationDefinitionNode)
+        and (not operation_name or (d.name and d.name.value == operation_name))
+    ]
+    if len(operations) != 1:
+        raise ValueError(
+            "Batched documents need exactly one operation, or `operation_name`"
+        )
+    operation = operations[0]
+    if operation.operation == OperationType.SUBSCRIPTION:
+        raise ValueError("Subscriptions can't be batched")
+    if operation.directives:
+        raise ValueError("Operations with directives can't be batched")
+    return operation
+
+
+def _used_fragments(
+    operation: OperationDefinitionNode, fragments: Dict[str, FragmentDefinitionNode]
+) -> List[FragmentDefinitionNode]:
+    """Get the fragments `operation` uses, since unused ones are invalid."""
+    used: Dict[str, FragmentDefinitionNode] = {}
+    stack: List[Any] = [operation]
+
+    class Spreads(Visitor):
+        def enter_fragment_spread(self, node: FragmentSpreadNode, *_):
+            name = node.name.value
+            if name not in used and name in fragments:
+                used[name] = fragments[name]
+                stack.append(fragments[name])
+
+    while stack:
+        visit(stack.pop(), Spreads())
+    return list(used.values())
+
+
+class _Entry:
+    """One queued operation, renamed to be merged with the others."""
+
+    def __init__(
+        self,
+        index: int,
+        document: DocumentNode,
+        variables: Optional[Dict[str, Any]],
+        operation_name: Optional[str],
+        transform: Optional[_Transform],
+        upload_files: bool,
+        future: "Union[Future[Any], asyncio.Future[Any]]",
+    ):
+        self.prefix = f"b{index}_"
+        operation = _operation(document, operation_name)
+        fragments = {
+            d.name.value: d
+            for d in document.definitions
+            if isinstance(d, FragmentDefinitionNode)
+        }
+
+        renamer = _Renamer(self.prefix)
+        renamed = visit(operation, renamer)
+        self.fragments = [
+            visit(fragment, renamer)
+            for fragment in _used_fragments(operation, fragments)
+        ]
+        self.operation_type = operation.operation
+        self.variable_definitions = renamed.variable_definitions or ()
+
+        # Root fields are aliased with the prefix too, to tell apart the
+        # results of each operation.
+        self.keys: Dict[str, str] = {}
+        selections = []
+        for selection in renamed.selection_set.selections:
+            if not isinstance(selection, FieldNode):
+                raise ValueError("Fragments at the root of a query can't be batched")
+            key = (selection.alias or selection.name).value
+            self.keys[self.prefix + key] = key
+            selections.append(
+                _replace(selection, alias=NameNode(value=self.prefix + key))
+            )
+        self.selections = selections
+
+        self.variables = {self.prefix + k: v for k, v in (variables or {}).items()}
+        self.transform = transform
+        self.upload_files = upload_files
+        self.future = future
+
+    def resolve(self, data: Optional[Dict[str, Any]], errors: List[Any]):
+        if self.future.done():
+            return
+        result = (
+            None if data is None else {key: data.get(k) for k, key in self.keys.items()}
+        )
+        if errors:
+            self.future.set_exception(
+                TransportQueryError(
+                    graphql_error_message(errors), errors=errors, data=result
+                )
+            )
+            return
+        try:
+            value = self.transform(result) if self.transform else result
+        except Exception as e:  # pylint: disable=broad-except
+            self.future.set_exception(e)
+        else:
+            self.future.set_result(value)
+
+    def fail(self, error: BaseException):
+        if not self.future.done():
+            self.future.set_exception(error)
+
+
+class BatchRequest(NamedTuple):
+    """A merged operation, ready to be sent."""
+
+    document: DocumentNode
+    variables: Dict[str, Any]
+    upload_files: bool
+    entries: List[_Entry]
+
+    @property
+    def is_mutation(self) -> bool:
+        return self.entries[0].operation_type == OperationType.MUTATION
+
+    def resolve(self, data: Optional[Dict[str, Any]], errors: Optional[List[Any]]):
+        """Give each queued operation its part of the response.
+
+        Errors are routed by the alias at the start of their `path`, which
+        is put back to the original field name. Errors without a path go
+        to every operation.
+        """
+        owners = {k: entry for entry in self.entries for k in entry.keys}
+        routed: Dict[int, List[Any]] = {id(entry): [] for entry in self.entries}
+        for error in errors or []:
+            path = error.get("path") if isinstance(error, dict) else None
+            entry = owners.get(path[0]) if path else None
+            if entry is None:
+                for entry_errors in routed.values():
+                    entry_errors.append(error)
+            else:
+                error = {**error, "path": [entry.keys[path[0]], *path[1:]]}
+                routed[id(entry)].append(error)
+
+        for entry in self.entries:
+            entry.resolve(data, routed[id(entry)])
+
+    def fail(self, error: BaseException):
+        for entry in self.entries:
+            entry.fail(error)
+
+
+def _merge(entries: List[_Entry]) -> BatchRequest:
+    operation = OperationDefinitionNode(
+        operation=entries[0].operation_type,
+        name=NameNode(value=BATCH_OPERATION),
+        variable_definitions=tuple(
+            definition for entry in entries for definition in entry.variable_definitions
+        ),
+        directives=(),
+        selection_set=SelectionSetNode(
+            selections=tuple(
+                selection for entry in entries for selection in entry.selections
+            )
+        ),
+    )
+    fragments = tuple(fragment for entry in entries for fragment in entry.fragments)
+    variables: Dict[str, Any] = {}
+    for entry in entries:
+        variables.update(entry.variables)
+    return BatchRequest(
+        DocumentNode(definitions=(operation, *fragments)),
+        variables,
+        any(entry.upload_files for entry in entries),
+        entries,
+    )
+
+
+class BaseBatch:
+    """Queues GraphQL operations to send them together.
+
+    Each method queues an operation and returns a future for its result, a
+    `concurrent.futures.Future` or, in `AsyncBatch`, an `asyncio.Future`,
+    which is resolved when the batch is sent. Methods match those of
+    `Anvil`, and their futures resolve to what `Anvil` returns, or raise
+    what it raises.
+
+    Queries are merged into one query and mutations into one mutation, with
+    their variables and root fields renamed so they don't collide. A batch
+    with both queries and mutations takes two requests, since a GraphQL
+    request runs only one operation. Mutations are run in the order they
+    were queued.
+    """
+
+    def __init__(self, **kwargs):
+        # Request options, e.g. `timeout`, for every request of the batch.
+        self.kwargs = kwargs
+        self._entries: List[_Entry] = []
+        self._sent = False
+        # Loads the lazy fields of casts from `get_casts`.
+        self._cast_loader: Optional[CastLoader] = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _future(self) -> "Future[Any]":
+        return Future()
+
+    def _add(
+        self,
+        query: Union[str, DocumentNode, BaseQuery],
+        variables: Optional[Dict[str, Any]] = None,
+        operation_name: Optional[str] = None,
+        transform: Optional[_Transform] = None,
+        upload_files: bool = False,
+    ) -> "Future[Any]":
+        if self._sent:
+            raise RuntimeError("The batch was already sent")
+        entry = _Entry(
+            len(self._entries),
+            to_document(query),
+            variables,
+            operation_name,
+            transform,
+            upload_files,
+            self._future(),
+        )
+        self._entries.append(entry)
+        return entry.future
+
+    def _requests(self) -> List[BatchRequest]:
+        """Merge the queued operations, mutations first."""
+        self._sent = True
+        requests = []
+        for operation_type in (OperationType.MUTATION, OperationType.QUERY):
+            entries = [e for e in self._entries if e.operation_type == operation_type]
+            if entries:
+                requests.append(_merge(entries))
+        return requests
+
+    def cancel(self):
+        """Don't send the batch, and cancel the futures of its operations."""
+        self._sent = True
+        for entry in self._entries:
+            entry.future.cancel()
+
+    def query(
+        self,
+        query: Union[str, DocumentNode],
+        variables: Optional[Dict[str, Any]] = None,
+        operation_name: Optional[str] = None,
+    ) -> "Future[Dict[str, Any]]":
+        """Queue a GraphQL query. See `Anvil.query`."""
+        return self._add(query, variables, operation_name)
+
+    def mutate(
+        self,
+        query: Union[str, BaseQuery],
+        variables: Dict[str, Any],
+        upload_files: bool = False,
+    ) -> "Future[Dict[str, Any]]":
+        """Queue a GraphQL mutation. See `Anvil.mutate`."""
+        return self._add(query, variables, upload_files=upload_files)
+
+    def get_cast(
+        self,
+        eid: str,
+        fields: Optional[List[str]] = None,
+        version_number: Optional[int] = None,
+        cast_args: Optional[List[Tuple[str, str]]] = None,
+    ) -> "Future[Dict[str, Any]]":
+        return self._add(
+            cast_query(eid, fields, version_number, cast_args),
+            transform=lambda r: r["cast"],
+        )
+
+    def get_casts(
+        self, fields: Optional[List[str]] = None, show_all: bool = False
+    ) -> "Future[List[Dict[str, Any]]]":
+        return self._add(
+            casts_query(fields, show_all),
+            transform=lambda r: [Cast(c, self._cast_loader) for c in get_casts_data(r)],
+        )
+
+    def get_current_user(self) -> "Future[Dict[str, Any]]":
+        return self._add(CURRENT_USER_QUERY, transform=lambda r: r["currentUser"])
+
+    def get_welds(self) -> "Future[List[Dict[str, Any]]]":
+        return self._add(WELDS_QUERY, transform=get_welds_data)
+
+    def get_weld(self, eid: str) -> "Future[Dict[str, Any]]":
+        return self._add(WELD_QUERY, dict(eid=eid), transform=lambda r: r["weld"])
+
+    def get_etch_packet_document_group(
+        self, etch_packet_eid: str
+    ) -> "Future[Dict[str, Any]]":
+        return self._add(
+            ETCH_PACKET_DOCUMENT_GROUP_QUERY,
+            dict(eid=etch_packet_eid),
+            transform=lambda r: r["etchPacket"]["documentGroup"],
+        )
+
+    def _get_one(
+        self, field: BulkField, eid: str, fields: Optional[List[str]]
+    ) -> "Future[Optional[Dict[str, Any]]]":
+        return self._add(
+            bulk_query(field, 1, fields), dict(e0=eid), transform=lambda r: r["r0"]
+        )
+
+    def get_etch_packet(
+        self, eid: str, fields: Optional[List[str]] = None
+    ) -> "Future[Optional[Dict[str, Any]]]":
+        return self._get_one(ETCH_PACKET, eid, fields)
+
+    def get_signer(
+        self, eid: str, fields: Optional[List[str]] = None
+    ) -> "Future[Optional[Dict[str, Any]]]":
+        return self._get_one(SIGNER, eid, fields)
+
+    def get_weld_data(
+        self, eid: str, fields: Optional[List[str]] = None
+    ) -> "Future[Optional[Dict[str, Any]]]":
+        return self._get_one(WELD_DATA, eid, fields)
+
+    def create_etch_packet(
+        self,
+        payload: Optional[
+            Union[dict, CreateEtchPacketPayload, CreateEtchPacket, AnyStr]
+        ] = None,
+        json=None,
+    ) -> "Future[Dict[str, Any]]":
+        mutation, variables = create_etch_packet_mutation(payload, json)
+        return self.mutate(mutation, variables, upload_files=True)
+
+    def generate_etch_signing_url(
+        self, signer_eid: str, client_user_id: str
+    ) -> "Future[Dict[str, Any]]":
+        mutation, variables = generate_etch_signing_url_mutation(
+            signer_eid, client_user_id
+        )
+        return self.mutate(mutation, variables)
+
+    def forge_submit(
+        self,
+        payload: Optional[Union[Dict[str, Any], ForgeSubmitPayload]] = None,
+        json=None,
+    ) -> "Future[Dict[str, Any]]":
+        mutation, variables = forge_submit_mutation(payload, json)
+        return self.mutate(mutation, variables)
+
+
+class Batch(BaseBatch):
+    """A batch of `Anvil` operations, sent when the `with` block exits.
+
+    Usage:
+        >> with anvil.batch() as b:
+        >>     cast = b.get_cast(cast_eid)
+        >>     user = b.get_current_user()
+        >> print(cast.result()["title"], user.result()["email"])
+    """
+
+    def __init__(self, anvil: "Anvil", **kwargs):
+        super().__init__(**kwargs)
+        self.anvil = anvil
+        self._cast_loader = anvil.load_cast_fields
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.send()
+        else:
+            self.cancel()
+
+    def send(self):
+        """Send the queued operations and resolve their futures.
+
+        A request that fails, e.g. with `AnvilServerError`, fails the futures
+        of its operations instead of raising.
+        """
+        for request in self._requests():
+            execute = self.anvil.mutate if request.is_mutation else self.anvil.query
+            try:
+                data, errors = (
+                    execute(
+                        request.document,
+                        variables=request.variables,
+                        upload_files=request.upload_files,
+                        **self.kwargs,
+                    ),
+                    None,
+                )
+            except TransportQueryError as e:
+                data, errors = e.data, e.errors
+            except Exception as e:  # pylint: disable=broad-except
+                request.fail(e)
+                continue
+            request.resolve(data, errors)
+
+
+class AsyncBatch(BaseBatch):
+    """A batch of `AsyncAnvil` operations, sent when the `async with` block exits.
+
+    Usage:
+        >> async with anvil.batch() as b:
+        >>     cast = b.get_cast(cast_eid)
+        >>     user = b.get_current_user()
+        >> print((await cast)["title"], user.result()["email"])
+
+    Its methods return `asyncio.Future`s, so they must be called from a
+    running event loop.
+    """
+
+    def __init__(self, anvil: "AsyncAnvil", **kwargs):
+        super().__init__(**kwargs)
+        self.anvil = anvil
+
+    def _future(self) -> "asyncio.Future[Any]":
+        # Futures that can be awaited, on the loop that sends the batch.
+        return asyncio.get_running_loop().create_future()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, *args):
+        if exc_type is None:
+            await self.send()
+        else:
+            self.cancel()
+
+    async def send(self):
+        """Send the queued operations and resolve their futures."""
+        for request in self._requests():
+            execute = self.anvil.mutate if request.is_mutation else self.anvil.query
+            try:
+                data, errors = (
+                    await execute(
+                        request.document,
+                        variables=request.variables,
+                        upload_files=request.upload_files,
+                        **self.kwargs,
+                    ),
+                    None,
+                )
+            except TransportQueryError as e:
+                data, errors = e.data, e.errors
+            except Exception as e:  # pylint: disable=broad-except
+                request.fail(e)
+                continue
+            request.resolve(data, errors)
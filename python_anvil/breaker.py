@@ -0,0 +1,286 @@
+"""Circuit breaker, to fail fast while an Anvil endpoint is failing."""
+
+import itertools
+import re
+from collections import deque
+from logging import getLogger
+from time import monotonic
+from typing import Callable, Collection, Deque, Dict, NamedTuple, Optional, Tuple
+from urllib.parse import urlsplit
+
+from .exceptions import AnvilCircuitOpenError
+from .forksafe import ForkSafeLock
+from .retry import RETRY_STATUSES
+
+
+logger = getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_VERSION = re.compile(r"v\d+")
+
+
+def endpoint_for_url(url: str) -> str:
+    """Group a request URL by the endpoint it calls.
+
+    IDs in the path are dropped, so that e.g. every `fill/{eid}.pdf` request
+    counts towards the same breaker:
+
+        >> endpoint_for_url("https://app.useanvil.com/api/v1/fill/abc.pdf")
+        'app.useanvil.com/fill'
+    """
+    parts = urlsplit(url)
+    segments = [
+        segment
+        for segment in parts.path.split("/")
+        if segment and segment != "api" and not _VERSION.fullmatch(segment)
+    ]
+    name = segments[0].split(".")[0] if segments else ""
+    return f"{parts.netloc}/{name}"
+
+
+class Ticket(NamedTuple):
+    """Permission to send one request, handed out by `CircuitBreaker.before_request`."""
+
+    endpoint: str
+    generation: int
+    probe: bool
+
+
+class _Circuit:
+    def __init__(self, window: int, generation: int):
+        self.state = CLOSED
+        # Changed on every state change, so that results of requests sent
+        # before it are ignored.
+        self.generation = generation
+        self.opened_at = 0.0
+        # (failed, slow) for the most recent requests.
+        self.outcomes: Deque[Tuple[bool, bool]] = deque(maxlen=window)
+        self.probes = 0
+        self.probe_successes = 0
+
+
+class CircuitBreaker:
+    """Stops sending requests to an endpoint while it is failing.
+
+    Each endpoint has its own circuit. It starts out closed, and requests
+    are sent as usual. When, out of the last `window` requests, at least
+    `failure_rate` failed (timeouts, connection errors or a status in
+    `failure_statuses`), or at least `slow_rate` took longer than
+    `slow_duration` seconds, the circuit opens. While it is open, requests
+    to the endpoint raise `AnvilCircuitOpenError` right away, without
+    waiting for the rate limiter, retries or timeouts.
+
+    After `open_duration` seconds the circuit is half-open: up to
+    `half_open_requests` requests are let through as probes. If they all
+    succeed the circuit closes, otherwise it opens again.
+
+    Rate-limited (429) responses don't count either way.
+
+    Usage:
+        >> def on_state_change(endpoint, old, new):
+        >>     health.set(endpoint, new)
+        >>
+        >> breaker = CircuitBreaker(on_state_change=on_state_change)
+        >> anvil = Anvil(api_key="my_key", circuit_breaker=breaker)
+
+    :param failure_rate: Fraction of failed requests that opens the circuit.
+    :param slow_rate: Fraction of slow requests that opens the circuit.
+    :param slow_duration: Seconds after which a request counts as slow.
+    :param window: Number of recent requests the rates are computed over.
+    :param min_requests: Number of requests needed before the circuit can
+        open.
+    :param open_duration: Seconds to fail fast before sending probes.
+    :param half_open_requests: Number of probes that must succeed to close
+        the circuit.
+    :param failure_statuses: Response statuses that count as failures.
+    :param endpoint: Function grouping request URLs into endpoints. See
+        `endpoint_for_url`.
+    :param on_state_change: Called with `(endpoint, old_state, new_state)`
+        whenever a circuit changes state. States are `"closed"`, `"open"`
+        and `"half_open"`.
+    """
+
+    def __init__(
+        self,
+        failure_rate: float = 0.5,
+        slow_rate: float = 0.8,
+        slow_duration: float = 30.0,
+        window: int = 50,
+        min_requests: int = 10,
+        open_duration: float = 30.0,
+        half_open_requests: int = 3,
+        failure_statuses: Collection[int] = RETRY_STATUSES,
+        endpoint: Callable[[str], str] = endpoint_for_url,
+        on_state_change: Optional[Callable[[str, str, str], None]] = None,
+    ):
+        if not 0 < failure_rate <= 1 or not 0 < slow_rate <= 1:
+            raise ValueError("`failure_rate` and `slow_rate` must be between 0 and 1")
+        if half_open_requests < 1:
+            raise ValueError("`half_open_requests` must be at least 1")
+
+        self.failure_rate = failure_rate
+        self.slow_rate = slow_rate
+        self.slow_duration = slow_duration
+        self.window = window
+        self.min_requests = min_requests
+        self.open_duration = open_duration
+        self.half_open_requests = half_open_requests
+        self.failure_statuses = frozenset(failure_statuses)
+        self.endpoint = endpoint
+        self.on_state_change = on_state_change
+        self._circuits: Dict[str, _Circuit] = {}
+        # Generations are unique across circuits, so a ticket issued before
+        # `reset()` never matches the circuit that replaces its own.
+        self._generations = itertools.count()
+        self._lock = ForkSafeLock()
+
+    def state(self, endpoint: str) -> str:
+        """Get the state of an endpoint's circuit."""
+        with self._lock:
+            circuit = self._circuits.get(endpoint)
+            if circuit is None:
+                return CLOSED
+            changes = self._check_open(endpoint, circuit)
+            state = circuit.state
+        self._notify(changes)
+        return state
+
+    def states(self) -> Dict[str, str]:
+        """Get the state of every endpoint that has been called."""
+        with self._lock:
+            endpoints = list(self._circuits)
+        return {endpoint: self.state(endpoint) for endpoint in endpoints}
+
+    def before_request(self, url: str) -> Ticket:
+        """Get permission to send a request to `url`.
+
+        Raises `AnvilCircuitOpenError` if the endpoint's circuit is open, or
+        if it is half-open and all probes are already in flight. Pass the
+        returned ticket to `record()` or `cancel()`.
+        """
+        endpoint = self.endpoint(url)
+        with self._lock:
+            circuit = self._circuits.get(endpoint)
+            if circuit is None:
+                circuit = self._circuits[endpoint] = _Circuit(
+                    self.window, next(self._generations)
+                )
+            changes = self._check_open(endpoint, circuit)
+            probe = circuit.state == HALF_OPEN
+            allowed = circuit.state == CLOSED or (
+                probe and circuit.probes < self.half_open_requests
+            )
+            if allowed and probe:
+                circuit.probes += 1
+            retry_after = max(0.0, circuit.opened_at + self.open_duration - monotonic())
+            ticket = Ticket(endpoint, circuit.generation, probe)
+        self._notify(changes)
+
+        if not allowed:
+            raise AnvilCircuitOpenError(
+                f"Circuit for {endpoint} is open. "
+                f"Retry after {retry_after:.2f} seconds.",
+                endpoint=endpoint,
+                retry_after=retry_after,
+            )
+        return ticket
+
+    def cancel(self, ticket: Ticket):
+        """Give back a ticket for a request that wasn't sent."""
+        with self._lock:
+            circuit = self._circuits.get(ticket.endpoint)
+            if circuit is None or ticket.generation != circuit.generation:
+                # Issued before the last state change or `reset()`.
+                return
+            if ticket.probe:
+                circuit.probes -= 1
+
+    def record(self, ticket: Ticket, latency: float, status_code: Optional[int] = None):
+        """Record the result of a request.
+
+        :param latency: Seconds until the response arrived, or the request
+            failed.
+        :param status_code: The response status, or `None` if no response
+            was received.
+        """
+        if status_code == 429:
+            self.cancel(ticket)
+            return
+
+        failed = status_code is None or status_code in self.failure_statuses
+        slow = latency >= self.slow_duration
+        changes = []
+        with self._lock:
+            circuit = self._circuits.get(ticket.endpoint)
+            if circuit is None or ticket.generation != circuit.generation:
+                # Sent before the last state change or `reset()`.
+                return
+            if circuit.state == HALF_OPEN:
+                if failed or slow:
+                    changes.append(self._transition(ticket.endpoint, circuit, OPEN))
+                else:
+                    circuit.probe_successes += 1
+                    if circuit.probe_successes >= self.half_open_requests:
+                        changes.append(
+                            self._transition(ticket.endpoint, circuit, CLOSED)
+                        )
+            elif circuit.state == CLOSED:
+                circuit.outcomes.append((failed, slow))
+                if self._should_open(circuit):
+                    changes.append(self._transition(ticket.endpoint, circuit, OPEN))
+        self._notify(changes)
+
+    def reset(self):
+        """Close every circuit."""
+        with self._lock:
+            changes = [
+                self._transition(endpoint, circuit, CLOSED)
+                for endpoint, circuit in self._circuits.items()
+                if circuit.state != CLOSED
+            ]
+            self._circuits.clear()
+        self._notify(changes)
+
+    def _should_open(self, circuit: _Circuit) -> bool:
+        count = len(circuit.outcomes)
+        if count < self.min_requests:
+            return False
+        failures = sum(failed for failed, _ in circuit.outcomes)
+        slow = sum(slow for _, slow in circuit.outcomes)
+        return failures >= self.failure_rate * count or slow >= self.slow_rate * count
+
+    def _check_open(self, endpoint: str, circuit: _Circuit):
+        """Move an open circuit to half-open once `open_duration` has passed."""
+        if (
+            circuit.state == OPEN
+            and monotonic() - circuit.opened_at >= self.open_duration
+        ):
+            return [self._transition(endpoint, circuit, HALF_OPEN)]
+        return []
+
+    def _transition(self, endpoint: str, circuit: _Circuit, state: str):
+        old = circuit.state
+        circuit.state = state
+        circuit.generation = next(self._generations)
+        circuit.probes = 0
+        circuit.probe_successes = 0
+        circuit.outcomes.clear()
+        if state == OPEN:
+            circuit.opened_at = monotonic()
+        return endpoint, old, state
+
+    def _notify(self, changes):
+        # Called without holding the lock, so the hook can use the breaker.
+        for endpoint, old, new in changes:
+            if new == OPEN:
+                logger.warning("Circuit for %s opened.", endpoint)
+            else:
+                logger.info("Circuit for %s is now %s.", endpoint, new)
+            if self.on_state_change:
+                try:
+                    self.on_state_change(endpoint, old, new)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception("Circuit breaker state change hook failed.")
@@ -0,0 +1,148 @@
+"""Fetch many objects by eid, with one aliased GraphQL query per chunk."""
+
+from collections import defaultdict
+from gql.transport.exceptions import TransportQueryError
+from graphql import DocumentNode
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from .constants import DEFAULT_BULK_CHUNK_SIZE
+from .exceptions import AnvilGraphQLError, graphql_error_message
+from .query_cache import parse_query
+
+
+class BulkField(NamedTuple):
+    """A root query field that fetches one object by its eid.
+
+    :param name: Name of the field, e.g. `"cast"`.
+    :param fields: Fields selected on each object by default.
+    :param arguments: `(name, type)` of the field's other arguments, e.g.
+        `("versionNumber", "Int")`. They're the same for every object.
+    """
+
+    name: str
+    fields: Tuple[str, ...]
+    arguments: Tuple[Tuple[str, str], ...] = ()
+
+
+CAST = BulkField(
+    "cast", ("eid", "title", "fieldInfo"), arguments=(("versionNumber", "Int"),)
+)
+ETCH_PACKET = BulkField("etchPacket", ("eid", "name", "status", "isTest"))
+SIGNER = BulkField("signer", ("eid", "name", "email", "status", "routingOrder"))
+WELD_DATA = BulkField("weldData", ("eid", "displayTitle", "status", "isComplete"))
+
+
+class BulkItem(NamedTuple):
+    """Result for one eid of a bulk fetch.
+
+    `data` is `None` when the object couldn't be fetched, in which case
+    `error` usually says why. Both are set when only some of the object's
+    fields failed.
+    """
+
+    data: Optional[Dict[str, Any]]
+    error: Optional[AnvilGraphQLError] = None
+
+
+def _alias(index: int) -> str:
+    return f"r{index}"
+
+
+def bulk_query(
+    field: BulkField,
+    size: int,
+    fields: Optional[List[str]] = None,
+    arguments: Iterable[str] = (),
+) -> DocumentNode:
+    """Build a query fetching `size` objects of `field`, aliased `r0`, `r1`...
+
+    Eids are passed as variables `$e0`, `$e1`... and `arguments` as
+    variables of the same name, so the document only depends on the chunk
+    size and fields, and is parsed and validated once.
+    """
+    types = dict(field.arguments)
+    unknown = set(arguments) - set(types)
+    if unknown:
+        raise ValueError(f"Unknown arguments for `{field.name}`: {sorted(unknown)}")
+
+    definitions = [f"$e{i}: String!" for i in range(size)]
+    definitions += [f"${name}: {types[name]}" for name in arguments]
+    shared = "".join(f", {name}: ${name}" for name in arguments)
+    selection = " ".join(fields or field.fields)
+    roots = "\n".join(
+        f"  {_alias(i)}: {field.name}(eid: $e{i}{shared}) {{ {selection} }}"
+        for i in range(size)
+    )
+    operation = f"Bulk{field.name[0].upper()}{field.name[1:]}"
+    return parse_query(f"query {operation}({', '.join(definitions)}) {{\n{roots}\n}}")
+
+
+def bulk_queries(
+    field: BulkField,
+    eids: Iterable[str],
+    fields: Optional[List[str]] = None,
+    arguments: Optional[Dict[str, Any]] = None,
+    chunk_size: int = DEFAULT_BULK_CHUNK_SIZE,
+) -> Iterator[Tuple[DocumentNode, Dict[str, Any], List[str]]]:
+    """Split `eids` into chunks, and yield the query for each one.
+
+    Duplicate eids are only fetched once. Each item is a `(document,
+    variables, eids)` tuple, with the eids in alias order.
+    """
+    if chunk_size < 1:
+        raise ValueError("`chunk_size` must be at least 1")
+
+    arguments = {k: v for k, v in (arguments or {}).items() if v is not None}
+    unique = list(dict.fromkeys(eids))
+    for start in range(0, len(unique), chunk_size):
+        chunk = unique[start : start + chunk_size]
+        variables = {f"e{i}": eid for i, eid in enumerate(chunk)}
+        variables.update(arguments)
+        yield bulk_query(field, len(chunk), fields, arguments), variables, chunk
+
+
+def bulk_results(
+    eids: List[str], data: Optional[Dict[str, Any]], errors: Optional[List[Any]]
+) -> Dict[str, BulkItem]:
+    """Match the data and errors of an aliased query to each eid.
+
+    Errors are matched by the alias at the start of their `path`. Errors
+    without a path, e.g. for the whole query, go to every object that
+    has no data.
+    """
+    data = data or {}
+    by_alias: Dict[str, List[Any]] = defaultdict(list)
+    general = []
+    for error in errors or []:
+        path = error.get("path") if isinstance(error, dict) else None
+        if path:
+            by_alias[path[0]].append(error)
+        else:
+            general.append(error)
+
+    results = {}
+    for index, eid in enumerate(eids):
+        alias = _alias(index)
+        item = data.get(alias)
+        item_errors = by_alias.get(alias) or (general if item is None else [])
+        error = (
+            AnvilGraphQLError(graphql_error_message(item_errors), errors=item_errors)
+            if item_errors
+            else None
+        )
+        results[eid] = BulkItem(item, error)
+    return results
+
+
+def query_errors(error: TransportQueryError) -> Tuple[Dict[str, Any], List[Any]]:
+    """Get the partial data and the errors of a failed query."""
+    return error.data or {}, error.errors or [{"message": str(error)}]
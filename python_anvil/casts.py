@@ -0,0 +1,59 @@
+"""Cast results whose large fields are loaded when they're used."""
+
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from .bulk import BulkItem
+
+
+# Fields fetched for each cast by `get_casts`, unless `fields` is given.
+CAST_LIST_FIELDS = ["eid", "title"]
+# Fields that are left out of listings, and loaded on access instead.
+LAZY_CAST_FIELDS = ("fieldInfo",)
+
+# Loads `fields` into each of the casts, e.g. `Anvil.load_cast_fields`.
+CastLoader = Callable[[List["Cast"], List[str]], Dict[str, BulkItem]]
+
+
+class Cast(dict):
+    """A cast from `get_casts`.
+
+    `fieldInfo` can be megabytes per cast, so listings leave it out. Reading
+    it, with `cast["fieldInfo"]` or `cast.get("fieldInfo")`, fetches it for
+    this cast, and raises `AnvilGraphQLError` if that fails. To fetch it for
+    many casts in a few requests instead, pass them to
+    `Anvil.load_cast_fields()`. Either way, the field is stored in the same
+    `Cast`, so it's only fetched once.
+
+    Casts from `AsyncAnvil` can't fetch on access, and raise `KeyError`
+    until they're loaded with `await anvil.load_cast_fields(casts)`.
+    """
+
+    def __init__(self, data: dict, loader: Optional[CastLoader] = None):
+        super().__init__(data)
+        self._loader = loader
+
+    def __missing__(self, key: str):
+        if key not in LAZY_CAST_FIELDS or self._loader is None or "eid" not in self:
+            raise KeyError(key)
+        item = self._loader([self], [key]).get(self["eid"])
+        if item is not None and item.error is not None:
+            raise item.error
+        if key not in self:
+            raise KeyError(key)
+        return dict.__getitem__(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __reduce__(self):
+        # The loader holds a client, which can't be pickled.
+        return Cast, (dict(self),)
+
+
+def casts_missing(casts: Iterable[Cast], fields: Iterable[str]) -> List[Cast]:
+    """Get the casts that don't have all of `fields` yet."""
+    fields = list(fields)
+    return [cast for cast in casts if any(field not in cast for field in fields)]
@@ -10,6 +10,7 @@ from python_anvil import utils
 
 from .api import Anvil
 from .api_resources.payload import FillPDFPayload
+from .limiter import LIMITER_BACKENDS
 
 
 logger = getLogger(__name__)
@@ -29,15 +30,28 @@ def process_response(res):
 
 @click.group()
 @click.option("--debug/--no-debug", default=False)
+@click.option(
+    "--limiter-backend",
+    type=click.Choice(LIMITER_BACKENDS),
+    default="memory",
+    envvar="ANVIL_LIMITER_BACKEND",
+    help="Where rate limit state is kept. Use 'sqlite' to share one budget "
+    "per API key between processes on this machine.",
+)
+@click.option(
+    "--limiter-path",
+    envvar="ANVIL_LIMITER_PATH",
+    help="Database file used by the 'sqlite' rate limiter backend",
+)
 @click.pass_context
-def cli(ctx: click.Context, debug=False):
+def cli(ctx: click.Context, debug=False, limiter_backend="memory", limiter_path=None):
     ctx.ensure_object(dict)
 
     key = get_api_key()
     if not key:
         raise ValueError("$ANVIL_API_KEY must be defined in your environment variables")
 
-    anvil = Anvil(key)
+    anvil = Anvil(key, limiter_backend=limiter_backend, limiter_path=limiter_path)
     ctx.obj["anvil"] = anvil
     ctx.obj["debug"] = debug
 
@@ -137,7 +151,7 @@ def cast(ctx, eid, version_number, list_all, list_templates):
         raise AssertionError("Cast eid or --list/--all option required")
 
     if list_all or list_templates:
-        res = anvil.get_casts(show_all=list_all, debug=debug)
+        res = anvil.get_casts(fields=["eid", "title"], show_all=list_all, debug=debug)
 
         if contains_headers(res):
             res, headers = process_response(res)
@@ -309,25 +323,50 @@ def generate_etch_url(ctx, signer_eid, client_user_id):
     help="Instead of writing to a file, output data to STDOUT",
     default=False,
 )
+@click.option(
+    "--resume/--no-resume",
+    help="Resume an interrupted download instead of starting over. The zip "
+    "is kept in FILENAME.part until it is complete.",
+    default=False,
+)
 @click.pass_context
-def download_documents(ctx, document_group_eid, filename, stdout):
+def download_documents(ctx, document_group_eid, filename, stdout, resume):
     anvil = ctx.obj["anvil"]
     debug = ctx.obj["debug"]
-    res = anvil.download_documents(document_group_eid, debug=debug)
-
-    if contains_headers(res):
-        res, headers = process_response(res)
-        if debug:
-            click.echo(headers)
 
     if not stdout:
         if not filename:
             filename = f"{document_group_eid}.zip"
 
-        with click.open_file(filename, 'wb') as out_file:
-            out_file.write(res)
-        click.echo(f"Saved as '{click.format_filename(filename)}'")
+        if resume:
+            # `filename` is only replaced once the download is complete.
+            res = anvil.download_documents(
+                document_group_eid, debug=debug, output=filename, resume=True
+            )
+            if contains_headers(res):
+                _, headers = process_response(res)
+                if debug:
+                    click.echo(headers)
+        else:
+            # Request errors are raised before the file is opened, so they
+            # don't clobber an existing one.
+            content = anvil.download_documents(
+                document_group_eid, debug=debug, stream=True
+            )
+            if contains_headers(content):
+                content, headers = process_response(content)
+                if debug:
+                    click.echo(headers)
+            with content, click.open_file(filename, 'wb') as out_file:
+                content.write_to(out_file)
+        if filename != "-":
+            click.echo(f"Saved as '{click.format_filename(filename)}'")
     else:
+        res = anvil.download_documents(document_group_eid, debug=debug)
+        if contains_headers(res):
+            res, headers = process_response(res)
+            if debug:
+                click.echo(headers)
         click.echo(res)
 
 
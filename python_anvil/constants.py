@@ -11,6 +11,25 @@ VALID_HOSTS = [
 ]
 
 RETRIES_LIMIT = 5
+# Default (connect, read) timeouts in seconds. Generating large PDFs can
+# take a while, so the read timeout is generous.
+DEFAULT_TIMEOUT = (10.0, 120.0)
+# Bytes read at a time from streamed responses.
+DEFAULT_CHUNK_SIZE = 64 * 1024
+# Files downloaded at a time by `download_document_files`.
+DEFAULT_DOWNLOAD_WORKERS = 4
+# Objects fetched per request by the bulk getters, e.g. `get_signers`.
+DEFAULT_BULK_CHUNK_SIZE = 50
+# Seconds a `Loader` waits to collect lookups into one request.
+DEFAULT_COALESCE_WINDOW = 0.005
+# Supported `Content-Encoding`s for request bodies.
+COMPRESSIONS = ("gzip", "zstd")
+# Request bodies smaller than this aren't worth compressing.
+DEFAULT_COMPRESSION_THRESHOLD = 16 * 1024
+# Connections kept open per host. Matches the `requests` default.
+DEFAULT_POOL_SIZE = 10
+# HTTP methods that are safe to retry.
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "DELETE"])
 REQUESTS_LIMIT = {
     "dev": {
         "calls": 2,
@@ -21,5 +40,3 @@ REQUESTS_LIMIT = {
         "seconds": 1,
     },
 }
-
-RATELIMIT_ENV = "dev"
@@ -0,0 +1,248 @@
+"""Resumable downloads, shared by `HTTPClient` and `AsyncHTTPClient`."""
+
+import base64
+import hashlib
+import json
+import os
+import re
+from logging import getLogger
+from typing import Dict, Mapping, Optional, Tuple, Union
+
+from python_anvil.exceptions import AnvilDownloadError
+
+
+logger = getLogger(__name__)
+
+PART_SUFFIX = ".part"
+# Saved next to the partial file, with what's needed to resume it later.
+META_SUFFIX = ".meta"
+
+# What to do with the body of a response, see `ResumableDownload.start`.
+WRITE = "write"
+COMPLETE = "complete"
+ERROR = "error"
+
+_CONTENT_RANGE = re.compile(r"bytes\s+(?:(\d+)-\d+|\*)/(\d+|\*)")
+_SHA256_DIGEST = re.compile(r"sha-256=:?([A-Za-z0-9+/=]+):?", re.IGNORECASE)
+
+
+def _parse_content_range(value: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
+    """Get the `(start, total)` of a `Content-Range` header value."""
+    match = _CONTENT_RANGE.fullmatch((value or "").strip())
+    if not match:
+        return None, None
+    start, total = match.groups()
+    return (
+        int(start) if start is not None else None,
+        int(total) if total != "*" else None,
+    )
+
+
+def _parse_sha256_digest(headers: Mapping[str, str]) -> Optional[str]:
+    """Get a SHA-256 checksum sent in a `Repr-Digest` or `Digest` header, as hex."""
+    for name in ("Repr-Digest", "Digest"):
+        match = _SHA256_DIGEST.search(headers.get(name) or "")
+        if match:
+            try:
+                return base64.b64decode(match.group(1)).hex()
+            except ValueError:
+                return None
+    return None
+
+
+def _remove(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class ResumableDownload:
+    """State of a download to `path`.
+
+    The body is written to `path` + ".part" and only moved to `path` once
+    its length and checksum have been verified. If the download is
+    interrupted, the partial file is kept, and the next request asks for
+    the rest of it with a `Range` header, whether that is the next retry or
+    a later call.
+
+    The response's `ETag` or `Last-Modified` validator is saved to
+    `path` + ".part.meta" and sent as `If-Range` when resuming, so that a
+    file that changed in the meantime is downloaded again from the start
+    instead of being appended to the old part. A partial file without a
+    saved validator is thrown away.
+
+    :param path: Where to save the file.
+    :param sha256: Expected SHA-256 checksum of the file, in hex. If not
+        given, a checksum sent by the server in a `Repr-Digest` or `Digest`
+        header is used instead.
+    """
+
+    def __init__(self, path: Union[str, "os.PathLike[str]"], sha256=None):
+        self.path = os.fspath(path)
+        self.part_path = self.path + PART_SUFFIX
+        self.meta_path = self.part_path + META_SUFFIX
+        self.sha256 = sha256.lower() if sha256 else None
+        self.total: Optional[int] = None
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.offset = 0
+        self._file = None
+        self._hash = None
+        if os.path.exists(self.part_path):
+            self._load_part()
+
+    def _load_part(self):
+        """Continue from a partial file left behind by an earlier call."""
+        try:
+            with open(self.meta_path, encoding="utf-8") as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            meta = None
+        if not isinstance(meta, dict):
+            meta = {}
+
+        self.etag = meta.get("etag")
+        self.last_modified = meta.get("last_modified")
+        if not self.etag and not self.last_modified:
+            # Without `If-Range`, a file that changed since would be spliced
+            # onto the old part.
+            logger.info("Can't resume %s, downloading it again.", self.part_path)
+            self.reset()
+            return
+        if not self.sha256:
+            self.sha256 = meta.get("sha256")
+        self.offset = os.path.getsize(self.part_path)
+
+    def request_headers(self) -> Dict[str, str]:
+        """Headers for the next request, asking for the rest of the file."""
+        # Ranges apply to the encoded body, so ask for it unencoded.
+        headers = {"Accept-Encoding": "identity"}
+        if self.offset:
+            headers["Range"] = f"bytes={self.offset}-"
+            validator = self.etag or self.last_modified
+            if validator:
+                # Send the whole file instead if it changed since.
+                headers["If-Range"] = validator
+        return headers
+
+    def start(self, status_code: int, headers: Mapping[str, str]) -> str:
+        """Prepare to handle a response.
+
+        :return: `WRITE` if the body should be written with `write()`,
+            `COMPLETE` if the file is already complete, or `ERROR` if the
+            response is an error.
+        """
+        if status_code == 206:
+            start, total = _parse_content_range(headers.get("Content-Range"))
+            if start != self.offset:
+                self.reset()
+                raise AnvilDownloadError(
+                    "Unexpected Content-Range "
+                    f"{headers.get('Content-Range')!r} for offset {self.offset}",
+                    status_code=status_code,
+                    headers=headers,
+                )
+            self._set_validators(headers, total)
+            self._open("ab")
+            return WRITE
+
+        if status_code == 416:
+            # Only a complete file makes the range unsatisfiable.
+            _, total = _parse_content_range(headers.get("Content-Range"))
+            if self.offset and total == self.offset:
+                self.total = total
+                return COMPLETE
+            self.reset()
+            raise AnvilDownloadError(
+                f"Range starting at {self.offset} not satisfiable",
+                status_code=status_code,
+                headers=headers,
+            )
+
+        if 200 <= status_code < 300:
+            if self.offset:
+                logger.info("Server sent the whole file, restarting download.")
+            self.reset()
+            length = headers.get("Content-Length")
+            self._set_validators(headers, int(length) if length else None)
+            self._open("wb")
+            return WRITE
+
+        return ERROR
+
+    def _set_validators(self, headers: Mapping[str, str], total: Optional[int]):
+        self.total = total
+        etag = headers.get("ETag")
+        # Weak ETags can't be used with `If-Range`.
+        self.etag = etag if etag and not etag.startswith("W/") else None
+        self.last_modified = headers.get("Last-Modified")
+        if not self.sha256:
+            self.sha256 = _parse_sha256_digest(headers)
+        self._save_meta()
+
+    def _save_meta(self):
+        if not self.etag and not self.last_modified:
+            _remove(self.meta_path)
+            return
+        meta = dict(
+            etag=self.etag, last_modified=self.last_modified, sha256=self.sha256
+        )
+        with open(self.meta_path, "w", encoding="utf-8") as file:
+            json.dump(meta, file)
+
+    def _open(self, mode: str):
+        self._hash = hashlib.sha256()
+        if mode == "ab":
+            with open(self.part_path, "rb") as file:
+                for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                    self._hash.update(chunk)
+        # pylint: disable=consider-using-with
+        self._file = open(self.part_path, mode)  # type: ignore
+
+    def write(self, chunk: bytes):
+        self._file.write(chunk)  # type: ignore
+        self._hash.update(chunk)  # type: ignore
+        self.offset += len(chunk)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def reset(self):
+        """Throw away the partial file, to download it again from the start."""
+        self.close()
+        _remove(self.part_path)
+        _remove(self.meta_path)
+        self.offset = 0
+        self.total = None
+        self.etag = None
+        self.last_modified = None
+        self._hash = None
+
+    def finish(self) -> str:
+        """Verify the downloaded file and move it to `path`.
+
+        Raises `AnvilDownloadError` if the file is incomplete or doesn't
+        match the checksum. The partial file is then thrown away.
+
+        :return: The path of the file.
+        """
+        self.close()
+        if self.total is not None and self.offset != self.total:
+            raise AnvilDownloadError(
+                f"Download incomplete: got {self.offset} of {self.total} bytes"
+            )
+        if self.sha256:
+            if self._hash is None:
+                # Complete from a previous call: hash what's on disk.
+                self._open("ab")
+                self.close()
+            actual = self._hash.hexdigest()  # type: ignore
+            if actual != self.sha256:
+                self.reset()
+                raise AnvilDownloadError(
+                    f"Checksum mismatch: expected SHA-256 {self.sha256}, got {actual}"
+                )
+        os.replace(self.part_path, self.path)
+        _remove(self.meta_path)
+        return self.path
@@ -1,6 +1,115 @@
-class AnvilException(BaseException):
-    pass
+from typing import Any, List, Mapping, Optional
+
+
+class AnvilException(Exception):
+    """Base class for all errors raised by this library.
+
+    `retryable` is `True` for transient errors, where the same call may
+    succeed if it is made again later.
+    """
+
+    retryable = False
 
 
 class AnvilRequestException(AnvilException):
-    pass
+    """An Anvil API request failed."""
+
+    def __init__(
+        self,
+        message: str = "",
+        status_code: Optional[int] = None,
+        headers: Optional[Mapping[str, Any]] = None,
+        response: Any = None,
+    ):
+        super().__init__(message)
+        self.status_code = status_code
+        self.headers = headers
+        self.response = response
+
+
+class AnvilRateLimitException(AnvilRequestException):
+    """The request was rate limited (HTTP 429)."""
+
+    retryable = True
+
+    def __init__(self, message: str = "", retry_after: float = 1, **kwargs):
+        kwargs.setdefault("status_code", 429)
+        super().__init__(message, **kwargs)
+        self.retry_after = retry_after
+
+
+class AnvilClientError(AnvilRequestException):
+    """The API rejected the request (HTTP 4xx). Retrying won't help."""
+
+
+class AnvilServerError(AnvilRequestException):
+    """The API failed to handle the request (HTTP 5xx)."""
+
+    retryable = True
+
+
+class AnvilTimeoutError(AnvilRequestException):
+    """The request timed out."""
+
+    retryable = True
+
+
+class AnvilConnectionError(AnvilRequestException):
+    """The connection to the API failed, e.g. it was refused or reset."""
+
+    retryable = True
+
+
+class AnvilDownloadError(AnvilRequestException):
+    """A downloaded file is incomplete or doesn't match its checksum."""
+
+    retryable = True
+
+
+class AnvilCircuitOpenError(AnvilRequestException):
+    """The request wasn't sent, because the endpoint's circuit breaker is open.
+
+    `retry_after` is the number of seconds until the breaker lets requests
+    through again.
+    """
+
+    retryable = True
+
+    def __init__(
+        self, message: str = "", endpoint: str = "", retry_after: float = 0, **kwargs
+    ):
+        super().__init__(message, **kwargs)
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class AnvilGraphQLError(AnvilException):
+    """A GraphQL query returned errors, e.g. for an eid that wasn't found.
+
+    `errors` are the GraphQL errors as returned by the API.
+    """
+
+    def __init__(self, message: str = "", errors: Optional[List[Any]] = None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+def graphql_error_message(errors: List[Any]) -> str:
+    """Get a message for GraphQL `errors`, from the first one."""
+    error = errors[0]
+    return error.get("message", str(error)) if isinstance(error, dict) else str(error)
+
+
+def exception_for_status(
+    status_code: int, message: str, **kwargs
+) -> AnvilRequestException:
+    """Get the exception matching an unsuccessful HTTP status code."""
+    if status_code == 429:
+        return AnvilRateLimitException(message, **kwargs)
+    if status_code == 408:
+        return AnvilTimeoutError(message, status_code=status_code, **kwargs)
+    if 400 <= status_code < 500:
+        return AnvilClientError(message, status_code=status_code, **kwargs)
+    if status_code >= 500:
+        return AnvilServerError(message, status_code=status_code, **kwargs)
+    return AnvilRequestException(message, status_code=status_code, **kwargs)
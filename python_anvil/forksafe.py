@@ -0,0 +1,64 @@
+"""State that is reset in the child process after `os.fork()`.
+
+Only the thread that calls `os.fork()` is copied into the child. A lock
+held by any other thread at that moment stays locked in the child forever,
+so locks shared between threads are replaced there with new ones.
+"""
+
+import os
+import threading
+import weakref
+from typing import Any
+
+
+# Objects whose `after_fork()` is called in the child process.
+_registered: "weakref.WeakSet[Any]" = weakref.WeakSet()
+
+
+def register_after_fork(obj: Any):
+    """Call `obj.after_fork()` in the child process after `os.fork()`.
+
+    `obj` is held with a weak reference, so it isn't kept alive.
+    """
+    _registered.add(obj)
+
+
+def _after_fork_in_child():
+    for obj in list(_registered):
+        obj.after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+class ForkSafeLock:
+    """A `threading.Lock` that's replaced with a new one in a forked child.
+
+    Usage:
+        >> self._lock = ForkSafeLock()
+        >> with self._lock:
+        >>     ...
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        register_after_fork(self)
+
+    def __enter__(self):
+        return self._lock.__enter__()
+
+    def __exit__(self, *args):
+        return self._lock.__exit__(*args)
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        return self._lock.acquire(blocking, timeout)
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def after_fork(self):
+        self._lock = threading.Lock()
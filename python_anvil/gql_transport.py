@@ -0,0 +1,184 @@
+"""GraphQL transport used by `GQLClient`, the sync counterpart of `async_http`."""
+
+import json
+import requests
+from gql.transport.exceptions import (
+    TransportClosed,
+    TransportProtocolError,
+    TransportServerError,
+)
+from gql.transport.requests import RequestsHTTPTransport
+from gql.utils import extract_files
+from graphql import DocumentNode, ExecutionResult, OperationType, get_operation_ast
+from requests_toolbelt.multipart.encoder import MultipartEncoder
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional
+
+from .query_cache import print_query
+
+
+if TYPE_CHECKING:
+    from .http import HTTPClient, Timeout
+
+
+class _HTTPClientSession:
+    """Minimal `requests.Session` stand-in that sends through an `HTTPClient`."""
+
+    def __init__(self, client: "HTTPClient"):
+        self.client = client
+
+    def request(self, method, url, **kwargs) -> requests.Response:
+        # gql always passes a `timeout`, leave it to the client if not set.
+        if kwargs.get("timeout") is None:
+            kwargs.pop("timeout", None)
+        return self.client.do_request(method, url, **kwargs)
+
+    def close(self):
+        # The connection pool belongs to the `HTTPClient`.
+        pass
+
+
+class HTTPClientTransport(RequestsHTTPTransport):
+    """gql transport that sends GraphQL requests through an `HTTPClient`.
+
+    This replaces the separate `requests` session `RequestsHTTPTransport`
+    would open, so GraphQL requests go through the same rate limiter, retry
+    policy and connection pool as REST requests.
+    """
+
+    def __init__(self, http_client: "HTTPClient", url: str, **kwargs):
+        super().__init__(url=url, **kwargs)
+        self.http_client = http_client
+        self.session = _HTTPClientSession(http_client)  # type: ignore
+
+    def connect(self):
+        # `Client.execute` connects and closes the transport around every
+        # request, including ones made at the same time from other threads.
+        # The session only wraps the long-lived `HTTPClient`, so it stays
+        # open throughout.
+        pass
+
+    def close(self):
+        # The connection pool belongs to the `HTTPClient`.
+        pass
+
+    def execute(  # type: ignore
+        self,
+        document: DocumentNode,
+        variable_values: Optional[Dict[str, Any]] = None,
+        operation_name: Optional[str] = None,
+        timeout: "Timeout" = None,
+        extra_args: Optional[Dict[str, Any]] = None,
+        upload_files: bool = False,
+        deadline: Optional[float] = None,
+    ) -> ExecutionResult:
+        """Send a GraphQL request.
+
+        Works like `RequestsHTTPTransport.execute`, except the query is sent
+        as returned by `print_query`, so cached documents aren't printed
+        again for every request.
+        """
+        if not self.session:
+            raise TransportClosed("Transport is not connected")
+
+        payload: Dict[str, Any] = {"query": print_query(document)}
+        if operation_name:
+            payload["operationName"] = operation_name
+
+        # Queries can be retried and hedged like any idempotent request.
+        # Mutations are never hedged, and only retried when they never
+        # reached the server.
+        query = is_query(document, operation_name)
+        post_args: Dict[str, Any] = {
+            "headers": self.headers,
+            "auth": self.auth,
+            "cookies": self.cookies,
+            "timeout": timeout or self.default_timeout,
+            "verify": self.verify,
+            "idempotent": query,
+            "hedge": query,
+        }
+        if deadline is not None:
+            post_args["deadline"] = deadline
+
+        if upload_files:
+            post_args.update(self._prepare_file_uploads(variable_values, payload))
+        else:
+            if variable_values:
+                payload["variables"] = variable_values
+            post_args["json"] = payload
+
+        post_args.update(self.kwargs)
+        post_args.update(extra_args or {})
+
+        response = self.session.request(  # type: ignore
+            self.method, self.url, **post_args
+        )
+        self.response_headers = response.headers
+        return _execution_result(response, self.json_deserialize)
+
+    def _prepare_file_uploads(
+        self, variable_values: Optional[Dict[str, Any]], payload: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Build a multipart body, following the GraphQL multipart request spec."""
+        assert variable_values is not None
+        nulled_variable_values, files = extract_files(
+            variables=variable_values, file_classes=self.file_classes
+        )
+        payload["variables"] = nulled_variable_values
+
+        fields: Dict[str, Any] = {
+            "operations": self.json_serialize(payload),
+            "map": self.json_serialize(
+                {str(i): [path] for i, path in enumerate(files)}
+            ),
+        }
+        for i, file in enumerate(files.values()):
+            name = getattr(file, "name", str(i))
+            content_type = getattr(file, "content_type", None)
+            fields[str(i)] = (
+                (name, file) if content_type is None else (name, file, content_type)
+            )
+
+        data = MultipartEncoder(fields=fields)
+        return {
+            "data": data,
+            "headers": {**(self.headers or {}), "Content-Type": data.content_type},
+        }
+
+
+def _execution_result(
+    response: requests.Response, json_deserialize: Callable[[str], Any]
+) -> ExecutionResult:
+    """Read a GraphQL response, as `RequestsHTTPTransport` does."""
+
+    def raise_response_error(reason: str):
+        try:
+            response.raise_for_status()
+        except requests.HTTPError as e:
+            raise TransportServerError(str(e), e.response.status_code) from e
+        raise TransportProtocolError(
+            f"Server did not return a GraphQL result: {reason}: {response.text}"
+        )
+
+    try:
+        if json_deserialize is json.loads:
+            result = response.json()
+        else:
+            result = json_deserialize(response.text)
+    except Exception:  # pylint: disable=broad-except
+        raise_response_error("Not a JSON answer")
+
+    if "errors" not in result and "data" not in result:
+        raise_response_error('No "data" or "errors" keys in answer')
+
+    return ExecutionResult(
+        errors=result.get("errors"),
+        data=result.get("data"),
+        extensions=result.get("extensions"),
+    )
+
+
+def is_query(document: DocumentNode, operation_name: Optional[str] = None) -> bool:
+    """Check whether the operation to run in `document` is a query."""
+    operation = get_operation_ast(document, operation_name)
+    return operation is not None and operation.operation == OperationType.QUERY
@@ -0,0 +1,91 @@
+"""Hedged requests, to cut tail latency on idempotent reads."""
+
+from collections import deque
+from logging import getLogger
+from typing import Deque, Optional
+
+from .forksafe import ForkSafeLock
+from .retry import RetryBudget
+
+
+logger = getLogger(__name__)
+
+
+class HedgePolicy:
+    """Decides when a slow request gets a second copy sent ("hedged").
+
+    If a response hasn't arrived after the `percentile` of recent response
+    times, the same request is sent again and whichever response arrives
+    first is used. Only a few requests are slower than that, so hedging
+    them costs few extra requests but removes most of the slow tail.
+
+    Only GET and HEAD requests and GraphQL queries are hedged, never
+    mutations. Each hedge needs a token from the client's rate limiter
+    without waiting for it, and is withdrawn from `budget`, so hedging
+    stops when requests are already being throttled.
+
+    Usage:
+        >> anvil = Anvil(api_key="my_key", hedge_policy=HedgePolicy(percentile=95))
+
+    :param percentile: Percentile of recent response times to wait before
+        hedging.
+    :param initial_delay: Seconds to wait before hedging until `min_samples`
+        response times have been seen.
+    :param min_delay: Lower bound of the wait, in seconds.
+    :param max_delay: Upper bound of the wait, in seconds.
+    :param window: Number of recent response times to keep.
+    :param min_samples: Number of response times needed to use the
+        percentile.
+    :param budget: Caps hedges to a fraction of requests. Defaults to 10%.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95,
+        initial_delay: float = 1.0,
+        min_delay: float = 0.05,
+        max_delay: float = 5.0,
+        window: int = 200,
+        min_samples: int = 20,
+        budget: Optional[RetryBudget] = None,
+    ):
+        if not 0 < percentile < 100:
+            raise ValueError("`percentile` must be between 0 and 100")
+
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.budget = (
+            budget if budget is not None else RetryBudget(ratio=0.1, min_retries=5)
+        )
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._lock = ForkSafeLock()
+
+    def record(self, latency: float):
+        """Record the response time of a request, in seconds."""
+        with self._lock:
+            self._latencies.append(latency)
+
+    def delay(self) -> float:
+        """Seconds to wait for a response before hedging."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < self.min_samples:
+            delay = self.initial_delay
+        else:
+            index = round(self.percentile / 100 * (len(latencies) - 1))
+            delay = latencies[index]
+        return min(self.max_delay, max(self.min_delay, delay))
+
+
+def should_hedge(method: str, hedge: Optional[bool]) -> bool:
+    """Check whether a request may be hedged.
+
+    :param hedge: Whether the request is a read that is safe to send twice,
+        e.g. a GraphQL query. `None` allows it for GET and HEAD requests.
+    """
+    if hedge is None:
+        return method.upper() in ("GET", "HEAD")
+    return hedge
@@ -1,52 +1,166 @@
+import contextlib
+import gzip
+import json
 import os
-
-# import json
 import requests
 from base64 import b64encode
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
 from gql import Client
 from gql.dsl import DSLSchema
-from gql.transport.requests import RequestsHTTPTransport
 from logging import getLogger
-from ratelimit import limits, sleep_and_retry
-from ratelimit.exception import RateLimitException
-from requests.auth import HTTPBasicAuth
-from typing import Optional
+from requests.adapters import HTTPAdapter
+from requests.auth import AuthBase, HTTPBasicAuth
+from time import monotonic, sleep, time
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    Optional,
+    Tuple,
+    Union,
+)
+from urllib3.exceptions import NewConnectionError
+
+from python_anvil.exceptions import (
+    AnvilConnectionError,
+    AnvilDownloadError,
+    AnvilRateLimitException,
+    AnvilRequestException,
+    AnvilTimeoutError,
+)
+
+from .breaker import CircuitBreaker
+from .constants import (
+    ANVIL_HOST,
+    COMPRESSIONS,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_COMPRESSION_THRESHOLD,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_TIMEOUT,
+    GRAPHQL_ENDPOINT,
+    IDEMPOTENT_METHODS,
+    RETRIES_LIMIT,
+)
+from .download import ERROR, WRITE, ResumableDownload
+from .forksafe import ForkSafeLock, register_after_fork
+from .gql_transport import HTTPClientTransport
+from .hedge import HedgePolicy, should_hedge
+from .limiter import BaseLimiter, create_limiter
+from .retry import RetryPolicy
+
+# `get_local_schema` used to live here, and is still imported from here.
+# pylint: disable-next=unused-import
+from .schema import DEFAULT_INTROSPECTION_TTL, create_client, get_local_schema
+
 
-from python_anvil.exceptions import AnvilRequestException
+logger = getLogger(__name__)
 
-from .constants import GRAPHQL_ENDPOINT, RATELIMIT_ENV, REQUESTS_LIMIT, RETRIES_LIMIT
+Timeout = Union[None, float, Tuple[Optional[float], Optional[float]]]
 
 
-logger = getLogger(__name__)
+class NoAuth(AuthBase):
+    """Send a request without the client's API key, e.g. to another host.
+
+    Works as the `auth` of both `HTTPClient` and `AsyncHTTPClient`.
+    """
+
+    def __call__(self, request):
+        return request
 
 
 def _handle_request_error(e: Exception):
     raise e
 
 
-def get_local_schema(raise_on_error=False) -> Optional[str]:
+def _wrap_request_error(e: Exception) -> AnvilRequestException:
+    """Convert a `requests` exception into a typed Anvil exception."""
+    if isinstance(e, requests.Timeout):
+        return AnvilTimeoutError(f"Request timed out: {e}")
+    return AnvilConnectionError(f"Connection failed: {e}")
+
+
+def _request_not_sent(e: Exception) -> bool:
+    """Check whether a failed request is known to never have reached the server."""
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], "reason", None) if e.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def _cap_timeout(timeout: Timeout, remaining: Optional[float]) -> Timeout:
+    """Limit a `requests` timeout to the time remaining before a deadline."""
+    if remaining is None:
+        return timeout
+    if isinstance(timeout, tuple):
+        return tuple(remaining if t is None else min(t, remaining) for t in timeout)
+    return remaining if timeout is None else min(timeout, remaining)
+
+
+def get_compressor(compression: str) -> Callable[[bytes], bytes]:
+    """Get a function that compresses request bodies with `compression`.
+
+    :param compression: `gzip`, or `zstd`, which requires the `zstandard`
+        package.
     """
-    Retrieve local GraphQL schema.
+    if compression == "gzip":
+        return gzip.compress
+    if compression == "zstd":
+        try:
+            import zstandard  # pylint: disable=import-outside-toplevel
+        except ImportError as e:
+            raise ImportError(
+                "zstd compression requires the `zstandard` package. "
+                "Install it with `pip install python-anvil[zstd]`."
+            ) from e
+        # Compressors aren't thread-safe, so use a new one each time.
+        return lambda body: zstandard.ZstdCompressor().compress(body)
+    raise ValueError(
+        f"Unsupported compression {compression!r}, use one of {COMPRESSIONS}"
+    )
 
-    :param raise_on_error:
-    :return:
+
+def _compress_body(
+    compression: str, threshold: int, headers, data, kwargs: Dict[str, Any]
+) -> Optional[Tuple[bytes, Dict[str, str]]]:
+    """Compress a JSON or raw request body of at least `threshold` bytes.
+
+    :return: The compressed body and the headers to send it with, or `None`
+        if the body is left as is.
+    """
+    headers = dict(headers or {})
+    if data is None and kwargs.get("json") is not None:
+        body = json.dumps(kwargs["json"], separators=(",", ":")).encode()
+        headers.setdefault("Content-Type", "application/json")
+    elif isinstance(data, (bytes, str)):
+        body = data.encode() if isinstance(data, str) else data
+    else:
+        # Nothing to send, or a form or file that is encoded later.
+        return None
+    if len(body) < threshold:
+        return None
+    headers["Content-Encoding"] = compression
+    return get_compressor(compression)(body), headers
+
+
+def parse_retry_after(value, default: float = 1) -> float:
+    """Get the number of seconds to wait from a `Retry-After` header value.
+
+    The header can either be a number of seconds or an HTTP date.
     """
+    if value is None:
+        return default
     try:
-        file_dir = os.path.dirname(os.path.realpath(__file__))
-        file_path = os.path.join(file_dir, "..", "schema", "anvil_schema.graphql")
-        with open(file_path, encoding="utf-8") as file:
-            schema = file.read()
-    except Exception:  # pylint: disable
-        logger.warning(
-            "Unable to find local schema. Will not use schema for local "
-            "validation. Use `fetch_schema_from_transport=True` to allow "
-            "fetching the remote schema."
-        )
-        if raise_on_error:
-            raise
-        schema = None
-
-    return schema
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time())
+    except (TypeError, ValueError):
+        return default
 
 
 def get_gql_ds(client: Client) -> DSLSchema:
@@ -70,15 +184,35 @@ class GQLClient:
     @staticmethod
     def get_client(
         api_key: str,
-        environment: str = "dev",  # pylint: disable=unused-argument
+        environment: str = "dev",
         endpoint_url: Optional[str] = None,
         fetch_schema_from_transport: bool = False,
         force_local_schema: bool = False,
+        http_client: Optional["HTTPClient"] = None,
+        introspection_ttl: float = DEFAULT_INTROSPECTION_TTL,
+        validate_queries: bool = True,
     ) -> Client:
+        """Create a GraphQL client.
+
+        Requests are sent through `http_client`, so that GraphQL and REST
+        requests share one connection pool, rate limiter and retry policy.
+        A new `HTTPClient` is created if one isn't provided.
+
+        The schema used to validate queries is built when the first query is
+        validated, and shared with every other client. See `SchemaCache`.
+
+        :param introspection_ttl: With `fetch_schema_from_transport`, seconds
+            to reuse a schema fetched by another client or process.
+        :param validate_queries: Validate queries against the schema before
+            sending them. Each query is only validated once.
+        """
         auth = HTTPBasicAuth(username=api_key, password="")
         endpoint_url = endpoint_url or GRAPHQL_ENDPOINT
-        transport = RequestsHTTPTransport(
-            retries=RETRIES_LIMIT,
+        if http_client is None:
+            http_client = HTTPClient(api_key=api_key, environment=environment)
+
+        transport = HTTPClientTransport(
+            http_client,
             auth=auth,
             url=endpoint_url,
             verify=True,
@@ -86,23 +220,225 @@ class GQLClient:
             # json_deserialize=json_deserialize,
         )
 
-        schema = None
-        if force_local_schema or not fetch_schema_from_transport:
-            schema = get_local_schema(raise_on_error=False)
-
-        return Client(
-            schema=schema,
-            transport=transport,
+        return create_client(
+            transport,
+            url=endpoint_url,
             fetch_schema_from_transport=fetch_schema_from_transport,
+            force_local_schema=force_local_schema,
+            introspection_ttl=introspection_ttl,
+            validate_queries=validate_queries,
         )
 
 
+Output = Union[str, "os.PathLike[str]", IO[bytes]]
+
+
+def _open_output(output: Output):
+    """Open `output` for writing, unless it's already a file object."""
+    if hasattr(output, "write"):
+        return contextlib.nullcontext(output)
+    return open(output, "wb")  # type: ignore  # pylint: disable=consider-using-with
+
+
+class StreamedContent:
+    """Body of a streamed response, downloaded in chunks as it's read.
+
+    Iterate over it to get the body in chunks of `chunk_size` bytes, or use
+    `write_to()` to save it to a file. Either way, only one chunk is held in
+    memory at a time. The connection is released once the body has been
+    read, or when `close()` is called.
+
+    Usage:
+        >> with anvil.download_documents(eid, stream=True) as content:
+        >>     for chunk in content:
+        >>         upload_part(chunk)
+    """
+
+    def __init__(
+        self, response: requests.Response, chunk_size: int = DEFAULT_CHUNK_SIZE
+    ):
+        self.response = response
+        self.chunk_size = chunk_size
+
+    def __iter__(self) -> Iterator[bytes]:
+        try:
+            yield from self.response.iter_content(self.chunk_size)
+        finally:
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read(self) -> bytes:
+        """Read the whole body into memory."""
+        return b"".join(self)
+
+    def write_to(self, output: Output) -> int:
+        """Write the body to a file path or a binary file object.
+
+        Chunks are written as they arrive, so the file fills up while the
+        download is still in progress.
+
+        :return: The number of bytes written.
+        """
+        written = 0
+        with _open_output(output) as file:
+            for chunk in self:
+                file.write(chunk)
+                written += len(chunk)
+        return written
+
+    def close(self):
+        self.response.close()
+
+
+def _close_response(future: "Future[requests.Response]"):
+    if future.exception() is None:
+        future.result().close()
+
+
 class HTTPClient:
-    def __init__(self, api_key=None, environment="dev"):
-        self._session = requests.Session()
+    def __init__(
+        self,
+        api_key=None,
+        environment="dev",
+        limiter: Optional[BaseLimiter] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        pool_connections: int = DEFAULT_POOL_SIZE,
+        pool_maxsize: int = DEFAULT_POOL_SIZE,
+        keep_alive: bool = True,
+        timeout: Timeout = DEFAULT_TIMEOUT,
+        http2: bool = False,
+        http2_connections: int = 1,
+        http2_max_streams: Optional[int] = None,
+        compression: Optional[str] = None,
+        compression_threshold: int = DEFAULT_COMPRESSION_THRESHOLD,
+        hedge_policy: Optional[HedgePolicy] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+    ):
+        """Create an HTTP client.
+
+        :param pool_connections: Number of hosts to keep connection pools for.
+        :param pool_maxsize: Maximum number of connections kept open per host.
+            Raise this when many threads share one client.
+        :param keep_alive: Whether to reuse connections between requests.
+        :param timeout: Default timeout in seconds for each request, either a
+            number or a `(connect, read)` tuple. `None` waits forever.
+        :param http2: Send HTTPS requests over HTTP/2, so that concurrent
+            requests share a few multiplexed connections. Requires the `httpx`
+            and `h2` packages.
+        :param http2_connections: Number of HTTP/2 connections per host to
+            spread concurrent requests over. See `HTTP2Adapter`.
+        :param http2_max_streams: Maximum number of concurrent requests on
+            each HTTP/2 connection. See `HTTP2Adapter`.
+        :param compression: Compress JSON request bodies with `gzip` or
+            `zstd`. Off by default. Responses are compressed either way, as
+            negotiated by `Accept-Encoding`.
+        :param compression_threshold: Minimum size in bytes of a request body
+            to compress. Smaller bodies are sent as is.
+        :param hedge_policy: Send a second copy of slow reads, and use
+            whichever response arrives first. Off by default. See
+            `HedgePolicy`.
+        :param circuit_breaker: Fail fast while an endpoint keeps failing.
+            Off by default. See `CircuitBreaker`.
+        """
+        if compression is not None:
+            # Fail early on a typo or a missing package.
+            get_compressor(compression)
+        self._session_options = dict(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            keep_alive=keep_alive,
+            http2=http2,
+            http2_connections=http2_connections,
+            http2_max_streams=http2_max_streams,
+        )
+        self._session = self._create_session(**self._session_options)
         self.api_key = api_key
-        global RATELIMIT_ENV  # pylint: disable=global-statement
-        RATELIMIT_ENV = environment
+        # Each client gets its own limiter so that separate keys (and
+        # environments) don't share a single budget.
+        self.limiter = limiter or create_limiter(environment=environment)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.timeout = timeout
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self.hedge_policy = hedge_policy
+        self._hedge_executor: Optional[ThreadPoolExecutor] = None
+        self._hedge_lock = ForkSafeLock()
+        self.circuit_breaker = circuit_breaker
+        self._pid = os.getpid()
+        register_after_fork(self)
+
+    @staticmethod
+    def _create_session(
+        pool_connections: int,
+        pool_maxsize: int,
+        keep_alive: bool,
+        http2: bool = False,
+        http2_connections: int = 1,
+        http2_max_streams: Optional[int] = None,
+    ) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        if http2:
+            # Imported here, since `httpx` is optional.
+            from .http2 import HTTP2Adapter  # pylint: disable=import-outside-toplevel
+
+            session.mount(
+                "https://",
+                HTTP2Adapter(
+                    connections=http2_connections,
+                    max_streams=http2_max_streams,
+                    pool_maxsize=pool_maxsize,
+                    keep_alive=keep_alive,
+                ),
+            )
+        if not keep_alive:
+            session.headers["Connection"] = "close"
+        return session
+
+    def close(self):
+        """Close all pooled connections."""
+        if self._pid != os.getpid():
+            # The connections belong to the parent process.
+            self.after_fork()
+        self._session.close()
+        if self._hedge_executor:
+            self._hedge_executor.shutdown(wait=False)
+            self._hedge_executor = None
+
+    def after_fork(self):
+        """Replace state inherited from the parent process after `os.fork()`.
+
+        The parent's pooled sockets are shared with the child, so using them
+        from both processes mixes up responses. The old session is dropped
+        without being closed, since the parent may still be using it.
+        """
+        self._pid = os.getpid()
+        self._session = self._create_session(**self._session_options)
+        self.limiter.after_fork()
+        # The executor's threads weren't copied into the child.
+        self._hedge_executor = None
+
+    def warmup(self, urls: Iterable[str] = (ANVIL_HOST, GRAPHQL_ENDPOINT)):
+        """Open a connection to each of `urls` ahead of the first real request.
+
+        This sends a `HEAD` request to each URL, so the TCP and TLS handshakes
+        don't add to the latency of the first API call. Failures are logged
+        and otherwise ignored.
+        """
+        for url in urls:
+            try:
+                self.do_request("HEAD", url, retry=False).close()
+            except AnvilRequestException as e:
+                logger.warning("Unable to warm up connection to %s: %s", url, e)
 
     def get_auth(self, encode=False) -> str:
         # TODO: Handle OAuth + API_KEY
@@ -117,11 +453,47 @@ class HTTPClient:
 
         return self.api_key
 
-    @sleep_and_retry
-    @limits(
-        calls=REQUESTS_LIMIT[RATELIMIT_ENV]["calls"],
-        period=REQUESTS_LIMIT[RATELIMIT_ENV]["seconds"],
-    )
+    def estimated_wait(self) -> float:
+        """Estimate how long a new request would wait for the rate limiter."""
+        return self.limiter.estimated_wait()
+
+    def _send(self, hedge: bool, *args, **kwargs) -> requests.Response:
+        """Send one attempt of a request, hedging it if it is slow."""
+        policy = self.hedge_policy
+        if not policy or not hedge:
+            return self._session.request(*args, **kwargs)
+
+        policy.budget.record_request()
+        started = monotonic()
+        executor = self._get_hedge_executor()
+        pending = {executor.submit(self._session.request, *args, **kwargs)}
+        done, _ = wait(pending, timeout=policy.delay())
+        if not done and policy.budget.try_spend() and self.limiter.acquire(timeout=0):
+            logger.debug("Request is slow, sending a hedged copy.")
+            pending.add(executor.submit(self._session.request, *args, **kwargs))
+
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    policy.record(monotonic() - started)
+                    # The loser can't be interrupted, release it when it's done.
+                    for loser in pending:
+                        loser.add_done_callback(_close_response)
+                    return future.result()
+                error = error or future.exception()
+        raise error  # type: ignore
+
+    def _get_hedge_executor(self) -> ThreadPoolExecutor:
+        with self._hedge_lock:
+            if not self._hedge_executor:
+                self._hedge_executor = ThreadPoolExecutor(
+                    max_workers=2 * self._session_options["pool_maxsize"],
+                    thread_name_prefix="anvil-hedge",
+                )
+            return self._hedge_executor
+
     def do_request(
         self,
         method,
@@ -132,42 +504,183 @@ class HTTPClient:
         params=None,
         retry=True,
         files=None,
+        idempotent: Optional[bool] = None,
+        timeout: Timeout = DEFAULT_TIMEOUT,
+        deadline: Optional[float] = None,
+        hedge: Optional[bool] = None,
         **kwargs,
     ) -> requests.Response:
-        for _ in range(5):
-            # Retry a max of 5 times in case of hitting any rate limit errors
-            res = self._session.request(
-                method,
-                url,
-                headers=headers,
-                data=data,
-                auth=auth,
-                params=params,
-                files=files,
-                **kwargs,
+        """Send a request, waiting for the rate limiter and retrying failures.
+
+        :param retry: Whether to retry rate-limited requests and transient
+            failures, as allowed by the client's `retry_policy`.
+        :param idempotent: Whether the request is safe to send more than
+            once. Defaults to `True` for GET, HEAD, OPTIONS, PUT and DELETE.
+            Non-idempotent requests are only retried if they never reached
+            the server.
+        :param timeout: Timeout in seconds for each attempt, either a number
+            or a `(connect, read)` tuple. Defaults to the client's `timeout`.
+        :param deadline: Maximum number of seconds for the whole call,
+            including rate limiter waits, retries and backoff. Raises
+            `AnvilTimeoutError` when it runs out.
+        :param hedge: Whether the request may be hedged by the client's
+            `hedge_policy`. Only set this for reads. Defaults to `True` for
+            GET and HEAD requests.
+
+        Raises `AnvilCircuitOpenError` without sending the request while the
+        client's `circuit_breaker` is open for the endpoint.
+        """
+        if self._pid != os.getpid():
+            # Fallback for forks that didn't run the `register_after_fork` hook.
+            self.after_fork()
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.timeout
+        # Streamed bodies are read later, so a hedge can't race them.
+        hedge = should_hedge(method, hedge) and not kwargs.get("stream")
+
+        deadline_at = None if deadline is None else monotonic() + deadline
+
+        def remaining() -> Optional[float]:
+            if deadline_at is None:
+                return None
+            return deadline_at - monotonic()
+
+        def out_of_time(wait: float = 0) -> bool:
+            left = remaining()
+            return left is not None and wait >= left
+
+        policy = self.retry_policy
+        policy.budget.record_request()
+        attempt = 0
+        rate_limited = 0
+
+        uncompressed = None
+        if self.compression and not files:
+            compressed = _compress_body(
+                self.compression, self.compression_threshold, headers, data, kwargs
             )
+            if compressed:
+                uncompressed = (data, headers, kwargs.pop("json", None))
+                data, headers = compressed
+
+        breaker = self.circuit_breaker
+        while True:
+            # Checked before the limiter, so an open circuit fails right away.
+            ticket = breaker.before_request(url) if breaker else None
+            if out_of_time() or not self.limiter.acquire(timeout=remaining()):
+                if ticket:
+                    breaker.cancel(ticket)  # type: ignore
+                raise AnvilTimeoutError(
+                    f"Deadline of {deadline:g} seconds exceeded before the "
+                    "request could be sent."
+                )
+            started = monotonic()
+            try:
+                res = self._send(
+                    hedge,
+                    method,
+                    url,
+                    headers=headers,
+                    data=data,
+                    auth=auth,
+                    params=params,
+                    files=files,
+                    timeout=_cap_timeout(timeout, remaining()),
+                    **kwargs,
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if ticket:
+                    breaker.record(ticket, monotonic() - started)  # type: ignore
+                error = _wrap_request_error(e)
+                if (
+                    retry
+                    and (idempotent or _request_not_sent(e))
+                    and policy.should_retry(attempt)
+                ):
+                    wait = policy.backoff(attempt)
+                    if not out_of_time(wait):
+                        attempt += 1
+                        logger.warning(
+                            "Request failed (%s). Retrying in %.2f seconds.", e, wait
+                        )
+                        sleep(wait)
+                        continue
+                raise error from e
+            except BaseException:
+                # Don't hold on to a half-open probe that never completed.
+                if ticket:
+                    breaker.cancel(ticket)  # type: ignore
+                raise
+
+            if ticket:
+                breaker.record(  # type: ignore
+                    ticket, monotonic() - started, res.status_code
+                )
+            self.limiter.observe(res.status_code, res.headers)
+
+            if res.status_code == 415 and uncompressed:
+                logger.warning(
+                    "Server rejected the %s request body, sending it uncompressed.",
+                    self.compression,
+                )
+                data, headers, kwargs["json"] = uncompressed
+                uncompressed = None
+                res.close()
+                continue
 
             if res.status_code == 429:
-                time_to_wait = int(res.headers.get("Retry-After", 1))
-                if retry:
-                    logger.warning(
-                        "Rate-limited: request not accepted. Retrying in "
-                        "%i second%s.",
-                        time_to_wait,
-                        's' if time_to_wait > 1 else '',
+                time_to_wait = parse_retry_after(res.headers.get("Retry-After"))
+                rate_limited += 1
+                if not retry or out_of_time(time_to_wait):
+                    res.close()
+                    raise AnvilRateLimitException(
+                        f"Rate limit exceeded. Retry after {time_to_wait:g} seconds.",
+                        retry_after=time_to_wait,
+                        headers=res.headers,
                     )
 
-                    # This exception will raise up to the `sleep_and_retry` decorator
-                    # which will handle waiting for `time_to_wait` seconds.
-                    raise RateLimitException("Retrying", period_remaining=time_to_wait)
-
-                raise AnvilRequestException(
-                    f"Rate limit exceeded. Retry after {time_to_wait} seconds."
+                logger.warning(
+                    "Rate-limited: request not accepted. Retrying in %g second%s.",
+                    time_to_wait,
+                    's' if time_to_wait != 1 else '',
                 )
 
-            break
+                # Pause the whole limiter, not just this request, so other
+                # requests on this client wait out the cooldown instead of
+                # collecting their own 429s. The retry then queues up behind
+                # them in the limiter.
+                self.limiter.pause(time_to_wait)
+
+                # Retry a max of 5 times in case of hitting any rate limit errors
+                if rate_limited < RETRIES_LIMIT:
+                    res.close()
+                    continue
+
+            elif (
+                retry
+                and idempotent
+                and res.status_code in policy.retry_statuses
+                and policy.should_retry(attempt)
+            ):
+                wait = policy.backoff(attempt)
+                if "Retry-After" in res.headers:
+                    wait = max(wait, parse_retry_after(res.headers["Retry-After"]))
+                # Out of time: hand back the failed response, as if the
+                # retries had run out.
+                if not out_of_time(wait):
+                    attempt += 1
+                    logger.warning(
+                        "Request failed with status %i. Retrying in %.2f seconds.",
+                        res.status_code,
+                        wait,
+                    )
+                    res.close()
+                    sleep(wait)
+                    continue
 
-        return res
+            return res
 
     def request(
         self,
@@ -190,11 +703,16 @@ class HTTPClient:
         :param auth:
         :param params:
         :param files:
-        :param retry: Whether to retry on any rate-limited requests
+        :param retry: Whether to retry rate-limited requests and transient
+            failures
+        :param kwargs.stream: Don't download the body right away. The content
+            returned is a `StreamedContent` instead of `bytes`.
+        :param kwargs.chunk_size: Chunk size for a streamed body.
         :param kwargs:
         :return:
         """
         parse_json = kwargs.pop("parse_json", False)
+        chunk_size = kwargs.pop("chunk_size", DEFAULT_CHUNK_SIZE)
         if self.api_key and not auth:
             auth = HTTPBasicAuth(self.get_auth(), "")
 
@@ -211,7 +729,9 @@ class HTTPClient:
                 **kwargs,
             )
 
-            if parse_json and res.headers.get("Content-Type") == "application/json":
+            if kwargs.get("stream"):
+                content = StreamedContent(res, chunk_size=chunk_size)
+            elif parse_json and res.headers.get("Content-Type") == "application/json":
                 content = res.json()
             else:
                 # This actually reads the content and can potentially cause issues
@@ -224,3 +744,83 @@ class HTTPClient:
             _handle_request_error(e)
 
         return content, status_code, res.headers
+
+    def download(
+        self,
+        url,
+        path: Union[str, "os.PathLike[str]"],
+        sha256: Optional[str] = None,
+        headers=None,
+        retry=True,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        deadline: Optional[float] = None,
+        **kwargs,
+    ):
+        """Download `url` to `path`, resuming where it left off after failures.
+
+        The file is written to `path` + ".part" and resumed with `Range`
+        requests, both when the connection drops in the middle of the
+        download and when a previous call left a partial file behind. Once
+        complete, its length and checksum are verified and it is moved to
+        `path`. See `ResumableDownload`.
+
+        :param sha256: Expected SHA-256 checksum of the file, in hex.
+        :param retry: Whether to retry interrupted downloads, as allowed by
+            the client's `retry_policy`. An attempt that made progress
+            doesn't count towards `max_retries`.
+        :param deadline: Maximum number of seconds for the whole download,
+            including retries.
+        :return: A `(content, status_code, headers)` tuple, like `request()`.
+            The content is the path of the file, or the body of an error
+            response.
+        """
+        if self.api_key and "auth" not in kwargs:
+            kwargs["auth"] = HTTPBasicAuth(self.get_auth(), "")
+
+        download = ResumableDownload(path, sha256=sha256)
+        deadline_at = None if deadline is None else monotonic() + deadline
+        policy = self.retry_policy
+        attempt = 0
+
+        while True:
+            offset = download.offset
+            res = self.do_request(
+                "GET",
+                url,
+                headers={**(headers or {}), **download.request_headers()},
+                retry=retry,
+                stream=True,
+                deadline=None if deadline_at is None else deadline_at - monotonic(),
+                **kwargs,
+            )
+            try:
+                with res:
+                    action = download.start(res.status_code, res.headers)
+                    if action == ERROR:
+                        return res.content, res.status_code, res.headers
+                    if action == WRITE:
+                        for chunk in res.iter_content(chunk_size):
+                            download.write(chunk)
+                return download.finish(), res.status_code, res.headers
+            except (requests.RequestException, AnvilDownloadError) as e:
+                download.close()
+                if download.offset > offset:
+                    attempt = 0
+                error = (
+                    e if isinstance(e, AnvilDownloadError) else _wrap_request_error(e)
+                )
+                wait = policy.backoff(attempt)
+                if (
+                    not retry
+                    or (deadline_at is not None and monotonic() + wait >= deadline_at)
+                    or not policy.should_retry(attempt)
+                ):
+                    raise error from e
+                attempt += 1
+                logger.warning(
+                    "Download interrupted at %i bytes (%s). Resuming in %.2f seconds.",
+                    download.offset,
+                    e,
+                    wait,
+                )
+                sleep(wait)
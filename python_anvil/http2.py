@@ -0,0 +1,336 @@
+"""HTTP/2 support for `HTTPClient`.
+
+Requires the optional `httpx` and `h2` packages.
+"""
+
+import os
+import ssl
+import threading
+from logging import getLogger
+from requests import Response
+from requests.adapters import BaseAdapter
+from requests.exceptions import (
+    ConnectionError as RequestsConnectionError,
+    ConnectTimeout,
+    ReadTimeout,
+)
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers, select_proxy
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from .constants import DEFAULT_POOL_SIZE
+
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None  # type: ignore
+
+
+logger = getLogger(__name__)
+
+# Connection-specific headers, which are not allowed in HTTP/2.
+HOP_BY_HOP_HEADERS = frozenset(
+    ["connection", "keep-alive", "proxy-connection", "transfer-encoding", "upgrade"]
+)
+
+# Size of the chunks read from file-like request bodies.
+BODY_CHUNK_SIZE = 2**16
+
+# The `verify`, `cert` and proxy of a request, which httpx sets per client.
+_ClientKey = Tuple[Union[bool, str], Union[None, str, Tuple[str, str]], Optional[str]]
+
+
+def _httpx_timeout(timeout) -> "httpx.Timeout":
+    """Convert a `requests` timeout into an `httpx.Timeout`."""
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
+
+
+def _connect_timeout(timeout) -> Optional[float]:
+    if isinstance(timeout, tuple):
+        return timeout[0]
+    return timeout
+
+
+def _iter_body(body) -> Iterator[bytes]:
+    if hasattr(body, "read"):
+        while True:
+            chunk = body.read(BODY_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk.encode() if isinstance(chunk, str) else chunk
+    else:
+        for chunk in body:
+            yield chunk.encode() if isinstance(chunk, str) else chunk
+
+
+def _content(body) -> Union[None, bytes, str, Iterator[bytes]]:
+    """Convert a `requests` body into `content` that httpx accepts.
+
+    Besides `bytes` and `str`, `requests` sends file-like bodies, e.g. the
+    `MultipartEncoder` of file uploads, and iterables of chunks. Those are
+    streamed to httpx as an iterator.
+    """
+    if body is None or isinstance(body, (bytes, str)):
+        return body
+    return _iter_body(body)
+
+
+def _ssl_context(
+    verify: Union[bool, str], cert: Union[None, str, Tuple[str, str]]
+) -> Union[bool, ssl.SSLContext]:
+    """Build the httpx `verify` for the `verify` and `cert` of `requests`."""
+    if isinstance(verify, str):
+        if os.path.isdir(verify):
+            context = ssl.create_default_context(capath=verify)
+        else:
+            context = ssl.create_default_context(cafile=verify)
+    elif cert is None:
+        return verify
+    else:
+        context = ssl.create_default_context()
+        if not verify:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+    if cert is not None:
+        if isinstance(cert, tuple):
+            context.load_cert_chain(*cert)
+        else:
+            context.load_cert_chain(cert)
+    return context
+
+
+def _wrap_httpx_error(e: Exception, url: str) -> Exception:
+    """Convert an `httpx` exception into the one `requests` would raise.
+
+    Connection failures are wrapped the way `requests` wraps them, so that
+    `HTTPClient` can tell that the request never reached the server.
+    """
+    if isinstance(e, (httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return ConnectTimeout(e)
+    if isinstance(e, httpx.TimeoutException):
+        return ReadTimeout(e)
+    if isinstance(e, httpx.ConnectError):
+        return RequestsConnectionError(
+            MaxRetryError(None, url, NewConnectionError(None, str(e)))  # type: ignore
+        )
+    return RequestsConnectionError(e)
+
+
+class _Connection:
+    """One `httpx.Client`, i.e. one multiplexed connection per host."""
+
+    def __init__(self, client: "httpx.Client", max_streams: Optional[int]):
+        self.client = client
+        self.in_flight = 0
+        self._streams = threading.BoundedSemaphore(max_streams) if max_streams else None
+
+    def acquire_stream(self, timeout: Optional[float] = None) -> bool:
+        if self._streams:
+            return self._streams.acquire(timeout=timeout)
+        return True
+
+    def release_stream(self):
+        if self._streams:
+            self._streams.release()
+
+
+class _RawResponse:
+    """File-like body of an `httpx.Response`, used as `requests.Response.raw`.
+
+    The body is already decompressed, so urllib3's `decode_content` and
+    other read options are accepted but ignored.
+    """
+
+    def __init__(self, response: "httpx.Response", on_close):
+        self._response = response
+        self._chunks = response.iter_bytes()
+        self._buffer = b""
+        self._on_close = on_close
+        self.reason = response.reason_phrase
+
+    def stream(  # pylint: disable=unused-argument
+        self, amt: int = 2**16, decode_content=None
+    ) -> Iterator[bytes]:
+        while True:
+            chunk = self.read(amt)
+            if not chunk:
+                return
+            yield chunk
+
+    def read(  # pylint: disable=unused-argument
+        self, amt: Optional[int] = None, **kwargs
+    ) -> bytes:
+        try:
+            while amt is None or len(self._buffer) < amt:
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    self.close()
+                    break
+                self._buffer += chunk
+        except httpx.HTTPError as e:
+            self.close()
+            raise _wrap_httpx_error(e, str(self._response.url)) from e
+
+        if amt is None:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def close(self):
+        if self._on_close:
+            self._response.close()
+            self._on_close()
+            self._on_close = None
+
+    def release_conn(self):
+        self.close()
+
+
+class HTTP2Adapter(BaseAdapter):
+    """`requests` transport adapter that sends requests over HTTP/2 with `httpx`.
+
+    Concurrent requests are multiplexed as streams over a few connections
+    per host instead of using one connection each.
+
+    The `verify`, `cert` and `proxies` of each request are applied like
+    `requests` does, with separate connections for each combination of them.
+    Settings from the environment, e.g. `HTTPS_PROXY`, are read by
+    `requests` and passed in that way too.
+
+    :param connections: Number of connections per host to spread streams
+        over. Streams on one connection share a TCP stream, so a lost packet
+        or a slow download holds up every stream on it (head-of-line
+        blocking). More connections limit that, at the cost of handshakes.
+    :param max_streams: Maximum number of concurrent streams (in-flight
+        requests) on each connection. Further requests wait for a free
+        stream. `None` leaves it to the server's limit.
+    :param pool_maxsize: Maximum number of connections each underlying
+        client keeps open, e.g. to hosts that only speak HTTP/1.1.
+    :param keep_alive: Whether to reuse connections between requests.
+    """
+
+    def __init__(
+        self,
+        connections: int = 1,
+        max_streams: Optional[int] = None,
+        pool_maxsize: int = DEFAULT_POOL_SIZE,
+        keep_alive: bool = True,
+        **client_kwargs,
+    ):
+        if httpx is None:
+            raise ImportError(
+                "HTTP/2 requires the `httpx` and `h2` packages. "
+                "Install them with `pip install python-anvil[http2]`."
+            )
+        if connections < 1:
+            raise ValueError("`connections` must be at least 1")
+
+        super().__init__()
+        self._num_connections = connections
+        self._max_streams = max_streams
+        self._client_kwargs: Dict[str, Any] = {
+            "limits": httpx.Limits(
+                max_connections=pool_maxsize,
+                max_keepalive_connections=pool_maxsize if keep_alive else 0,
+            ),
+            # `requests` already applied the environment to each request.
+            "trust_env": False,
+            **client_kwargs,
+        }
+        self._pools: Dict[_ClientKey, List[_Connection]] = {}
+        self._lock = threading.Lock()
+        self._connections = self._pool((True, None, None))
+
+    def _pool(self, key: _ClientKey) -> List[_Connection]:
+        """Get the connections for a `verify`, `cert` and proxy."""
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                verify, cert, proxy = key
+                kwargs = dict(self._client_kwargs)
+                if key != (True, None, None):
+                    kwargs["verify"] = _ssl_context(verify, cert)
+                if proxy:
+                    kwargs["proxy"] = proxy
+                pool = self._pools[key] = [
+                    _Connection(httpx.Client(http2=True, **kwargs), self._max_streams)
+                    for _ in range(self._num_connections)
+                ]
+            return pool
+
+    def _checkout(
+        self,
+        pool: Optional[List[_Connection]] = None,
+        timeout: Optional[float] = None,
+    ) -> _Connection:
+        with self._lock:
+            conn = min(pool or self._connections, key=lambda c: c.in_flight)
+            conn.in_flight += 1
+        if not conn.acquire_stream(timeout):
+            with self._lock:
+                conn.in_flight -= 1
+            raise ConnectTimeout(
+                f"No HTTP/2 stream became free within {timeout:g} seconds"
+            )
+        return conn
+
+    def _checkin(self, conn: _Connection):
+        conn.release_stream()
+        with self._lock:
+            conn.in_flight -= 1
+
+    def send(
+        self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None
+    ) -> Response:
+        key: _ClientKey = (
+            verify,
+            tuple(cert) if isinstance(cert, list) else cert,  # type: ignore
+            select_proxy(request.url, proxies or {}),
+        )
+        conn = self._checkout(self._pool(key), _connect_timeout(timeout))
+        try:
+            res = conn.client.send(
+                conn.client.build_request(
+                    request.method,
+                    request.url,
+                    headers={
+                        k: v
+                        for k, v in request.headers.items()
+                        if k.lower() not in HOP_BY_HOP_HEADERS
+                    },
+                    content=_content(request.body),
+                    timeout=_httpx_timeout(timeout),
+                ),
+                stream=True,
+            )
+        except httpx.HTTPError as e:
+            self._checkin(conn)
+            raise _wrap_httpx_error(e, request.url) from e
+
+        response = Response()
+        response.status_code = res.status_code
+        response.headers = CaseInsensitiveDict(res.headers)
+        # The body is decompressed by httpx already, so the encoding and
+        # length headers no longer apply to it.
+        if response.headers.pop("Content-Encoding", None):
+            response.headers.pop("Content-Length", None)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = _RawResponse(res, on_close=lambda: self._checkin(conn))
+        response.reason = res.reason_phrase
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            for conn in pool:
+                conn.client.close()
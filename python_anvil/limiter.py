@@ -0,0 +1,572 @@
+"""Client-side rate limiting for Anvil API requests."""
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from logging import getLogger
+from typing import (
+    Any,
+    Callable,
+    Generator,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from .constants import REQUESTS_LIMIT
+from .forksafe import ForkSafeLock
+
+
+logger = getLogger(__name__)
+
+SQLITE_FILENAME = "ratelimit.db"
+
+# Header names checked, in order, for server rate limit information.
+LIMIT_HEADERS = ("X-RateLimit-Limit", "RateLimit-Limit")
+REMAINING_HEADERS = ("X-RateLimit-Remaining", "RateLimit-Remaining")
+RESET_HEADERS = ("X-RateLimit-Reset", "RateLimit-Reset")
+
+
+def default_sqlite_path() -> str:
+    """Get the default database file of the "sqlite" limiter backend.
+
+    The file is kept in a `python-anvil` directory under `$XDG_RUNTIME_DIR`
+    if it's set, or under the user's cache directory otherwise, so it can't
+    be read or replaced by other users.
+    """
+    base = os.environ.get("XDG_RUNTIME_DIR") or os.environ.get("XDG_CACHE_HOME")
+    if not base:
+        base = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "python-anvil", SQLITE_FILENAME)
+
+
+def _step(generator: Generator[float, None, bool]) -> Tuple[bool, Any]:
+    """Advance `generator`, returning `(done, value)` instead of raising.
+
+    `StopIteration` can't be raised through an asyncio future.
+    """
+    try:
+        return False, next(generator)
+    except StopIteration as e:
+        return True, e.value
+
+
+class RateLimitInfo(NamedTuple):
+    """Rate limit state reported by the server on a response."""
+
+    limit: Optional[float] = None
+    remaining: Optional[float] = None
+    # Seconds until the current window resets.
+    reset: Optional[float] = None
+
+
+def _header_value(headers: Mapping, names) -> Optional[float]:
+    for name in names:
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            # Some servers send a list of policies, e.g. "40, 40;w=1".
+            return float(str(value).split(",", 1)[0].split(";", 1)[0].strip())
+        except ValueError:
+            logger.debug("Unable to parse header %s: %s", name, value)
+    return None
+
+
+def parse_rate_limit_headers(
+    headers: Optional[Mapping], now: Optional[float] = None
+) -> RateLimitInfo:
+    """Read rate limit headers from a response.
+
+    Both the `X-RateLimit-*` and the IETF `RateLimit-*` headers are
+    supported. A reset value that looks like a unix timestamp is converted to
+    the number of seconds from `now`.
+
+    :param headers: Response headers. Lookups should be case-insensitive, as
+        with `requests` responses.
+    :param now: Current unix time, defaults to `time.time()`.
+    :return:
+    """
+    if not headers:
+        return RateLimitInfo()
+
+    reset = _header_value(headers, RESET_HEADERS)
+    if reset is not None and reset > 1_000_000_000:
+        reset = max(0.0, reset - (time.time() if now is None else now))
+
+    return RateLimitInfo(
+        limit=_header_value(headers, LIMIT_HEADERS),
+        remaining=_header_value(headers, REMAINING_HEADERS),
+        reset=reset,
+    )
+
+
+class BaseLimiter:
+    """Interface for rate limiters used by `HTTPClient`.
+
+    Every `HTTPClient` owns a limiter and calls `acquire()` before each
+    request is sent.
+    """
+
+    def acquire(self, tokens: int = 1, timeout: Optional[float] = None) -> bool:
+        """Block until `tokens` may be spent.
+
+        :param tokens: Number of tokens (requests) to spend.
+        :param timeout: Maximum number of seconds to wait. `None` waits forever.
+        :return: `True` if the tokens were acquired, `False` on timeout.
+        """
+        raise NotImplementedError
+
+    def observe(self, status_code: int, headers: Optional[Mapping] = None):
+        """Inspect a response, e.g. to adjust the request rate.
+
+        :param status_code: HTTP status code of the response.
+        :param headers: Headers of the response.
+        """
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for `seconds`, e.g. after a 429 response.
+
+        Limiters that don't track a cooldown only make the caller wait.
+        """
+        time.sleep(seconds)
+
+    def estimated_wait(self) -> float:
+        """Estimate how long a new `acquire()` call would currently wait."""
+        return 0.0
+
+    async def acquire_async(
+        self, tokens: int = 1, timeout: Optional[float] = None
+    ) -> bool:
+        """Wait until `tokens` may be spent, without blocking the event loop.
+
+        Runs `acquire()` in a worker thread unless the limiter overrides this.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.acquire, tokens, timeout)
+
+    async def pause_async(self, seconds: float):
+        """Async version of `pause()`."""
+        await asyncio.sleep(seconds)
+
+    def close(self):
+        """Release any resources held by the limiter."""
+
+    def after_fork(self):
+        """Reset state that can't be shared with a forked child process.
+
+        Called in the child process by `HTTPClient` after `os.fork()`.
+        """
+
+
+class TokenBucketLimiter(BaseLimiter):
+    """Thread-safe, in-memory token bucket.
+
+    The bucket refills at `calls / period` tokens per second and holds at
+    most `burst` tokens, so short bursts are allowed while the long-term
+    rate stays at `calls` per `period`.
+
+    Callers that find the bucket empty reserve a future token instead of
+    polling for one, so they are released in FIFO order, spaced at the
+    allowed rate. `pause()` puts the whole bucket in a cooldown (e.g. after
+    a 429): no tokens accrue until it ends, and callers already waiting are
+    pushed back by the cooldown while keeping their order.
+
+    With `adaptive=True` the limiter adjusts `calls` from the responses it
+    observes (AIMD): the rate is cut by `decrease_factor` on a 429 or when the
+    server reports that the remaining budget can't sustain the current rate,
+    and raised by `increase_step` while the server reports spare capacity.
+    The rate never goes below `min_calls`, nor above the server's reported
+    limit or `max_calls`.
+
+    Usage:
+        >> limiter = TokenBucketLimiter(calls=40, period=1, burst=10)
+        >> anvil = Anvil(api_key="my_key", limiter=limiter)
+    """
+
+    def __init__(
+        self,
+        calls: float,
+        period: float = 1.0,
+        burst: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+        adaptive: bool = False,
+        min_calls: float = 1,
+        max_calls: Optional[float] = None,
+        increase_step: float = 1,
+        decrease_factor: float = 0.5,
+    ):
+        if calls <= 0 or period <= 0:
+            raise ValueError("`calls` and `period` must be positive numbers")
+        if not 0 < decrease_factor < 1:
+            raise ValueError("`decrease_factor` must be between 0 and 1")
+
+        self.calls = calls
+        self.period = period
+        # Without an explicit burst size, the bucket follows `calls`.
+        self._fixed_burst = burst is not None
+        self.burst = burst if burst is not None else max(1, int(calls))
+        if self.burst < 1:
+            raise ValueError("`burst` must be at least 1")
+
+        self.adaptive = adaptive
+        self.min_calls = min_calls
+        self.max_calls = max_calls
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = ForkSafeLock()
+        self._tokens = float(self.burst)
+        # May be in the future while the bucket is paused.
+        self._updated_at = clock()
+        # (started, until) of the latest cooldown seen by this instance.
+        self._cooldown = (float("-inf"), float("-inf"))
+
+    @classmethod
+    def for_environment(
+        cls, environment: str = "dev", burst: Optional[int] = None, **kwargs
+    ) -> "TokenBucketLimiter":
+        """Create a limiter using the default limits for an API key environment.
+
+        :param environment: The type of key being used, "dev" or "prod".
+        :param burst: Optional bucket size. Defaults to the per-period limit.
+        :param kwargs: Any other `TokenBucketLimiter` arguments.
+        :return:
+        """
+        if environment not in REQUESTS_LIMIT:
+            raise ValueError(
+                f"Invalid environment '{environment}'. "
+                f"Allowed values: {list(REQUESTS_LIMIT.keys())}"
+            )
+        limit = REQUESTS_LIMIT[environment]
+        return cls(calls=limit["calls"], period=limit["seconds"], burst=burst, **kwargs)
+
+    @property
+    def rate(self) -> float:
+        """Tokens added to the bucket per second."""
+        return self.calls / self.period
+
+    @contextmanager
+    def _state(self) -> Iterator[List[float]]:
+        """Lock the bucket and yield its state as `[tokens, updated_at]`.
+
+        Changes made to the yielded list are saved when the block exits.
+        """
+        with self._lock:
+            state = [self._tokens, self._updated_at]
+            yield state
+            self._tokens, self._updated_at = state
+
+    def _wait_time(self, state: List[float], now: float, tokens: float) -> float:
+        """Refill `state` up to `now` and get the wait until `tokens` are free."""
+        if now > state[1]:
+            state[0] = min(float(self.burst), state[0] + (now - state[1]) * self.rate)
+            state[1] = now
+
+        shortfall = max(0.0, tokens - state[0])
+        return (state[1] - now) + shortfall / self.rate
+
+    def reserve(
+        self, tokens: int = 1, timeout: Optional[float] = None
+    ) -> Optional[float]:
+        """Reserve `tokens` and get the number of seconds until they may be used.
+
+        :param tokens: Number of tokens (requests) to reserve.
+        :param timeout: Don't reserve anything if the wait would be longer
+            than this many seconds.
+        :return: Seconds to wait, or `None` if nothing was reserved.
+        """
+        if tokens > self.burst:
+            raise ValueError("Cannot acquire more tokens than the bucket size")
+
+        with self._state() as state:
+            wait = self._wait_time(state, self._clock(), tokens)
+            if timeout is not None and wait > timeout:
+                return None
+            state[0] -= tokens
+            return wait
+
+    def pause(self, seconds: float):
+        if seconds <= 0:
+            return
+
+        with self._state() as state:
+            now = self._clock()
+            self._wait_time(state, now, 0)
+            until = now + seconds
+            if until > state[1]:
+                # Start the bucket empty (keeping any queued reservations)
+                # once the cooldown ends, so waiting callers are released
+                # at the allowed rate instead of all at once.
+                state[0] = min(state[0], 0.0)
+                state[1] = until
+                self._cooldown = (now, until)
+
+        logger.debug("Pausing requests for %.3f seconds", seconds)
+
+    def estimated_wait(self) -> float:
+        with self._state() as state:
+            return max(0.0, self._wait_time(state, self._clock(), 1))
+
+    def _set_calls(self, calls: float):
+        ceiling = self.max_calls
+        calls = max(self.min_calls, calls if ceiling is None else min(ceiling, calls))
+        if calls != self.calls:
+            logger.debug(
+                "Adjusting rate limit from %.2f to %.2f calls", self.calls, calls
+            )
+        self.calls = calls
+        if not self._fixed_burst:
+            self.burst = max(1, int(calls))
+
+    def observe(self, status_code: int, headers: Optional[Mapping] = None):
+        if not self.adaptive:
+            return
+
+        info = parse_rate_limit_headers(headers)
+        with self._lock:
+            if status_code == 429:
+                self._set_calls(self.calls * self.decrease_factor)
+                return
+
+            if info.remaining is None:
+                # Without any feedback from the server there's nothing to
+                # safely increase towards.
+                return
+
+            if info.reset:
+                # Calls per `period` the remaining budget can sustain until
+                # the window resets.
+                sustainable = info.remaining / info.reset * self.period
+                if sustainable < self.calls:
+                    self._set_calls(max(sustainable, self.calls * self.decrease_factor))
+                    return
+
+            if info.remaining > 0:
+                calls = self.calls + self.increase_step
+                if info.limit:
+                    calls = min(calls, info.limit)
+                self._set_calls(calls)
+
+    def try_acquire(self, tokens: int = 1) -> bool:
+        """Spend `tokens` if they are available right now, without waiting."""
+        return self.reserve(tokens, timeout=0) is not None
+
+    def _waits(
+        self, tokens: int = 1, timeout: Optional[float] = None
+    ) -> Generator[float, None, bool]:
+        """Reserve `tokens` and yield the seconds to sleep before using them.
+
+        Shared by `acquire` and `acquire_async`, which only differ in how
+        they sleep. Returns `True` once the tokens may be used, or `False`
+        on timeout.
+        """
+        reserved_at = self._clock()
+        wait = self.reserve(tokens, timeout=timeout)
+        if wait is None:
+            return False
+
+        wake_at = reserved_at + wait
+        deadline = None if timeout is None else reserved_at + timeout
+        while True:
+            remaining = wake_at - self._clock()
+            if remaining > 0:
+                logger.debug("Rate limit reached, waiting %.3f seconds", remaining)
+                yield remaining
+
+            started, until = self._cooldown
+            if started < reserved_at or until <= self._clock():
+                return True
+
+            # A cooldown began while we were waiting. Keep our place in line
+            # by waiting out the cooldown on top of what was left.
+            wake_at = until + max(0.0, wake_at - started)
+            reserved_at = started
+            if deadline is not None and wake_at > deadline:
+                return False
+
+    def acquire(self, tokens: int = 1, timeout: Optional[float] = None) -> bool:
+        waits = self._waits(tokens, timeout)
+        try:
+            while True:
+                self._sleep(next(waits))
+        except StopIteration as e:
+            return e.value
+
+    async def acquire_async(
+        self, tokens: int = 1, timeout: Optional[float] = None
+    ) -> bool:
+        waits = self._waits(tokens, timeout)
+        try:
+            while True:
+                await asyncio.sleep(next(waits))
+        except StopIteration as e:
+            return e.value
+
+    async def pause_async(self, seconds: float):
+        # Pausing only updates the bucket, so there's nothing to wait for.
+        self.pause(seconds)
+
+
+class SQLiteTokenBucketLimiter(TokenBucketLimiter):
+    """Token bucket shared by all processes on a host.
+
+    The bucket state is kept in a SQLite database, keyed by `key`, so that
+    every process using the same file and key draws from one budget. This
+    is useful for prefork servers (e.g. gunicorn workers) and for repeated
+    CLI runs.
+
+    Usage:
+        >> limiter = SQLiteTokenBucketLimiter(
+        >>     calls=40, period=1, key=api_key_bucket_key(api_key)
+        >> )
+    """
+
+    def __init__(
+        self,
+        calls: float,
+        period: float = 1.0,
+        burst: Optional[int] = None,
+        path: Optional[str] = None,
+        key: str = "default",
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+        **kwargs,
+    ):
+        # Wall-clock time is used by default since `time.monotonic` is not
+        # comparable between processes.
+        super().__init__(
+            calls, period=period, burst=burst, clock=clock, sleep=sleep, **kwargs
+        )
+        self.path = path or default_sqlite_path()
+        self.key = key
+        # Only the default directory is created, as private to the user.
+        self._create_dir = path is None
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self._create_dir:
+                os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+            conn = sqlite3.connect(
+                self.path,
+                timeout=30,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    @contextmanager
+    def _state(self) -> Iterator[List[float]]:
+        with self._lock:
+            conn = self._connect()
+            # `BEGIN IMMEDIATE` takes the database write lock, which
+            # serializes the read-modify-write across processes.
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT tokens, updated_at FROM buckets WHERE key = ?",
+                    (self.key,),
+                ).fetchone()
+                state = list(row) if row else [float(self.burst), self._clock()]
+                yield state
+                conn.execute(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, updated_at) "
+                    "VALUES (?, ?, ?)",
+                    (self.key, state[0], state[1]),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    async def acquire_async(
+        self, tokens: int = 1, timeout: Optional[float] = None
+    ) -> bool:
+        # Reserving tokens waits for the database lock, which may be held by
+        # other processes, so it's done in a worker thread.
+        loop = asyncio.get_running_loop()
+        waits = self._waits(tokens, timeout)
+        while True:
+            done, value = await loop.run_in_executor(None, _step, waits)
+            if done:
+                return value
+            await asyncio.sleep(value)
+
+    async def pause_async(self, seconds: float):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.pause, seconds)
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def after_fork(self):
+        super().after_fork()
+        # SQLite connections must not be used across a fork. The parent still
+        # owns this one, so drop it without closing it and reconnect lazily.
+        self._conn = None
+
+
+def api_key_bucket_key(api_key: Optional[str], environment: str = "dev") -> str:
+    """Build a bucket key for an API key without storing the key itself."""
+    digest = hashlib.sha256((api_key or "").encode()).hexdigest()[:32]
+    return f"{environment}:{digest}"
+
+
+LIMITER_BACKENDS = ["memory", "sqlite"]
+
+
+def create_limiter(
+    backend: str = "memory",
+    environment: str = "dev",
+    api_key: Optional[str] = None,
+    path: Optional[str] = None,
+    burst: Optional[int] = None,
+    adaptive: bool = False,
+) -> TokenBucketLimiter:
+    """Create a limiter with the default limits for `environment`.
+
+    :param backend: "memory" for a limiter local to this client, or "sqlite"
+        to share one budget per API key across processes on this host.
+    :param environment: The type of key being used, "dev" or "prod".
+    :param api_key: API key the budget belongs to. Only used by shared backends.
+    :param path: Database path for the "sqlite" backend.
+    :param burst: Optional bucket size. Defaults to the per-period limit.
+    :param adaptive: Adjust the rate from rate limit headers on responses.
+    :return:
+    """
+    if backend == "memory":
+        return TokenBucketLimiter.for_environment(
+            environment, burst=burst, adaptive=adaptive
+        )
+
+    if backend == "sqlite":
+        return SQLiteTokenBucketLimiter.for_environment(
+            environment,
+            burst=burst,
+            adaptive=adaptive,
+            path=path,
+            key=api_key_bucket_key(api_key, environment),
+        )
+
+    raise ValueError(
+        f"Invalid limiter backend '{backend}'. Allowed values: {LIMITER_BACKENDS}"
+    )
@@ -0,0 +1,229 @@
+"""Coalesce concurrent lookups by eid into one aliased GraphQL request."""
+
+import asyncio
+import threading
+from collections.abc import Hashable
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .bulk import BulkField, BulkItem
+from .constants import DEFAULT_BULK_CHUNK_SIZE, DEFAULT_COALESCE_WINDOW
+from .forksafe import register_after_fork
+
+
+# Fetches a batch: `(field, eids, fields, arguments)` to results by eid.
+Fetch = Callable[
+    [BulkField, List[str], Optional[List[str]], Dict[str, Any]],
+    Dict[str, BulkItem],
+]
+AsyncFetch = Callable[
+    [BulkField, List[str], Optional[List[str]], Dict[str, Any]],
+    Awaitable[Dict[str, BulkItem]],
+]
+
+
+def _batch_key(
+    field: BulkField, fields: Optional[List[str]], arguments: Optional[Dict[str, Any]]
+) -> Tuple[Hashable, ...]:
+    """Lookups can only share a request if they select the same fields."""
+    arguments = {k: v for k, v in (arguments or {}).items() if v is not None}
+    return field, tuple(fields or ()), tuple(sorted(arguments.items()))
+
+
+def _fetch_args(key: Tuple[Any, ...], eids: List[str]):
+    field, fields, arguments = key
+    return field, eids, list(fields) or None, dict(arguments)
+
+
+class _Batch:
+    def __init__(self):
+        self.futures: Dict[str, "Future[BulkItem]"] = {}
+        self.full = threading.Event()
+
+
+class Loader:
+    """Collects lookups made within `window` seconds into one request.
+
+    The first lookup of a batch waits `window` seconds, or until the batch
+    has `max_batch` eids, then fetches the whole batch with one aliased
+    query. Lookups made in the meantime, from other threads, wait for that
+    request. Lookups of the same eid in a batch share one result.
+
+    Only lookups selecting the same fields share a batch. Every lookup is
+    delayed by up to `window`, so this only pays off when many threads look
+    up objects at the same time, e.g. in a web server.
+
+    :param fetch: Fetches a batch, e.g. `Anvil._get_by_eid`.
+    :param window: Seconds to wait for more lookups.
+    :param max_batch: Maximum number of eids per request.
+    """
+
+    def __init__(
+        self,
+        fetch: Fetch,
+        window: float = DEFAULT_COALESCE_WINDOW,
+        max_batch: int = DEFAULT_BULK_CHUNK_SIZE,
+    ):
+        if window < 0 or max_batch < 1:
+            raise ValueError("`window` must be positive and `max_batch` at least 1")
+        self.window = window
+        self.max_batch = max_batch
+        self._fetch = fetch
+        self._pending: Dict[Tuple[Any, ...], _Batch] = {}
+        self._lock = threading.Lock()
+        register_after_fork(self)
+
+    def load(
+        self,
+        field: BulkField,
+        eid: str,
+        fields: Optional[List[str]] = None,
+        arguments: Optional[Dict[str, Any]] = None,
+    ) -> BulkItem:
+        """Look up one object, batched with concurrent lookups.
+
+        Raises the error of the whole request if it failed, e.g.
+        `AnvilServerError`. Errors for this object are in the result.
+        """
+        key = _batch_key(field, fields, arguments)
+        with self._lock:
+            batch = self._pending.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._pending[key] = _Batch()
+            future = batch.futures.get(eid)
+            if future is None:
+                future = batch.futures[eid] = Future()
+                if len(batch.futures) >= self.max_batch:
+                    # Later lookups start a new batch.
+                    del self._pending[key]
+                    batch.full.set()
+
+        if leader:
+            try:
+                batch.full.wait(self.window)
+                self._close(key, batch)
+                self._dispatch(key, batch)
+            finally:
+                # If the leader was interrupted before sending the batch,
+                # the other lookups in it mustn't wait forever.
+                self._close(key, batch)
+                for pending in batch.futures.values():
+                    pending.cancel()
+        return future.result()
+
+    def after_fork(self):
+        """Drop the parent's pending batches in a child after `os.fork()`.
+
+        Their leader threads don't exist in the child, so lookups joining
+        them would never get a result.
+        """
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _close(self, key: Tuple[Any, ...], batch: _Batch):
+        """Stop lookups from joining `batch`."""
+        with self._lock:
+            if self._pending.get(key) is batch:
+                del self._pending[key]
+
+    def _dispatch(self, key: Tuple[Any, ...], batch: _Batch):
+        try:
+            results = self._fetch(*_fetch_args(key, list(batch.futures)))
+        except BaseException as e:
+            for future in batch.futures.values():
+                future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        for eid, future in batch.futures.items():
+            future.set_result(results.get(eid, BulkItem(None)))
+
+
+class _AsyncBatch:
+    def __init__(self):
+        self.futures: Dict[str, "asyncio.Future[BulkItem]"] = {}
+        self.full = asyncio.Event()
+        self.task: Optional["asyncio.Task[None]"] = None
+
+
+class AsyncLoader:
+    """Collects lookups made within `window` seconds into one request.
+
+    Like `Loader`, for coroutines running on the same event loop.
+
+    :param fetch: Fetches a batch, e.g. `AsyncAnvil._get_by_eid`.
+    :param window: Seconds to wait for more lookups.
+    :param max_batch: Maximum number of eids per request.
+    """
+
+    def __init__(
+        self,
+        fetch: AsyncFetch,
+        window: float = DEFAULT_COALESCE_WINDOW,
+        max_batch: int = DEFAULT_BULK_CHUNK_SIZE,
+    ):
+        if window < 0 or max_batch < 1:
+            raise ValueError("`window` must be positive and `max_batch` at least 1")
+        self.window = window
+        self.max_batch = max_batch
+        self._fetch = fetch
+        self._pending: Dict[Tuple[Any, ...], _AsyncBatch] = {}
+
+    async def load(
+        self,
+        field: BulkField,
+        eid: str,
+        fields: Optional[List[str]] = None,
+        arguments: Optional[Dict[str, Any]] = None,
+    ) -> BulkItem:
+        """Look up one object, batched with concurrent lookups."""
+        key = _batch_key(field, fields, arguments)
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = _AsyncBatch()
+            batch.task = asyncio.get_running_loop().create_task(
+                self._dispatch(key, batch)
+            )
+            batch.task.add_done_callback(lambda _: self._close(key, batch))
+        future = batch.futures.get(eid)
+        if future is None:
+            future = batch.futures[eid] = asyncio.get_running_loop().create_future()
+            if len(batch.futures) >= self.max_batch:
+                del self._pending[key]
+                batch.full.set()
+        # Shielded, so that a cancelled caller doesn't cancel the result of
+        # others looking up the same eid.
+        return await asyncio.shield(future)
+
+    def _close(self, key: Tuple[Any, ...], batch: _AsyncBatch):
+        """Called when the batch's task is done, however it ended.
+
+        If the task was cancelled before sending the batch, possibly before
+        it even started, the lookups in it mustn't wait forever.
+        """
+        if self._pending.get(key) is batch:
+            del self._pending[key]
+        for future in batch.futures.values():
+            future.cancel()
+
+    async def _dispatch(self, key: Tuple[Any, ...], batch: _AsyncBatch):
+        try:
+            await asyncio.wait_for(batch.full.wait(), self.window)
+        except asyncio.TimeoutError:
+            pass
+        if self._pending.get(key) is batch:
+            del self._pending[key]
+
+        try:
+            results = await self._fetch(*_fetch_args(key, list(batch.futures)))
+        except BaseException as e:
+            for future in batch.futures.values():
+                if not future.done():
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        for eid, future in batch.futures.items():
+            if not future.done():
+                future.set_result(results.get(eid, BulkItem(None)))
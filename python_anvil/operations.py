@@ -0,0 +1,395 @@
+"""Request builders and response helpers shared by `Anvil`, `AsyncAnvil`
+and batches, so that they all send exactly the same requests."""
+
+import contextlib
+import logging
+import os
+import re
+from gql import gql
+from gql.transport.exceptions import TransportQueryError
+from graphql import DocumentNode
+from typing import Any, AnyStr, Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import quote
+
+from .api_resources.mutations import (
+    BaseQuery,
+    CreateEtchPacket,
+    ForgeSubmit,
+    GenerateEtchSigningURL,
+)
+from .api_resources.payload import (
+    CreateEtchPacketPayload,
+    FillPDFPayload,
+    ForgeSubmitPayload,
+    GeneratePDFPayload,
+)
+from .bulk import BulkItem
+from .casts import CAST_LIST_FIELDS, Cast
+from .query_cache import parse_query
+from .schema import skip_validation
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_return(res: Dict, get_data: Callable[[Dict], Union[Dict, List]]):
+    """Process response and get data from path if provided."""
+    _res = res
+    if "response" in res and "headers" in res:
+        _res = res["response"]
+        return {"response": get_data(_res), "headers": res["headers"]}
+    return get_data(_res)
+
+
+def fill_pdf_request(
+    template_id: str, payload: Union[dict, AnyStr, FillPDFPayload], kwargs: Dict
+) -> Tuple[str, Dict[str, Any]]:
+    """Validate a `fill_pdf` payload and get the URL path and JSON body.
+
+    Request options in `kwargs` are updated in place.
+    """
+    try:
+        if isinstance(payload, dict):
+            data = FillPDFPayload(**payload)
+        elif isinstance(payload, str):
+            data = FillPDFPayload.model_validate_json(payload)
+        elif isinstance(payload, FillPDFPayload):
+            data = payload
+        else:
+            raise ValueError("`payload` must be a valid JSON string or a dict")
+    except KeyError as e:
+        logger.exception(e)
+        raise ValueError(
+            "`payload` validation failed. Please make sure all required "
+            "fields are set. "
+        ) from e
+
+    version_number = kwargs.pop("version_number", None)
+    if version_number:
+        kwargs["params"] = dict(versionNumber=version_number)
+
+    # Filling a PDF has no side effects, so it's always safe to retry.
+    kwargs.setdefault("idempotent", True)
+
+    return (
+        f"fill/{template_id}.pdf",
+        data.model_dump(by_alias=True, exclude_none=True) if data else {},
+    )
+
+
+def generate_pdf_request(
+    payload: Union[AnyStr, Dict, GeneratePDFPayload], kwargs: Dict
+) -> Dict[str, Any]:
+    """Validate a `generate_pdf` payload and get the JSON body."""
+    if not payload:
+        raise ValueError("`payload` must be a valid JSON string or a dict")
+
+    if isinstance(payload, dict):
+        data = GeneratePDFPayload(**payload)
+    elif isinstance(payload, str):
+        data = GeneratePDFPayload.model_validate_json(payload)
+    elif isinstance(payload, GeneratePDFPayload):
+        data = payload
+    else:
+        raise ValueError("`payload` must be a valid JSON string or a dict")
+
+    # Generating a PDF has no side effects, so it's always safe to retry.
+    kwargs.setdefault("idempotent", True)
+
+    return data.model_dump(by_alias=True, exclude_none=True)
+
+
+def cast_query(
+    eid: str,
+    fields: Optional[List[str]] = None,
+    version_number: Optional[int] = None,
+    cast_args: Optional[List[Tuple[str, str]]] = None,
+) -> DocumentNode:
+    if not fields:
+        # Use default fields
+        fields = ["eid", "title", "fieldInfo"]
+
+    if not cast_args:
+        cast_args = []
+
+    cast_args.append(("eid", f'"{eid}"'))
+
+    # If `version_number` isn't provided, the API will default to the
+    # latest published version.
+    if version_number:
+        cast_args.append(("versionNumber", str(version_number)))
+
+    arg_str = ""
+    if len(cast_args):
+        joined_args = [(":".join(arg)) for arg in cast_args]
+        arg_str = f"({','.join(joined_args)})"
+
+    return gql(
+        f"""{{
+          cast {arg_str} {{
+            {" ".join(fields)}
+          }}
+        }}"""
+    )
+
+
+def casts_query(fields: Optional[List[str]] = None, show_all: bool = False):
+    if not fields:
+        # `fieldInfo` is left out, see `Cast`.
+        fields = CAST_LIST_FIELDS
+
+    cast_args = "" if show_all else "(isTemplate: true)"
+
+    # Only a few variations, so they can be cached.
+    return parse_query(
+        f"""{{
+          currentUser {{
+            organizations {{
+              casts {cast_args} {{
+                {" ".join(fields)}
+              }}
+            }}
+          }}
+        }}"""
+    )
+
+
+CURRENT_USER_QUERY = """{
+  currentUser {
+    name
+    email
+    eid
+    role
+    organizations {
+      eid
+      name
+      slug
+      casts {
+        eid
+        name
+      }
+    }
+  }
+}"""
+
+WELDS_QUERY = """{
+  currentUser {
+    organizations {
+      welds {
+        eid
+        slug
+        name
+        forges {
+          eid
+          name
+        }
+      }
+    }
+  }
+}"""
+
+WELD_QUERY = """
+query WeldQuery(
+    #$organizationSlug: String!,
+    #$slug: String!
+    $eid: String!
+) {
+    weld(
+        #organizationSlug: $organizationSlug,
+        #slug: $slug
+        eid: $eid
+    ) {
+        eid
+        slug
+        name
+        forges {
+            eid
+            name
+            slug
+        }
+    }
+}"""
+
+
+ETCH_PACKET_DOCUMENT_GROUP_QUERY = """
+query EtchPacketDocumentGroup($eid: String!) {
+    etchPacket(eid: $eid) {
+        documentGroup {
+            eid
+            status
+            files
+        }
+    }
+}"""
+
+
+def document_file_urls(
+    document_group: Union[str, Dict[str, Any]], filenames: Optional[List[str]]
+) -> Dict[str, str]:
+    """Get the download URL of each requested file in a document group.
+
+    URLs are either absolute, from the file listing, or relative to
+    `PlainRequest`.
+    """
+    if isinstance(document_group, str):
+        if filenames is None:
+            raise ValueError(
+                "`filenames` is required when `document_group` is an eid. "
+                "Pass the document group with its `files` to download all files."
+            )
+        return {
+            name: f"document-group/{document_group}/{quote(name)}" for name in filenames
+        }
+
+    eid = document_group["eid"]
+    listing = {
+        file["filename"]: file
+        for file in document_group.get("files") or []
+        if file.get("filename")
+    }
+    names = list(listing) if filenames is None else filenames
+    missing = [name for name in names if name not in listing]
+    if missing:
+        raise ValueError(
+            f"Files not found in document group {eid}: {', '.join(missing)}. "
+            f"Available files: {', '.join(listing)}"
+        )
+    return {
+        name: listing[name].get("downloadURL") or f"document-group/{eid}/{quote(name)}"
+        for name in names
+    }
+
+
+def document_file_outputs(output_dir, filenames: List[str]) -> Dict[str, Any]:
+    """Get the path in `output_dir` to save each file to.
+
+    Files keep their relative paths, without the parts that could lead
+    outside `output_dir`. Names that still collide get a number added.
+    """
+    outputs: Dict[str, Any] = {}
+    used = set()
+    for filename in filenames:
+        if output_dir is None:
+            outputs[filename] = None
+            continue
+        parts = [p for p in re.split(r"[\\/]+", filename) if p not in ("", ".", "..")]
+        relative = os.path.join(*parts) if parts else "document"
+        root, ext = os.path.splitext(relative)
+        count = 1
+        while os.path.normcase(relative) in used:
+            relative = f"{root} ({count}){ext}"
+            count += 1
+        used.add(os.path.normcase(relative))
+        outputs[filename] = os.path.join(output_dir, relative)
+    return outputs
+
+
+def make_parent_dir(path: Optional[str]):
+    if path is not None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+
+def get_casts_data(r: dict):
+    orgs = r["currentUser"]["organizations"]
+    return [item for org in orgs for item in org["casts"]]
+
+
+def get_welds_data(r: dict):
+    orgs = r["currentUser"]["organizations"]
+    return [item for org in orgs for item in org["welds"]]
+
+
+def create_etch_packet_mutation(
+    payload: Optional[
+        Union[
+            dict,
+            CreateEtchPacketPayload,
+            CreateEtchPacket,
+            AnyStr,
+        ]
+    ] = None,
+    json=None,
+) -> Tuple[CreateEtchPacket, Dict[str, Any]]:
+    """Build a `CreateEtchPacket` mutation and its variables."""
+    # Create an etch packet payload instance excluding signers and files
+    # (if any). We'll need to add those separately. below.
+    if not any([payload, json]):
+        raise TypeError('One of the arguments `payload` or `json` must exist')
+
+    if json:
+        payload = CreateEtchPacketPayload.model_validate_json(json)
+
+    if isinstance(payload, dict):
+        mutation = CreateEtchPacket.create_from_dict(payload)
+    elif isinstance(payload, CreateEtchPacketPayload):
+        mutation = CreateEtchPacket(payload=payload)
+    elif isinstance(payload, CreateEtchPacket):
+        mutation = payload
+    else:
+        raise ValueError("`payload` must be a valid CreateEtchPacket instance or dict")
+
+    variables = mutation.create_payload().model_dump(by_alias=True, exclude_none=True)
+    return mutation, variables
+
+
+def generate_etch_signing_url_mutation(
+    signer_eid: str, client_user_id: str
+) -> Tuple[GenerateEtchSigningURL, Dict[str, Any]]:
+    mutation = GenerateEtchSigningURL(
+        signer_eid=signer_eid,
+        client_user_id=client_user_id,
+    )
+    return mutation, mutation.create_payload().model_dump(by_alias=True)
+
+
+def forge_submit_mutation(
+    payload: Optional[Union[Dict[str, Any], ForgeSubmitPayload]] = None,
+    json=None,
+) -> Tuple[ForgeSubmit, Dict[str, Any]]:
+    if not any([json, payload]):
+        raise TypeError('One of arguments `json` or `payload` are required')
+
+    if json:
+        payload = ForgeSubmitPayload.model_validate_json(json)
+
+    if isinstance(payload, dict):
+        mutation = ForgeSubmit.create_from_dict(payload)
+    elif isinstance(payload, ForgeSubmitPayload):
+        mutation = ForgeSubmit(payload=payload)
+    else:
+        raise ValueError(
+            "`payload` must be a valid ForgeSubmitPayload instance or dict"
+        )
+
+    variables = mutation.create_payload().model_dump(by_alias=True, exclude_none=True)
+    return mutation, variables
+
+
+def update_casts(casts: List[Cast], fields: List[str], results: Dict[str, BulkItem]):
+    """Store the fields fetched by `load_cast_fields` in each cast."""
+    for cast in casts:
+        item = results.get(cast["eid"])
+        if item is not None and item.data is not None:
+            cast.update((f, item.data[f]) for f in fields if f in item.data)
+
+
+def item_data(item: BulkItem) -> Optional[Dict[str, Any]]:
+    """Get the data of a single lookup, raising its errors like `query` would."""
+    if item.error:
+        raise TransportQueryError(
+            str(item.error), errors=item.error.errors, data=item.data
+        )
+    return item.data
+
+
+def validation(validate: bool):
+    """Context for running a query with or without validating it."""
+    return contextlib.nullcontext() if validate else skip_validation()
+
+
+def to_document(query: Union[str, DocumentNode, BaseQuery]) -> DocumentNode:
+    if isinstance(query, BaseQuery):
+        return parse_query(query.get_mutation())
+    if isinstance(query, str):
+        return parse_query(query)
+    return query
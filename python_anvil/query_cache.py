@@ -0,0 +1,115 @@
+"""Cache of parsed GraphQL documents, so static queries are parsed once."""
+
+import threading
+from collections import OrderedDict
+from gql import gql
+from graphql import DocumentNode, print_ast
+from graphql.utilities import strip_ignored_characters
+from typing import Dict, NamedTuple, Optional
+
+from .forksafe import register_after_fork
+
+
+DEFAULT_CACHE_SIZE = 256
+
+
+class _Entry(NamedTuple):
+    document: DocumentNode
+    # The query without insignificant whitespace and comments, as sent.
+    printed: str
+
+
+class QueryCache:
+    """LRU cache of parsed GraphQL documents, keyed by their source.
+
+    Each document is stored with a minified copy of its source, which is
+    what gets sent to the API instead of printing the document again for
+    every request.
+
+    Documents must not be modified, since they're shared by every caller.
+
+    :param maxsize: Number of documents to keep.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # Documents aren't cheaply hashable, so they're looked up by `id()`.
+        self._by_id: Dict[int, _Entry] = {}
+        self._lock = threading.Lock()
+        register_after_fork(self)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def parse(self, source: str) -> DocumentNode:
+        """Parse `source`, or get the document parsed from it before.
+
+        Raises `graphql.GraphQLError` if `source` isn't valid GraphQL.
+        """
+        with self._lock:
+            entry = self._entries.get(source)
+            if entry is not None:
+                self._entries.move_to_end(source)
+                return entry.document
+
+        # Parsed outside the lock. Two threads may parse the same source at
+        # once, but both documents are equivalent.
+        entry = _Entry(gql(source), strip_ignored_characters(source))
+        with self._lock:
+            self._entries[source] = entry
+            self._by_id[id(entry.document)] = entry
+            while len(self._entries) > self.maxsize:
+                _, evicted = self._entries.popitem(last=False)
+                self._by_id.pop(id(evicted.document), None)
+        return entry.document
+
+    def printed(self, document: DocumentNode) -> Optional[str]:
+        """Get the minified query of a document returned by `parse()`.
+
+        Returns `None` for documents that aren't in the cache.
+        """
+        with self._lock:
+            entry = self._by_id.get(id(document))
+        # An evicted document's `id()` may have been reused.
+        if entry is not None and entry.document is document:
+            return entry.printed
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_id.clear()
+
+    def after_fork(self):
+        """Reset the cache in a child process after `os.fork()`.
+
+        Another thread may have been updating the cache when the process
+        forked, so the child starts with a new lock and an empty cache.
+        """
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._by_id = {}
+
+
+_cache = QueryCache()
+
+
+def parse_query(source: str) -> DocumentNode:
+    """Parse a GraphQL query, using the process-wide `QueryCache`.
+
+    Use this for queries that are the same on every call, not for queries
+    with values formatted into them, which would push the static ones out
+    of the cache.
+    """
+    return _cache.parse(source)
+
+
+def print_query(document: DocumentNode) -> str:
+    """Get the query text to send for `document`.
+
+    Documents from `parse_query()` use their cached, minified query. Others
+    are printed like `gql` would.
+    """
+    printed = _cache.printed(document)
+    return printed if printed is not None else print_ast(document)
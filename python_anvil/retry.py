@@ -0,0 +1,109 @@
+"""Retries for transient request failures."""
+
+import random
+from logging import getLogger
+from typing import Collection, Optional
+
+from .forksafe import ForkSafeLock
+
+
+logger = getLogger(__name__)
+
+RETRY_STATUSES = (408, 500, 502, 503, 504)
+
+
+class RetryBudget:
+    """Caps retries to a fraction of the requests being made.
+
+    Every request deposits `ratio` into the budget and every retry withdraws
+    one from it. Up to `min_retries` may be banked, so that a client with
+    little traffic can still retry. When an outage makes most requests fail,
+    retries stop once the budget is spent instead of multiplying the load.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_retries: int = 10):
+        if ratio < 0 or min_retries < 0:
+            raise ValueError("`ratio` and `min_retries` can't be negative")
+
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self._balance = float(min_retries)
+        self._lock = ForkSafeLock()
+
+    @property
+    def balance(self) -> float:
+        return self._balance
+
+    def record_request(self):
+        """Deposit `ratio` for a new (non-retry) request."""
+        with self._lock:
+            self._balance = min(
+                float(max(self.min_retries, 1)), self._balance + self.ratio
+            )
+
+    def try_spend(self) -> bool:
+        """Withdraw one retry from the budget, if there is one available."""
+        with self._lock:
+            if self._balance >= 1:
+                self._balance -= 1
+                return True
+            return False
+
+
+class RetryPolicy:
+    """Decides which failed requests are retried and how long to wait.
+
+    Failed requests are retried up to `max_retries` times when the response
+    status is in `retry_statuses`, or the request timed out, or the
+    connection failed. The wait between attempts grows exponentially from
+    `backoff_base` up to `backoff_max` seconds. With `jitter`, a random wait
+    between 0 and that value is used ("full jitter"), so that many clients
+    don't all retry at the same time.
+
+    Requests that are not idempotent are only retried if they never reached
+    the server.
+
+    A policy holds a `RetryBudget`. Clients that share a policy also share
+    its budget.
+
+    Usage:
+        >> policy = RetryPolicy(max_retries=5, backoff_max=10)
+        >> anvil = Anvil(api_key="my_key", retry_policy=policy)
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30,
+        jitter: bool = True,
+        retry_statuses: Collection[int] = RETRY_STATUSES,
+        budget: Optional[RetryBudget] = None,
+    ):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.retry_statuses = frozenset(retry_statuses)
+        self.budget = budget if budget is not None else RetryBudget()
+
+    @classmethod
+    def disabled(cls) -> "RetryPolicy":
+        """Get a policy that never retries."""
+        return cls(max_retries=0)
+
+    def backoff(self, attempt: int) -> float:
+        """Seconds to wait before retry number `attempt` (starting at 0)."""
+        wait = min(self.backoff_max, self.backoff_base * (2**attempt))
+        if self.jitter:
+            return random.uniform(0, wait)
+        return wait
+
+    def should_retry(self, attempt: int) -> bool:
+        """Check the retry limit and spend from the budget for another attempt."""
+        if attempt >= self.max_retries:
+            return False
+        if not self.budget.try_spend():
+            logger.warning("Retry budget exhausted, not retrying request.")
+            return False
+        return True
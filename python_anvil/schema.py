@@ -0,0 +1,443 @@
+"""Process-wide GraphQL schema, built once and optionally cached on disk.
+
+Building the schema from `schema/anvil_schema.graphql` takes longer than
+anything else when creating a client, so it is built the first time a
+query is validated and shared by every client in the process. With
+`ANVIL_CACHE_DIR` set, it's also saved in a pre-built form for the next
+process to load.
+"""
+
+import contextlib
+import hashlib
+import os
+import pickle
+import stat
+import tempfile
+from collections import OrderedDict
+from contextvars import ContextVar
+from gql import Client
+from graphql import (
+    DocumentNode,
+    GraphQLError,
+    GraphQLSchema,
+    build_ast_schema,
+    parse,
+    validate,
+    version as graphql_version,
+)
+from logging import getLogger
+from time import perf_counter, time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .forksafe import ForkSafeLock
+
+
+logger = getLogger(__name__)
+
+SCHEMA_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "..", "schema", "anvil_schema.graphql"
+)
+
+
+# Seconds to reuse a schema fetched with an introspection query.
+DEFAULT_INTROSPECTION_TTL = 24 * 60 * 60
+
+# Set to a directory to cache pre-built schemas there.
+CACHE_DIR_ENV = "ANVIL_CACHE_DIR"
+# Number of validation results to keep.
+DEFAULT_VALIDATION_CACHE_SIZE = 256
+
+
+def get_local_schema(raise_on_error=False) -> Optional[str]:
+    """
+    Retrieve local GraphQL schema.
+
+    :param raise_on_error:
+    :return:
+    """
+    try:
+        with open(SCHEMA_PATH, encoding="utf-8") as file:
+            schema = file.read()
+    except Exception:  # pylint: disable
+        logger.warning(
+            "Unable to find local schema. Will not use schema for local "
+            "validation. Use `fetch_schema_from_transport=True` to allow "
+            "fetching the remote schema."
+        )
+        if raise_on_error:
+            raise
+        schema = None
+
+    return schema
+
+
+def default_cache_dir() -> Optional[str]:
+    """Get the directory pre-built schemas are saved in.
+
+    The on-disk cache is off unless the `ANVIL_CACHE_DIR` environment
+    variable is set to a directory, in which case `None` is returned.
+    """
+    return os.environ.get(CACHE_DIR_ENV) or None
+
+
+def _digest(value: str) -> str:
+    return hashlib.sha256(value.encode()).hexdigest()[:16]
+
+
+def _is_private(info: os.stat_result) -> bool:
+    """Check that only the current user can write to a file or directory.
+
+    Pickles can run code when loaded, so they're only read from files and
+    directories that nobody else could have replaced.
+    """
+    if not hasattr(os, "getuid"):
+        return True
+    return info.st_uid == os.getuid() and not info.st_mode & (
+        stat.S_IWGRP | stat.S_IWOTH
+    )
+
+
+class SchemaCache:
+    """Builds each GraphQL schema once per process, and caches it on disk.
+
+    Pickled schemas are only read back by the same graphql-core version, and
+    the local schema's cache file is named after a hash of its source, so
+    an updated schema file is never mixed up with an old one. The cache
+    directory is created with mode 0700, and neither it nor its files are
+    used if they're owned by another user or writable by others.
+
+    :param cache_dir: Directory for the on-disk cache. `None` disables it.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = cache_dir
+        self._local: Optional[GraphQLSchema] = None
+        self._local_loaded = False
+        # Endpoint URL -> (time fetched, schema)
+        self._introspected: Dict[str, Tuple[float, GraphQLSchema]] = {}
+        self._lock = ForkSafeLock()
+
+    def local_schema(self) -> Optional[GraphQLSchema]:
+        """Get the schema in `schema/anvil_schema.graphql`.
+
+        Returns `None` if the file can't be read.
+        """
+        with self._lock:
+            if not self._local_loaded:
+                self._local = self._load_local()
+                self._local_loaded = True
+            return self._local
+
+    def _load_local(self) -> Optional[GraphQLSchema]:
+        source = get_local_schema(raise_on_error=False)
+        if source is None:
+            return None
+        name = f"schema-{_digest(source)}"
+        schema = self._read(name)
+        if schema is None:
+            schema = build_ast_schema(parse(source))
+            self._write(name, schema)
+        return schema
+
+    def introspected_schema(
+        self, url: str, ttl: float = DEFAULT_INTROSPECTION_TTL
+    ) -> Optional[GraphQLSchema]:
+        """Get the schema last fetched from `url`, if it's under `ttl` seconds old."""
+        with self._lock:
+            fetched_at, schema = self._introspected.get(url, (0.0, None))
+            if schema is None:
+                fetched_at, schema = self._read(
+                    f"introspection-{_digest(url)}", with_mtime=True
+                ) or (0.0, None)
+                if schema is not None:
+                    self._introspected[url] = (fetched_at, schema)
+            if schema is None or time() - fetched_at >= ttl:
+                return None
+            return schema
+
+    def store_introspection(self, url: str, schema: GraphQLSchema):
+        """Keep a schema fetched from `url` for other clients."""
+        with self._lock:
+            self._introspected[url] = (time(), schema)
+            self._write(f"introspection-{_digest(url)}", schema)
+
+    def clear(self):
+        """Forget every schema, in memory and on disk."""
+        with self._lock:
+            self._local = None
+            self._local_loaded = False
+            self._introspected.clear()
+            if not self.cache_dir or not os.path.isdir(self.cache_dir):
+                return
+            for name in os.listdir(self.cache_dir):
+                if name.startswith(("schema-", "introspection-")) and name.endswith(
+                    ".pickle"
+                ):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+    def _path(self, name: str) -> str:
+        # Pickles aren't compatible between graphql-core versions.
+        return os.path.join(  # type: ignore
+            self.cache_dir, f"{name}-graphql{graphql_version}.pickle"
+        )
+
+    def _private_dir(self) -> bool:
+        if _is_private(os.stat(self.cache_dir)):  # type: ignore
+            return True
+        logger.warning(
+            "Not using the schema cache in %s, since other users can write to it",
+            self.cache_dir,
+        )
+        return False
+
+    def _read(self, name: str, with_mtime: bool = False) -> Any:
+        if not self.cache_dir:
+            return None
+        path = self._path(name)
+        try:
+            if not self._private_dir():
+                return None
+            with open(path, "rb") as file:
+                if not _is_private(os.fstat(file.fileno())):
+                    logger.warning(
+                        "Not loading %s, since other users can write to it", path
+                    )
+                    return None
+                schema = pickle.load(file)
+            if not isinstance(schema, GraphQLSchema):
+                raise TypeError(f"Not a schema: {type(schema)}")
+            return (os.path.getmtime(path), schema) if with_mtime else schema
+        except FileNotFoundError:
+            return None
+        except Exception as e:  # pylint: disable=broad-except
+            # Rebuilt and overwritten below.
+            logger.debug("Ignoring unreadable schema cache %s: %s", path, e)
+            return None
+
+    def _write(self, name: str, schema: GraphQLSchema):
+        if not self.cache_dir:
+            return
+        try:
+            os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+            if not self._private_dir():
+                return
+            # Written to a temporary file first, so other processes never
+            # read a partial file.
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    pickle.dump(schema, file, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, self._path(name))
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        except Exception as e:  # pylint: disable=broad-except
+            logger.debug("Unable to write schema cache: %s", e)
+
+
+_cache = SchemaCache(cache_dir=default_cache_dir())
+
+
+def get_schema_cache() -> SchemaCache:
+    """Get the process-wide `SchemaCache`."""
+    return _cache
+
+
+# The schema and document are kept with their errors, so that their ids
+# can't be reused while the result is cached.
+_ValidationResult = Tuple[GraphQLSchema, DocumentNode, List[GraphQLError]]
+
+
+class ValidationCache:
+    """LRU cache of validation results, per schema and document.
+
+    Documents are compared by identity, so this helps documents that are
+    reused, such as those from `parse_query()`, and costs nothing more than
+    a lookup for the others.
+
+    :param maxsize: Number of results to keep.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_VALIDATION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._results: "OrderedDict[Tuple[int, int], _ValidationResult]" = OrderedDict()
+        self._lock = ForkSafeLock()
+
+    def __len__(self):
+        return len(self._results)
+
+    def get(
+        self, schema: GraphQLSchema, document: DocumentNode
+    ) -> Optional[List[GraphQLError]]:
+        """Get the errors found validating `document`, or `None` if it wasn't."""
+        key = (id(schema), id(document))
+        with self._lock:
+            result = self._results.get(key)
+            if result is None or result[0] is not schema or result[1] is not document:
+                return None
+            self._results.move_to_end(key)
+            return result[2]
+
+    def put(
+        self, schema: GraphQLSchema, document: DocumentNode, errors: List[GraphQLError]
+    ):
+        with self._lock:
+            self._results[(id(schema), id(document))] = (schema, document, errors)
+            while len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+
+_validations = ValidationCache()
+_skip_validation: ContextVar[bool] = ContextVar("skip_validation", default=False)
+
+
+@contextlib.contextmanager
+def skip_validation() -> Iterator[None]:
+    """Don't validate queries against the schema inside this block.
+
+    Usage:
+        >> with skip_validation():
+        >>     anvil.query(HOT_QUERY)
+    """
+    token = _skip_validation.set(True)
+    try:
+        yield
+    finally:
+        _skip_validation.reset(token)
+
+
+class ValidationStats:
+    """How many queries a client validated, and how long it took."""
+
+    def __init__(self):
+        self.validated = 0
+        self.cached = 0
+        self.skipped = 0
+        self.seconds = 0.0
+        self._lock = ForkSafeLock()
+
+    def __repr__(self):
+        return (
+            f"<ValidationStats validated={self.validated} cached={self.cached} "
+            f"skipped={self.skipped} seconds={self.seconds:.4f}>"
+        )
+
+    def record(self, seconds: Optional[float] = None, skipped: bool = False):
+        """Record a validation, a cached result if `seconds` is `None`, or a skip."""
+        with self._lock:
+            if skipped:
+                self.skipped += 1
+            elif seconds is None:
+                self.cached += 1
+            else:
+                self.validated += 1
+                self.seconds += seconds
+
+
+class LazySchemaClient(Client):
+    """gql `Client` that gets its schema when it's first needed.
+
+    gql builds a schema given as a string when the client is created. This
+    client instead calls `schema_loader` the first time `schema` is read,
+    which is when the first query is validated.
+
+    With `fetch_schema_from_transport`, `introspection_url` is set and
+    introspected schemas are shared through the `SchemaCache`: the loader
+    returns a cached one, or `None` so that gql fetches it.
+
+    Each document is only validated once against a schema, see
+    `ValidationCache`. `validation_stats` counts validations and the time
+    spent on them.
+    """
+
+    def __init__(
+        self,
+        schema_loader: Callable[[], Optional[GraphQLSchema]],
+        introspection_url: Optional[str] = None,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self._schema_loader: Optional[Callable[[], Optional[GraphQLSchema]]] = (
+            schema_loader
+        )
+        self._introspection_url = introspection_url
+        self.validation_stats = ValidationStats()
+
+    @property  # type: ignore
+    def schema(self) -> Optional[GraphQLSchema]:  # type: ignore
+        if self._schema_loader is not None:
+            self._schema = self._schema_loader()
+            self._schema_loader = None
+        return self._schema
+
+    @schema.setter
+    def schema(self, value: Optional[GraphQLSchema]):
+        # Setting a schema, e.g. `None` to turn off validation, replaces the
+        # loader.
+        self._schema = value
+        self._schema_loader = None
+
+    def validate(self, document: DocumentNode):
+        if _skip_validation.get():
+            self.validation_stats.record(skipped=True)
+            return
+
+        schema = self.schema
+        assert (
+            schema
+        ), "Cannot validate the document locally, you need to pass a schema."
+        errors = _validations.get(schema, document)
+        if errors is None:
+            started = perf_counter()
+            errors = validate(schema, document)
+            elapsed = perf_counter() - started
+            _validations.put(schema, document, errors)
+            self.validation_stats.record(elapsed)
+            logger.debug("Validated query in %.2f ms.", elapsed * 1000)
+        else:
+            self.validation_stats.record()
+        if errors:
+            raise errors[0]
+
+    def _build_schema_from_introspection(self, execution_result):
+        super()._build_schema_from_introspection(execution_result)
+        if self._introspection_url and self.schema is not None:
+            _cache.store_introspection(self._introspection_url, self.schema)
+
+
+def create_client(
+    transport,
+    url: str,
+    fetch_schema_from_transport: bool = False,
+    force_local_schema: bool = False,
+    introspection_ttl: float = DEFAULT_INTROSPECTION_TTL,
+    validate_queries: bool = True,
+    **kwargs,
+) -> Client:
+    """Create a gql `Client` that uses the process-wide schema.
+
+    :param url: The GraphQL endpoint, which introspected schemas are cached
+        by.
+    :param fetch_schema_from_transport: Use the schema from an introspection
+        query instead of the local schema file.
+    :param introspection_ttl: Seconds to reuse an introspected schema, in
+        this process and others.
+    :param validate_queries: Validate queries against the schema before
+        sending them. Without validation, the schema is never loaded.
+    """
+    if not validate_queries:
+        return LazySchemaClient(lambda: None, transport=transport, **kwargs)
+    if force_local_schema or not fetch_schema_from_transport:
+        return LazySchemaClient(_cache.local_schema, transport=transport, **kwargs)
+
+    return LazySchemaClient(
+        lambda: _cache.introspected_schema(url, ttl=introspection_ttl),
+        introspection_url=url,
+        transport=transport,
+        fetch_schema_from_transport=True,
+        **kwargs,
+    )
@@ -1,6 +1,12 @@
 # pylint: disable=unused-variable,unused-argument,too-many-statements
+import io
 import json
+import os
 import pytest
+import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from gql.transport.exceptions import TransportServerError
 from typing import Any, MutableMapping
 from unittest import mock
 
@@ -9,7 +15,23 @@ from python_anvil.api_resources.payload import (
     CreateEtchPacketPayload,
     ForgeSubmitPayload,
 )
-from python_anvil.constants import VALID_HOSTS
+from python_anvil.constants import (
+    ANVIL_HOST,
+    DEFAULT_COMPRESSION_THRESHOLD,
+    DEFAULT_TIMEOUT,
+    GRAPHQL_ENDPOINT,
+    VALID_HOSTS,
+)
+from python_anvil.exceptions import (
+    AnvilClientError,
+    AnvilRateLimitException,
+    AnvilRequestException,
+    AnvilServerError,
+    AnvilTimeoutError,
+)
+from python_anvil.http import NoAuth, StreamedContent
+from python_anvil.limiter import SQLiteTokenBucketLimiter, TokenBucketLimiter
+from python_anvil.retry import RetryPolicy
 
 from ..api_resources.payload import FillPDFPayload
 from . import payloads
@@ -25,6 +47,13 @@ type GenerateEmbedURLResponse {
 """
 
 
+def _streamed(body: bytes) -> StreamedContent:
+    res = requests.Response()
+    res.status_code = 200
+    res.raw = io.BytesIO(body)
+    return StreamedContent(res)
+
+
 def describe_api():
     @pytest.fixture
     @mock.patch("builtins.open", new_callable=mock.mock_open, read_data=TEST_SCHEMA)
@@ -36,31 +65,105 @@ def describe_api():
         @mock.patch('python_anvil.api.HTTPClient')
         def test_init_key_default(mock_client, mock_gql):
             Anvil(api_key="what")
-            mock_client.assert_called_once_with(api_key="what", environment="dev")
+            mock_client.assert_called_once_with(
+                api_key="what",
+                environment="dev",
+                limiter=mock.ANY,
+                retry_policy=None,
+                pool_connections=10,
+                pool_maxsize=10,
+                keep_alive=True,
+                timeout=DEFAULT_TIMEOUT,
+                http2=False,
+                http2_connections=1,
+                http2_max_streams=None,
+                compression=None,
+                compression_threshold=DEFAULT_COMPRESSION_THRESHOLD,
+                hedge_policy=None,
+                circuit_breaker=None,
+            )
             mock_gql.get_client.assert_called_once_with(
-                api_key="what", environment="dev", endpoint_url=None
+                api_key="what",
+                environment="dev",
+                endpoint_url=None,
+                http_client=mock_client.return_value,
+                validate_queries=True,
             )
 
         @mock.patch('python_anvil.api.GQLClient')
         @mock.patch('python_anvil.api.HTTPClient')
         def test_init_with_endpoint(mock_client, mock_gql):
             Anvil(api_key="what", endpoint_url="http://somewhere.example")
-            mock_client.assert_called_once_with(api_key="what", environment="dev")
+            mock_client.assert_called_once_with(
+                api_key="what",
+                environment="dev",
+                limiter=mock.ANY,
+                retry_policy=None,
+                pool_connections=10,
+                pool_maxsize=10,
+                keep_alive=True,
+                timeout=DEFAULT_TIMEOUT,
+                http2=False,
+                http2_connections=1,
+                http2_max_streams=None,
+                compression=None,
+                compression_threshold=DEFAULT_COMPRESSION_THRESHOLD,
+                hedge_policy=None,
+                circuit_breaker=None,
+            )
             mock_gql.get_client.assert_called_once_with(
                 api_key="what",
                 environment="dev",
                 endpoint_url="http://somewhere.example",
+                http_client=mock_client.return_value,
+                validate_queries=True,
             )
 
         @mock.patch('python_anvil.api.GQLClient')
         @mock.patch('python_anvil.api.HTTPClient')
         def test_init_key_prod(mock_client, mock_gql):
             Anvil(api_key="what", environment="prod")
-            mock_client.assert_called_once_with(api_key="what", environment="prod")
+            mock_client.assert_called_once_with(
+                api_key="what",
+                environment="prod",
+                limiter=mock.ANY,
+                retry_policy=None,
+                pool_connections=10,
+                pool_maxsize=10,
+                keep_alive=True,
+                timeout=DEFAULT_TIMEOUT,
+                http2=False,
+                http2_connections=1,
+                http2_max_streams=None,
+                compression=None,
+                compression_threshold=DEFAULT_COMPRESSION_THRESHOLD,
+                hedge_policy=None,
+                circuit_breaker=None,
+            )
             mock_gql.get_client.assert_called_once_with(
-                api_key="what", environment="prod", endpoint_url=None
+                api_key="what",
+                environment="prod",
+                endpoint_url=None,
+                http_client=mock_client.return_value,
+                validate_queries=True,
             )
 
+        @mock.patch('python_anvil.api.GQLClient')
+        @mock.patch('python_anvil.api.HTTPClient')
+        def test_init_limiter_backend(mock_client, mock_gql, tmp_path):
+            path = str(tmp_path / "limits.db")
+            Anvil(api_key="what", limiter_backend="sqlite", limiter_path=path)
+            limiter = mock_client.call_args[1]["limiter"]
+            assert isinstance(limiter, SQLiteTokenBucketLimiter)
+            assert limiter.path == path
+
+        @mock.patch('python_anvil.api.GQLClient')
+        @mock.patch('python_anvil.api.HTTPClient')
+        def test_init_custom_limiter(mock_client, mock_gql):
+            limiter = TokenBucketLimiter(calls=1)
+            Anvil(api_key="what", limiter=limiter)
+            assert mock_client.call_args[1]["limiter"] is limiter
+
         @mock.patch('python_anvil.api.GQLClient')
         @mock.patch('python_anvil.api.HTTPClient')
         def test_init_no_key(mock_client, mock_gql):
@@ -70,17 +173,138 @@ def describe_api():
             assert mock_client.call_count == 0
             assert mock_gql.get_client.call_count == 0
 
+    def describe_lifecycle():
+        def test_context_manager(anvil):
+            with mock.patch.object(anvil.client, "close") as close:
+                with anvil as client:
+                    assert client is anvil
+                close.assert_called_once_with()
+
+        @mock.patch('python_anvil.api.GQLClient')
+        def test_close_owned_limiter(mock_gql, tmp_path):
+            path = str(tmp_path / "limits.db")
+            anvil = Anvil(api_key="what", limiter_backend="sqlite", limiter_path=path)
+            with mock.patch.object(anvil.client.limiter, "close") as close:
+                anvil.close()
+            close.assert_called_once_with()
+
+        @mock.patch('python_anvil.api.GQLClient')
+        def test_keeps_shared_limiter_open(mock_gql):
+            limiter = mock.MagicMock()
+            Anvil(api_key="what", limiter=limiter).close()
+            assert limiter.close.call_count == 0
+
+        def test_warmup(anvil):
+            with mock.patch.object(anvil.client, "warmup") as warmup:
+                anvil.warmup()
+            warmup.assert_called_once_with([ANVIL_HOST, GRAPHQL_ENDPOINT])
+
+    def describe_estimated_wait():
+        def test_estimated_wait(anvil):
+            with mock.patch.object(anvil.client, "limiter") as limiter:
+                limiter.estimated_wait.return_value = 2.5
+                assert anvil.estimated_wait() == 2.5
+
     def describe_query():
         def test_query():
             # TODO: ...
             pass
 
+        def _graphql_response(status_code=200, body=b'{"data": {}}', headers=None):
+            res = requests.Response()
+            res.status_code = status_code
+            res._content = body  # pylint: disable=protected-access
+            res.raw = io.BytesIO(body)
+            res.headers.update(headers or {})
+            return res
+
+        def test_uses_http_client(anvil):
+            anvil.gql_client.schema = None
+            with mock.patch.object(anvil.client, "do_request") as do_request:
+                do_request.return_value = _graphql_response(
+                    body=b'{"data": {"currentUser": {"eid": "abc"}}}'
+                )
+                res = anvil.query("{ currentUser { eid } }")
+
+            assert res == {"currentUser": {"eid": "abc"}}
+            args, kwargs = do_request.call_args
+            assert args == ("POST", GRAPHQL_ENDPOINT)
+            assert kwargs["idempotent"] is True
+            assert kwargs["auth"].username == DEV_KEY
+
+        def test_mutation_not_idempotent(anvil):
+            anvil.gql_client.schema = None
+            with mock.patch.object(anvil.client, "do_request") as do_request:
+                do_request.return_value = _graphql_response()
+                anvil.mutate("mutation { removeWeldData(eid: \"abc\") }", {})
+
+            assert do_request.call_args[1]["idempotent"] is False
+
+        def test_rate_limits_graphql(anvil):
+            anvil.gql_client.schema = None
+            responses = [
+                _graphql_response(429, b"", {"Retry-After": "2"}),
+                _graphql_response(),
+            ]
+            with mock.patch.object(
+                anvil.client, "_session"
+            ) as session, mock.patch.object(anvil.client, "limiter") as limiter:
+                session.request.side_effect = responses
+                anvil.query("{ currentUser { eid } }")
+
+            assert responses[0].raw.closed
+            assert session.request.call_count == 2
+            assert limiter.acquire.call_count == 2
+            limiter.pause.assert_called_once_with(2)
+
+        def test_passes_deadline(anvil):
+            anvil.gql_client.schema = None
+            with mock.patch.object(anvil.client, "do_request") as do_request:
+                do_request.return_value = _graphql_response()
+                anvil.query("{ currentUser { eid } }")
+                assert "timeout" not in do_request.call_args[1]
+
+                anvil.query("{ currentUser { eid } }", timeout=5, deadline=10)
+                assert do_request.call_args[1]["timeout"] == 5
+                assert do_request.call_args[1]["deadline"] == 10
+
+        def test_concurrent_queries(anvil):
+            anvil.gql_client.schema = None
+            threads = 8
+            barrier = threading.Barrier(threads)
+
+            def do_request(*args, **kwargs):
+                # Every request is in flight before any of them returns.
+                barrier.wait(timeout=5)
+                return _graphql_response(
+                    body=b'{"data": {"currentUser": {"eid": "abc"}}}'
+                )
+
+            with mock.patch.object(anvil.client, "do_request", do_request):
+                with ThreadPoolExecutor(threads) as pool:
+                    futures = [
+                        pool.submit(anvil.get_current_user) for _ in range(threads)
+                    ]
+                    results = [future.result() for future in futures]
+
+            assert results == [{"eid": "abc"}] * threads
+
+        def test_raises_server_error(anvil):
+            anvil.gql_client.schema = None
+            anvil.client.retry_policy = RetryPolicy.disabled()
+            with mock.patch.object(anvil.client, "_session") as session:
+                session.request.return_value = _graphql_response(500, b"oops")
+                with pytest.raises(TransportServerError):
+                    anvil.query("{ currentUser { eid } }")
+
     def describe_fill_pdf():
         @mock.patch('python_anvil.api.RestRequest.post')
         def test_dict_payload(m_request_post, anvil):
             payload = {"data": {"this_data": "yes"}}
             anvil.fill_pdf("some_template", payload=payload)
-            m_request_post.assert_called_once_with("fill/some_template.pdf", payload)
+            m_request_post.assert_called_once_with(
+                "fill/some_template.pdf", payload, idempotent=True
+            )
 
         @mock.patch('python_anvil.api.RestRequest.post')
         def test_json_payload(m_request_post, anvil):
@@ -89,6 +313,7 @@ def describe_api():
             m_request_post.assert_called_once_with(
                 "fill/some_template.pdf",
                 {'data': {'jsonData': 'is here'}},
+                idempotent=True,
             )
 
         @mock.patch('python_anvil.api.RestRequest.post')
@@ -98,6 +323,7 @@ def describe_api():
             m_request_post.assert_called_once_with(
                 "fill/some_template.pdf",
                 {'data': {'jsonData': 'this was a payload instance'}},
+                idempotent=True,
             )
 
         @mock.patch('python_anvil.api.RestRequest.post')
@@ -114,6 +340,7 @@ def describe_api():
                 "fill/some_template.pdf",
                 {"data": {"jsonData": "is here"}},
                 include_headers=True,
+                idempotent=True,
             )
 
         @mock.patch('python_anvil.api.RestRequest.post')
@@ -130,6 +357,7 @@ def describe_api():
                 {"data": {"one": "One string"}},
                 include_headers=True,
                 params={"versionNumber": Anvil.VERSION_LATEST},
+                idempotent=True,
             )
 
         @mock.patch('python_anvil.api.RestRequest.post')
@@ -144,6 +372,7 @@ def describe_api():
                 {"data": {"one": "One string"}},
                 include_headers=True,
                 params=params,
+                idempotent=True,
             )
 
     def describe_generate_pdf():
@@ -154,6 +383,7 @@ def describe_api():
                 # Defaults to 'markdown'
                 "generate-pdf",
                 data={'data': [{'d1': 'data'}], 'type': 'markdown'},
+                idempotent=True,
             )
 
         @mock.patch('python_anvil.api.RestRequest.post')
@@ -161,7 +391,9 @@ def describe_api():
             payload = """{ "data": [{ "d1": "data" }] }"""
             anvil.generate_pdf(payload)
             m_request_post.assert_called_once_with(
-                "generate-pdf", data={"data": [{"d1": "data"}], "type": "markdown"}
+                "generate-pdf",
+                data={"data": [{"d1": "data"}], "type": "markdown"},
+                idempotent=True,
             )
 
         @mock.patch('python_anvil.api.RestRequest.post')
@@ -170,6 +402,7 @@ def describe_api():
             m_request_post.assert_called_once_with(
                 "generate-pdf",
                 data={"data": {"html": "<h1>Hello</h1>"}, "type": "html"},
+                idempotent=True,
             )
 
         @mock.patch('python_anvil.api.RestRequest.post')
@@ -224,6 +457,175 @@ def describe_api():
             anvil.download_documents('someEid')
             assert m_request_post.call_count == 1
 
+        @mock.patch("python_anvil.api_resources.requests.AnvilRequest._request")
+        def test_output(mock_request, anvil, tmp_path):
+            mock_request.return_value = (_streamed(b"zip" * 10), 200, {})
+            path = tmp_path / "docs.zip"
+
+            assert anvil.download_documents("someEid", output=path) == path
+            assert path.read_bytes() == b"zip" * 10
+            assert mock_request.call_args[1]["stream"] is True
+
+        @mock.patch("python_anvil.api_resources.requests.AnvilRequest._request")
+        def test_stream(mock_request, anvil):
+            content = _streamed(b"zip")
+            mock_request.return_value = (content, 200, {})
+            assert anvil.download_documents("someEid", stream=True) is content
+
+        @mock.patch("python_anvil.api_resources.requests.AnvilRequest._request")
+        def test_streamed_error(mock_request, anvil, tmp_path):
+            mock_request.return_value = (_streamed(b"not found"), 404, {})
+            path = tmp_path / "docs.zip"
+            with pytest.raises(AnvilClientError) as exc_info:
+                anvil.download_documents("someEid", output=path)
+            assert exc_info.value.response == b"not found"
+            assert not path.exists()
+
+    def describe_document_files():
+        @pytest.fixture
+        def document_group():
+            return {
+                "eid": "groupEid",
+                "files": [
+                    {"filename": "contract.pdf", "name": "Contract"},
+                    {
+                        "filename": "my nda.pdf",
+                        "downloadURL": f"{ANVIL_HOST}/download/nda",
+                    },
+                    {"filename": "terms.pdf"},
+                ],
+            }
+
+        @pytest.fixture
+        def mock_request():
+            def request(method, url, **kwargs):
+                return url.encode(), 200, {}
+
+            with mock.patch(
+                "python_anvil.api_resources.requests.AnvilRequest._request",
+                side_effect=request,
+            ) as mock_request:
+                yield mock_request
+
+        @mock.patch('gql.Client.execute')
+        def test_get_etch_packet_document_group(m_execute, anvil, document_group):
+            m_execute.return_value = {"etchPacket": {"documentGroup": document_group}}
+            assert anvil.get_etch_packet_document_group("packetEid") == document_group
+            assert m_execute.call_args[1]["variable_values"] == {"eid": "packetEid"}
+
+        def test_by_eid(anvil, mock_request):
+            res = anvil.download_document_files("groupEid", ["my nda.pdf"])
+            assert res == {"my nda.pdf": b"document-group/groupEid/my%20nda.pdf"}
+
+        def test_by_eid_requires_filenames(anvil):
+            with pytest.raises(ValueError):
+                anvil.download_document_files("groupEid")
+
+        def test_selected_files(anvil, mock_request, document_group):
+            res = anvil.download_document_files(
+                document_group, ["my nda.pdf", "contract.pdf"]
+            )
+            assert res == {
+                "my nda.pdf": f"{ANVIL_HOST}/download/nda".encode(),
+                "contract.pdf": b"document-group/groupEid/contract.pdf",
+            }
+            assert mock_request.call_count == 2
+
+        def test_all_files(anvil, mock_request, document_group):
+            res = anvil.download_document_files(document_group)
+            assert list(res) == ["contract.pdf", "my nda.pdf", "terms.pdf"]
+
+        def test_unknown_file(anvil, mock_request, document_group):
+            with pytest.raises(ValueError, match="missing.pdf"):
+                anvil.download_document_files(document_group, ["missing.pdf"])
+            assert mock_request.call_count == 0
+
+        def test_output_dir(anvil, tmp_path):
+            with mock.patch(
+                "python_anvil.api_resources.requests.AnvilRequest._request"
+            ) as mock_request:
+                mock_request.return_value = (_streamed(b"%PDF"), 200, {})
+                res = anvil.download_document_files(
+                    "groupEid", ["../contract.pdf"], output_dir=str(tmp_path)
+                )
+
+            path = tmp_path / "contract.pdf"
+            assert res == {"../contract.pdf": str(path)}
+            assert path.read_bytes() == b"%PDF"
+
+        def test_output_dir_keeps_paths(anvil, tmp_path):
+            with mock.patch(
+                "python_anvil.api_resources.requests.AnvilRequest._request"
+            ) as mock_request:
+                mock_request.side_effect = lambda *args, **kwargs: (
+                    _streamed(b"%PDF"),
+                    200,
+                    {},
+                )
+                res = anvil.download_document_files(
+                    "groupEid",
+                    ["a/x.pdf", "b/x.pdf", "x.pdf", "./x.pdf"],
+                    output_dir=str(tmp_path),
+                )
+
+            assert res == {
+                "a/x.pdf": str(tmp_path / "a" / "x.pdf"),
+                "b/x.pdf": str(tmp_path / "b" / "x.pdf"),
+                "x.pdf": str(tmp_path / "x.pdf"),
+                "./x.pdf": str(tmp_path / "x (1).pdf"),
+            }
+            assert all(os.path.exists(path) for path in res.values())
+
+        def test_credentials_only_sent_to_anvil(anvil):
+            urls = {
+                "anvil.pdf": f"{ANVIL_HOST}/download/a",
+                "other.pdf": "https://files.example/b",
+                "lookalike.pdf": f"{ANVIL_HOST}.evil.example/c",
+                "plain.pdf": "http://app.useanvil.com/d",
+            }
+            document_group = {
+                "eid": "groupEid",
+                "files": [
+                    {"filename": name, "downloadURL": url} for name, url in urls.items()
+                ],
+            }
+            with mock.patch.object(
+                anvil.client, "request", return_value=(b"", 200, {})
+            ) as request:
+                anvil.download_document_files(document_group, max_workers=1)
+
+            sent = {call[0][1]: call[1].get("auth") for call in request.call_args_list}
+            assert set(sent) == set(urls.values())
+            assert sent[urls["anvil.pdf"]] is None
+            for name in ["other.pdf", "lookalike.pdf", "plain.pdf"]:
+                assert isinstance(sent[urls[name]], NoAuth)
+
+        def test_parallel(anvil):
+            barrier = threading.Barrier(2, timeout=5)
+
+            def request(method, url, **kwargs):
+                barrier.wait()
+                return b"", 200, {}
+
+            with mock.patch(
+                "python_anvil.api_resources.requests.AnvilRequest._request",
+                side_effect=request,
+            ):
+                anvil.download_document_files("groupEid", ["a.pdf", "b.pdf"])
+
+        def test_error(anvil):
+            def request(method, url, **kwargs):
+                if url.endswith("b.pdf"):
+                    return b"not found", 404, {}
+                return b"", 200, {}
+
+            with mock.patch(
+                "python_anvil.api_resources.requests.AnvilRequest._request",
+                side_effect=request,
+            ):
+                with pytest.raises(AnvilClientError):
+                    anvil.download_document_files("groupEid", ["a.pdf", "b.pdf"])
+
     def describe_get_cast():
         @mock.patch('gql.Client.execute')
         def test_get_cast(m_request_post, anvil):
@@ -398,6 +800,52 @@ def describe_api():
             assert m_request_post.call_count == 1
             assert _expected_data in m_request_post.call_args
 
+    def describe_rest_request_errors():
+        @pytest.mark.parametrize(
+            "status_code, exc_class, retryable",
+            [
+                (400, AnvilClientError, False),
+                (404, AnvilClientError, False),
+                (408, AnvilTimeoutError, True),
+                (429, AnvilRateLimitException, True),
+                (500, AnvilServerError, True),
+                (502, AnvilServerError, True),
+            ],
+        )
+        @mock.patch("python_anvil.api_resources.requests.AnvilRequest._request")
+        def test_typed_errors(mock_request, anvil, status_code, exc_class, retryable):
+            mock_request.return_value = (b"nope", status_code, {"A": "b"})
+            with pytest.raises(exc_class) as exc_info:
+                anvil.request_rest().get("some/path")
+
+            error = exc_info.value
+            assert isinstance(error, AnvilRequestException)
+            assert error.status_code == status_code
+            assert error.retryable is retryable
+            assert error.headers == {"A": "b"}
+            assert error.response == b"nope"
+            assert f"Error: {status_code}: nope" in str(error)
+
+        @mock.patch("python_anvil.api_resources.requests.AnvilRequest._request")
+        def test_passes_idempotent(mock_request, anvil):
+            mock_request.return_value = (b"", 200, {})
+            anvil.request_rest().post("some/path", data={}, idempotent=True)
+            mock_request.assert_called_once_with(
+                "POST",
+                "some/path",
+                json={},
+                retry=True,
+                params=None,
+                idempotent=True,
+            )
+
+        @mock.patch("python_anvil.api_resources.requests.AnvilRequest._request")
+        def test_passes_timeouts(mock_request, anvil):
+            mock_request.return_value = (b"", 200, {})
+            anvil.fill_pdf("some_template", {"data": {"a": 1}}, timeout=5, deadline=2.0)
+            assert mock_request.call_args[1]["timeout"] == 5
+            assert mock_request.call_args[1]["deadline"] == 2.0
+
     def describe_rest_request_absolute_url_behavior():
         @pytest.mark.parametrize(
             "url, should_raise",
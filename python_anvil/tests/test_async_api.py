@@ -0,0 +1,262 @@
+# pylint: disable=redefined-outer-name,unused-variable,protected-access
+import asyncio
+import gzip
+import httpx
+import json
+import pytest
+from unittest import mock
+
+from python_anvil.async_api import AsyncAnvil
+from python_anvil.async_http import AsyncHTTPClient
+from python_anvil.exceptions import (
+    AnvilClientError,
+    AnvilConnectionError,
+    AnvilTimeoutError,
+)
+from python_anvil.limiter import TokenBucketLimiter
+from python_anvil.retry import RetryPolicy
+
+
+DEV_KEY = "MY-SECRET-KEY"
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def _mock_session(client, handler):
+    client._session = httpx.AsyncClient(
+        auth=httpx.BasicAuth(DEV_KEY, ""), transport=httpx.MockTransport(handler)
+    )
+
+
+def describe_async_http_client():
+    @pytest.fixture
+    def client():
+        return AsyncHTTPClient(
+            api_key=DEV_KEY,
+            limiter=TokenBucketLimiter(calls=100),
+            retry_policy=RetryPolicy(jitter=False, backoff_base=0),
+        )
+
+    def test_request(client):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, content=b"pdf")
+
+        _mock_session(client, handler)
+        content, status_code, _ = _run(client.request("GET", "https://x.example"))
+        assert (content, status_code) == (b"pdf", 200)
+        assert requests[0].headers["Authorization"].startswith("Basic ")
+
+    def test_retries_server_errors(client):
+        statuses = [503, 200]
+        _mock_session(client, lambda request: httpx.Response(statuses.pop(0)))
+        res = _run(client.do_request("GET", "https://x.example"))
+        assert res.status_code == 200
+        assert not statuses
+
+    def test_rate_limited(client):
+        statuses = [429, 200]
+        responses = []
+
+        def handler(request):
+            responses.append(
+                httpx.Response(statuses.pop(0), headers={"Retry-After": "0"})
+            )
+            return responses[-1]
+
+        _mock_session(client, handler)
+        with mock.patch.object(client.limiter, "pause") as pause:
+            res = _run(client.do_request("GET", "https://x.example"))
+        assert res.status_code == 200
+        pause.assert_called_once_with(0)
+        # The rate-limited response is closed, to free its connection.
+        assert responses[0].is_closed
+
+    def test_connection_errors(client):
+        def handler(request):
+            raise httpx.ConnectError("refused")
+
+        _mock_session(client, handler)
+        with pytest.raises(AnvilConnectionError):
+            _run(client.do_request("POST", "https://x.example", retry=False))
+
+    def test_deadline(client):
+        client.limiter = TokenBucketLimiter(calls=1, period=60)
+        client.limiter.try_acquire()
+        _mock_session(client, lambda request: httpx.Response(200))
+        with pytest.raises(AnvilTimeoutError):
+            _run(client.do_request("GET", "https://x.example", deadline=1))
+
+    def test_compression(client):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200)
+
+        client.compression = "gzip"
+        _mock_session(client, handler)
+        payload = {"text": "Lorem ipsum dolor sit amet. " * 1000}
+        _run(client.do_request("POST", "https://x.example", json=payload))
+
+        assert requests[0].headers["Content-Encoding"] == "gzip"
+        assert json.loads(gzip.decompress(requests[0].content)) == payload
+
+    def test_limiter_does_not_block_loop(client):
+        client.limiter = TokenBucketLimiter(calls=20, period=1, burst=1)
+        _mock_session(client, lambda request: httpx.Response(200))
+
+        async def run():
+            ticks = []
+
+            async def ticker():
+                for _ in range(3):
+                    ticks.append(True)
+                    await asyncio.sleep(0.01)
+
+            await asyncio.gather(
+                client.do_request("GET", "https://x.example"),
+                client.do_request("GET", "https://x.example"),
+                ticker(),
+            )
+            return ticks
+
+        assert len(_run(run())) == 3
+
+
+def describe_async_anvil():
+    @pytest.fixture
+    def anvil():
+        anvil = AsyncAnvil(api_key=DEV_KEY)
+        anvil.gql_client.schema = None
+        return anvil
+
+    def test_no_key():
+        with pytest.raises(ValueError):
+            AsyncAnvil()
+
+    def test_query(anvil):
+        bodies = []
+
+        def handler(request):
+            bodies.append(json.loads(request.content))
+            return httpx.Response(200, json={"data": {"currentUser": {"eid": "a"}}})
+
+        _mock_session(anvil.client, handler)
+        res = _run(anvil.get_current_user())
+        assert res == {"eid": "a"}
+        assert "currentUser" in bodies[0]["query"]
+
+    def test_concurrent_queries(anvil):
+        anvil.client.limiter = TokenBucketLimiter(calls=100)
+
+        async def handler(request):
+            # Keep every request in flight until all of them have started.
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, json={"data": {"currentUser": {"eid": "a"}}})
+
+        _mock_session(anvil.client, handler)
+
+        async def run():
+            return await asyncio.gather(*[anvil.get_current_user() for _ in range(5)])
+
+        assert _run(run()) == [{"eid": "a"}] * 5
+
+    def test_mutation_not_idempotent(anvil):
+        with mock.patch.object(anvil.client, "do_request") as do_request:
+            do_request.return_value = httpx.Response(200, json={"data": {}})
+            _run(anvil.generate_etch_signing_url("signer", "user"))
+        assert do_request.call_args[1]["idempotent"] is False
+
+    def test_fill_pdf(anvil):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, content=b"%PDF")
+
+        _mock_session(anvil.client, handler)
+        res = _run(anvil.fill_pdf("some_template", {"data": {"one": 1}}))
+        assert res == b"%PDF"
+        assert requests[0].url.path == "/api/v1/fill/some_template.pdf"
+        assert json.loads(requests[0].content) == {"data": {"one": 1}}
+
+    def test_download_to_output(anvil, tmp_path):
+        _mock_session(anvil.client, lambda request: httpx.Response(200, content=b"zip"))
+        path = tmp_path / "docs.zip"
+        assert _run(anvil.download_documents("abc", output=path)) == path
+        assert path.read_bytes() == b"zip"
+
+    def test_stream(anvil):
+        _mock_session(
+            anvil.client, lambda request: httpx.Response(200, content=b"x" * 10)
+        )
+
+        async def run():
+            content = await anvil.download_documents("abc", stream=True, chunk_size=4)
+            return [chunk async for chunk in content]
+
+        assert _run(run()) == [b"xxxx", b"xxxx", b"xx"]
+
+    def test_download_document_files(anvil, tmp_path):
+        paths = []
+
+        def handler(request):
+            paths.append(request.url.path)
+            return httpx.Response(200, content=request.url.path.encode())
+
+        _mock_session(anvil.client, handler)
+        res = _run(anvil.download_document_files("group", ["a.pdf", "b.pdf"]))
+        assert res == {
+            "a.pdf": b"/api/document-group/group/a.pdf",
+            "b.pdf": b"/api/document-group/group/b.pdf",
+        }
+        assert sorted(paths) == [
+            "/api/document-group/group/a.pdf",
+            "/api/document-group/group/b.pdf",
+        ]
+
+    def test_download_document_files_credentials(anvil):
+        auth = {}
+
+        def handler(request):
+            auth[str(request.url)] = "Authorization" in request.headers
+            return httpx.Response(200)
+
+        _mock_session(anvil.client, handler)
+        document_group = {
+            "eid": "group",
+            "files": [
+                {"filename": "a.pdf", "downloadURL": "https://app.useanvil.com/a"},
+                {"filename": "b.pdf", "downloadURL": "https://files.example/b"},
+            ],
+        }
+        _run(anvil.download_document_files(document_group))
+        assert auth == {
+            "https://app.useanvil.com/a": True,
+            "https://files.example/b": False,
+        }
+
+    def test_rest_errors(anvil):
+        _mock_session(anvil.client, lambda request: httpx.Response(404, content=b"?"))
+        with pytest.raises(AnvilClientError):
+            _run(anvil.download_documents("abc"))
+
+    def test_context_manager():
+        async def run():
+            async with AsyncAnvil(api_key=DEV_KEY) as anvil:
+                pass
+            return anvil
+
+        assert _run(run()).client._session.is_closed
+
+    def test_method_parity():
+        from python_anvil.api import Anvil
+
+        public = [name for name in dir(Anvil) if not name.startswith("_")]
+        missing = [name for name in public if not hasattr(AsyncAnvil, name)]
+        assert not missing
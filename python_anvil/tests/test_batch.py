@@ -0,0 +1,199 @@
+# pylint: disable=redefined-outer-name,unused-variable,protected-access
+import asyncio
+import httpx
+import json
+import pytest
+import requests
+from gql.transport.exceptions import TransportQueryError
+from graphql import execute_sync, parse
+from unittest import mock
+
+from python_anvil.api import Anvil
+from python_anvil.batch import Batch
+from python_anvil.exceptions import AnvilServerError
+from python_anvil.schema import get_schema_cache
+
+
+def _weld(info, eid=None, **kwargs):
+    if eid == "missing":
+        raise ValueError("Weld not found")
+    return {"eid": eid, "slug": "w", "name": "Weld", "forges": []}
+
+
+ROOT = {
+    "cast": lambda info, eid, **kwargs: {"eid": eid, "title": f"Cast {eid}"},
+    "weld": _weld,
+    "currentUser": lambda info: {"eid": "u1", "name": "Me", "organizations": []},
+    "signer": lambda info, eid: {"eid": eid, "name": "Signer"},
+    "generateEtchSignURL": lambda info, signerEid, clientUserId: (
+        f"https://sign/{signerEid}/{clientUserId}"
+    ),
+}
+
+
+def _execute(body):
+    """Run a GraphQL request against the local schema."""
+    result = execute_sync(
+        get_schema_cache().local_schema(),
+        parse(body["query"]),
+        root_value=ROOT,
+        variable_values=body.get("variables"),
+    )
+    response = {"data": result.data}
+    if result.errors:
+        response["errors"] = [error.formatted for error in result.errors]
+    return response
+
+
+def _response(body):
+    res = requests.Response()
+    res.status_code = 200
+    res._content = json.dumps(body).encode()
+    return res
+
+
+@pytest.fixture
+def anvil():
+    anvil = Anvil(api_key="my_key")
+    with mock.patch.object(anvil.client, "do_request") as do_request:
+        do_request.side_effect = lambda *args, **kwargs: _response(
+            _execute(kwargs["json"])
+        )
+        yield anvil
+
+
+def _sent(anvil, index=-1):
+    return anvil.client.do_request.call_args_list[index][1]["json"]
+
+
+def describe_batch():
+    def test_merges_queries(anvil):
+        with anvil.batch() as b:
+            cast = b.get_cast("c1", fields=["eid", "title"])
+            weld = b.get_weld("w1")
+            user = b.get_current_user()
+            signer = b.get_signer("s1", fields=["eid", "name"])
+            raw = b.query(
+                """
+                query Casts($eid: String!) {
+                  first: cast(eid: $eid) { ...CastFields }
+                }
+                fragment CastFields on Cast { eid title }
+                """,
+                variables={"eid": "c2"},
+            )
+
+        assert anvil.client.do_request.call_count == 1
+        assert cast.result() == {"eid": "c1", "title": "Cast c1"}
+        assert weld.result()["eid"] == "w1"
+        assert user.result()["name"] == "Me"
+        assert signer.result() == {"eid": "s1", "name": "Signer"}
+        assert raw.result() == {"first": {"eid": "c2", "title": "Cast c2"}}
+
+        body = _sent(anvil)
+        assert body["query"].startswith("query Batch(")
+        assert body["variables"] == {"b1_eid": "w1", "b3_e0": "s1", "b4_eid": "c2"}
+        assert "fragment b4_CastFields on Cast" in body["query"]
+
+    def test_routes_errors(anvil):
+        with anvil.batch() as b:
+            first = b.get_weld("w1")
+            missing = b.get_weld("missing")
+
+        assert first.result()["eid"] == "w1"
+        with pytest.raises(TransportQueryError) as e:
+            missing.result()
+        (error,) = e.value.errors
+        assert error["message"] == "Weld not found"
+        assert error["path"] == ["weld"]
+        assert e.value.data == {"weld": None}
+
+    def test_errors_without_path(anvil):
+        anvil.client.do_request.side_effect = None
+        anvil.client.do_request.return_value = _response(
+            {"data": None, "errors": [{"message": "Denied"}]}
+        )
+        with anvil.batch() as b:
+            futures = [b.get_current_user(), b.get_weld("w1")]
+        for future in futures:
+            with pytest.raises(TransportQueryError, match="Denied"):
+                future.result()
+
+    def test_mutations(anvil):
+        with anvil.batch() as b:
+            user = b.get_current_user()
+            first = b.generate_etch_signing_url("s1", "u1")
+            second = b.generate_etch_signing_url("s2", "u2")
+
+        assert anvil.client.do_request.call_count == 2
+        mutation, query = _sent(anvil, 0), _sent(anvil, 1)
+        assert mutation["query"].startswith("mutation Batch(")
+        assert query["query"].startswith("query Batch")
+        assert first.result() == {"generateEtchSignURL": "https://sign/s1/u1"}
+        assert second.result() == {"generateEtchSignURL": "https://sign/s2/u2"}
+        assert user.result()["eid"] == "u1"
+
+    def test_request_error(anvil):
+        anvil.client.do_request.side_effect = AnvilServerError("Oops")
+        with anvil.batch(timeout=5) as b:
+            cast = b.get_cast("c1")
+        with pytest.raises(AnvilServerError):
+            cast.result()
+        assert anvil.client.do_request.call_args[1]["timeout"] == 5
+
+    def test_not_sent_on_error(anvil):
+        with pytest.raises(KeyError):
+            with anvil.batch() as b:
+                cast = b.get_cast("c1")
+                raise KeyError()
+        assert cast.cancelled()
+        anvil.client.do_request.assert_not_called()
+        with pytest.raises(RuntimeError):
+            b.get_cast("c2")
+
+    def test_empty(anvil):
+        with anvil.batch():
+            pass
+        anvil.client.do_request.assert_not_called()
+
+    def test_invalid_documents():
+        b = Batch(mock.Mock())
+        with pytest.raises(ValueError):
+            b.query("query A { currentUser { eid } } query B { currentUser { eid } }")
+        with pytest.raises(ValueError):
+            b.query("{ ... on Query { currentUser { eid } } }")
+        with pytest.raises(ValueError):
+            b.query("subscription { currentUser { eid } }")
+        future = b.query(
+            "query A { currentUser { eid } } query B { currentUser { name } }",
+            operation_name="B",
+        )
+        assert len(b) == 1
+        assert not future.done()
+
+    def test_async():
+        from python_anvil.async_api import AsyncAnvil
+
+        requests_sent = []
+
+        async def handler(request):
+            body = json.loads(request.content)
+            requests_sent.append(body)
+            return httpx.Response(200, json=_execute(body))
+
+        async def run():
+            anvil = AsyncAnvil(api_key="my_key")
+            anvil.client._session = httpx.AsyncClient(
+                transport=httpx.MockTransport(handler)
+            )
+            async with anvil:
+                async with anvil.batch() as b:
+                    cast = b.get_cast("c1", fields=["eid"])
+                    weld = b.get_weld("missing")
+                    assert isinstance(cast, asyncio.Future)
+                assert await cast == {"eid": "c1"}
+                with pytest.raises(TransportQueryError):
+                    await weld
+
+        asyncio.run(run())
+        assert len(requests_sent) == 1
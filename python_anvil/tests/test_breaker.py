@@ -0,0 +1,253 @@
+# pylint: disable=redefined-outer-name,unused-variable,protected-access
+import asyncio
+import httpx
+import pytest
+import requests
+import time
+from unittest import mock
+
+from python_anvil.breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    endpoint_for_url,
+)
+from python_anvil.exceptions import (
+    AnvilCircuitOpenError,
+    AnvilConnectionError,
+    AnvilTimeoutError,
+)
+from python_anvil.http import HTTPClient
+from python_anvil.limiter import TokenBucketLimiter
+from python_anvil.retry import RetryPolicy
+
+
+URL = "https://app.useanvil.com/api/v1/fill/abc.pdf"
+ENDPOINT = "app.useanvil.com/fill"
+
+
+def _breaker(**kwargs):
+    options = dict(min_requests=4, window=4, open_duration=0.05, half_open_requests=2)
+    return CircuitBreaker(**{**options, **kwargs})
+
+
+def _fail(breaker, count=4, status_code=None):
+    for _ in range(count):
+        breaker.record(breaker.before_request(URL), 0.01, status_code)
+
+
+def describe_endpoint_for_url():
+    @pytest.mark.parametrize(
+        "url, endpoint",
+        [
+            (URL, ENDPOINT),
+            ("https://app.useanvil.com/api/v1/fill/xyz.pdf?x=1", ENDPOINT),
+            (
+                "https://app.useanvil.com/api/document-group/abc.zip",
+                "app.useanvil.com/document-group",
+            ),
+            ("https://graphql.useanvil.com", "graphql.useanvil.com/"),
+        ],
+    )
+    def test_endpoint(url, endpoint):
+        assert endpoint_for_url(url) == endpoint
+
+
+def describe_circuit_breaker():
+    def test_opens_on_failure_rate():
+        breaker = _breaker()
+        _fail(breaker, 2)
+        breaker.record(breaker.before_request(URL), 0.01, 200)
+        assert breaker.state(ENDPOINT) == CLOSED
+        _fail(breaker, 1, status_code=503)
+
+        assert breaker.state(ENDPOINT) == OPEN
+        with pytest.raises(AnvilCircuitOpenError) as e:
+            breaker.before_request(URL)
+        assert e.value.endpoint == ENDPOINT
+        assert 0 < e.value.retry_after <= 0.05
+        assert e.value.retryable
+
+    def test_opens_on_latency():
+        breaker = _breaker(slow_duration=1, slow_rate=0.75)
+        for latency in (2, 0.1, 2, 2):
+            breaker.record(breaker.before_request(URL), latency, 200)
+        assert breaker.state(ENDPOINT) == OPEN
+
+    def test_min_requests():
+        breaker = _breaker(min_requests=10, window=10)
+        _fail(breaker, 9)
+        assert breaker.state(ENDPOINT) == CLOSED
+
+    def test_ignores_client_errors_and_rate_limits():
+        breaker = _breaker()
+        _fail(breaker, 4, status_code=404)
+        _fail(breaker, 4, status_code=429)
+        assert breaker.state(ENDPOINT) == CLOSED
+
+    def test_endpoints_are_separate():
+        breaker = _breaker()
+        _fail(breaker)
+        breaker.before_request("https://graphql.useanvil.com")
+        assert breaker.states() == {ENDPOINT: OPEN, "graphql.useanvil.com/": CLOSED}
+
+    def test_half_open_closes():
+        breaker = _breaker()
+        _fail(breaker)
+        time.sleep(0.06)
+        assert breaker.state(ENDPOINT) == HALF_OPEN
+
+        probes = [breaker.before_request(URL), breaker.before_request(URL)]
+        # Only `half_open_requests` probes are let through.
+        with pytest.raises(AnvilCircuitOpenError):
+            breaker.before_request(URL)
+        for probe in probes:
+            breaker.record(probe, 0.01, 200)
+        assert breaker.state(ENDPOINT) == CLOSED
+
+    def test_half_open_reopens():
+        breaker = _breaker()
+        _fail(breaker)
+        time.sleep(0.06)
+        probe = breaker.before_request(URL)
+        breaker.record(probe, 0.01)
+        assert breaker.state(ENDPOINT) == OPEN
+
+    def test_cancelled_probe():
+        breaker = _breaker(half_open_requests=1)
+        _fail(breaker)
+        time.sleep(0.06)
+        breaker.cancel(breaker.before_request(URL))
+        breaker.record(breaker.before_request(URL), 0.01, 200)
+        assert breaker.state(ENDPOINT) == CLOSED
+
+    def test_ignores_stale_results():
+        breaker = _breaker()
+        stale = breaker.before_request(URL)
+        _fail(breaker)
+        time.sleep(0.06)
+        breaker.before_request(URL)
+        # Sent before the circuit opened, so it doesn't count as a probe.
+        breaker.record(stale, 0.01)
+        assert breaker.state(ENDPOINT) == HALF_OPEN
+
+    def test_on_state_change():
+        changes = []
+        breaker = _breaker(
+            half_open_requests=1,
+            on_state_change=lambda *change: changes.append(change),
+        )
+        _fail(breaker)
+        time.sleep(0.06)
+        breaker.record(breaker.before_request(URL), 0.01, 200)
+        assert changes == [
+            (ENDPOINT, CLOSED, OPEN),
+            (ENDPOINT, OPEN, HALF_OPEN),
+            (ENDPOINT, HALF_OPEN, CLOSED),
+        ]
+
+    def test_failing_hook():
+        breaker = _breaker(on_state_change=mock.Mock(side_effect=ValueError))
+        _fail(breaker)
+        assert breaker.state(ENDPOINT) == OPEN
+
+    def test_reset():
+        breaker = _breaker()
+        _fail(breaker)
+        breaker.reset()
+        assert breaker.state(ENDPOINT) == CLOSED
+
+    def test_in_flight_during_reset():
+        breaker = _breaker()
+        tickets = [breaker.before_request(URL) for _ in range(5)]
+        breaker.reset()
+        breaker.record(tickets[0], 0.01, 200)
+        breaker.cancel(tickets[1])
+
+        # Results of requests sent before the reset don't count for the new
+        # circuit either.
+        breaker.before_request(URL)
+        for ticket in tickets[2:]:
+            breaker.record(ticket, 0.01)
+        assert breaker.state(ENDPOINT) == CLOSED
+        assert not breaker._circuits[ENDPOINT].outcomes
+
+    def test_invalid():
+        with pytest.raises(ValueError):
+            CircuitBreaker(failure_rate=0)
+
+
+def describe_http_client():
+    @pytest.fixture
+    def session():
+        with mock.patch("python_anvil.http.requests.Session") as session:
+            yield session.return_value
+
+    def _client(breaker, limiter=None):
+        return HTTPClient(
+            limiter=limiter or TokenBucketLimiter(calls=100),
+            retry_policy=RetryPolicy(max_retries=5, backoff_base=0),
+            circuit_breaker=breaker,
+        )
+
+    def test_fails_fast_when_open(session):
+        session.request.side_effect = requests.ConnectionError("refused")
+        breaker = _breaker()
+        client = _client(breaker)
+
+        # The circuit opens after the 4th attempt, which stops the retries.
+        with pytest.raises(AnvilCircuitOpenError):
+            client.do_request("GET", URL)
+        assert session.request.call_count == 4
+
+        limiter = mock.Mock()
+        client.limiter = limiter
+        with pytest.raises(AnvilCircuitOpenError):
+            client.do_request("GET", URL)
+        assert session.request.call_count == 4
+        limiter.acquire.assert_not_called()
+
+    def test_records_responses(session):
+        session.request.return_value = mock.Mock(status_code=503, headers={})
+        breaker = _breaker()
+        client = _client(breaker)
+        for _ in range(4):
+            client.do_request("POST", URL)
+        assert breaker.state(ENDPOINT) == OPEN
+
+    def test_probe_released_on_deadline(session):
+        breaker = _breaker(half_open_requests=1)
+        _fail(breaker)
+        time.sleep(0.06)
+        limiter = mock.Mock()
+        limiter.acquire.return_value = False
+
+        with pytest.raises(AnvilTimeoutError):
+            _client(breaker, limiter).do_request("GET", URL, deadline=1)
+        # The probe slot is free again.
+        breaker.before_request(URL)
+
+    def test_connection_error_without_breaker(session):
+        session.request.side_effect = requests.ConnectionError("refused")
+        with pytest.raises(AnvilConnectionError):
+            _client(None).do_request("GET", URL, retry=False)
+
+    def test_async():
+        from python_anvil.async_http import AsyncHTTPClient
+
+        async def handler(request):
+            return httpx.Response(500)
+
+        async def run():
+            client = AsyncHTTPClient(
+                limiter=TokenBucketLimiter(calls=100),
+                retry_policy=RetryPolicy(max_retries=5, backoff_base=0),
+                circuit_breaker=_breaker(),
+            )
+            client._session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            async with client._session:
+                await client.do_request("GET", URL)
+
+        with pytest.raises(AnvilCircuitOpenError):
+            asyncio.run(run())
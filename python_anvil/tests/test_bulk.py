@@ -0,0 +1,184 @@
+# pylint: disable=redefined-outer-name,unused-variable,protected-access
+import asyncio
+import httpx
+import json
+import pytest
+import requests
+from graphql import validate
+from unittest import mock
+
+from python_anvil.api import Anvil
+from python_anvil.bulk import (
+    CAST,
+    ETCH_PACKET,
+    SIGNER,
+    WELD_DATA,
+    BulkItem,
+    bulk_queries,
+    bulk_query,
+    bulk_results,
+)
+from python_anvil.exceptions import AnvilGraphQLError
+from python_anvil.query_cache import print_query
+from python_anvil.schema import get_schema_cache
+
+
+def _response(body):
+    res = requests.Response()
+    res.status_code = 200
+    res._content = json.dumps(body).encode()
+    return res
+
+
+def _signers(request_json):
+    """Answer a bulk signer query, with an error for eids starting with `x`."""
+    variables = request_json["variables"]
+    data, errors = {}, []
+    for name, eid in variables.items():
+        alias = "r" + name[1:]
+        if eid.startswith("x"):
+            data[alias] = None
+            errors.append({"message": f"Not found: {eid}", "path": [alias]})
+        else:
+            data[alias] = {"eid": eid, "name": eid.upper()}
+    return {"data": data, "errors": errors} if errors else {"data": data}
+
+
+def describe_bulk_query():
+    @pytest.mark.parametrize("field", [CAST, ETCH_PACKET, SIGNER, WELD_DATA])
+    def test_valid(field):
+        document = bulk_query(field, 3)
+        assert not validate(get_schema_cache().local_schema(), document)
+
+    def test_arguments():
+        document = bulk_query(CAST, 2, ["eid"], ["versionNumber"])
+        assert print_query(document) == (
+            "query BulkCast($e0:String!$e1:String!$versionNumber:Int)"
+            "{r0:cast(eid:$e0 versionNumber:$versionNumber){eid}"
+            "r1:cast(eid:$e1 versionNumber:$versionNumber){eid}}"
+        )
+        assert not validate(get_schema_cache().local_schema(), document)
+
+    def test_unknown_argument():
+        with pytest.raises(ValueError):
+            bulk_query(SIGNER, 1, arguments=["versionNumber"])
+
+    def test_cached_per_size():
+        assert bulk_query(SIGNER, 2) is bulk_query(SIGNER, 2)
+        assert bulk_query(SIGNER, 2) is not bulk_query(SIGNER, 3)
+
+
+def describe_bulk_queries():
+    def test_chunks():
+        eids = [f"eid{i}" for i in range(5)]
+        chunks = list(bulk_queries(SIGNER, eids + ["eid0"], chunk_size=2))
+        assert [chunk for _, _, chunk in chunks] == [
+            ["eid0", "eid1"],
+            ["eid2", "eid3"],
+            ["eid4"],
+        ]
+        assert chunks[0][1] == {"e0": "eid0", "e1": "eid1"}
+        assert chunks[0][0] is chunks[1][0]
+
+    def test_arguments():
+        ((_, variables, _),) = bulk_queries(CAST, ["a"], arguments={"versionNumber": 3})
+        assert variables == {"e0": "a", "versionNumber": 3}
+        ((_, variables, _),) = bulk_queries(
+            CAST, ["a"], arguments={"versionNumber": None}
+        )
+        assert variables == {"e0": "a"}
+
+    def test_invalid_chunk_size():
+        with pytest.raises(ValueError):
+            list(bulk_queries(SIGNER, ["a"], chunk_size=0))
+
+
+def describe_bulk_results():
+    def test_per_item_errors():
+        results = bulk_results(
+            ["a", "b", "c"],
+            {"r0": {"eid": "a"}, "r1": None, "r2": {"eid": "c", "user": None}},
+            [
+                {"message": "Not found", "path": ["r1"]},
+                {"message": "Denied", "path": ["r2", "user"]},
+            ],
+        )
+        assert results["a"] == BulkItem({"eid": "a"})
+        assert results["b"].data is None
+        assert str(results["b"].error) == "Not found"
+        assert results["c"].data == {"eid": "c", "user": None}
+        assert results["c"].error.errors == [
+            {"message": "Denied", "path": ["r2", "user"]}
+        ]
+
+    def test_errors_without_path():
+        results = bulk_results(
+            ["a", "b"], None, [{"message": "Bad query"}, {"message": "Other"}]
+        )
+        for item in results.values():
+            assert isinstance(item.error, AnvilGraphQLError)
+            assert str(item.error) == "Bad query"
+            assert len(item.error.errors) == 2
+
+
+def describe_anvil():
+    @pytest.fixture
+    def anvil():
+        anvil = Anvil(api_key="my_key")
+        with mock.patch.object(anvil.client, "do_request") as do_request:
+            do_request.side_effect = lambda *args, **kwargs: _response(
+                _signers(kwargs["json"])
+            )
+            yield anvil
+
+    def test_get_signers(anvil):
+        eids = [f"eid{i}" for i in range(120)] + ["x1", "eid3"]
+        results = anvil.get_signers(eids)
+
+        assert anvil.client.do_request.call_count == 3
+        assert list(results) == eids[:-1]
+        assert results["eid3"] == BulkItem({"eid": "eid3", "name": "EID3"})
+        assert results["x1"].data is None
+        assert str(results["x1"].error) == "Not found: x1"
+
+    def test_get_casts_by_eid(anvil):
+        anvil.client.do_request.side_effect = None
+        anvil.client.do_request.return_value = _response({"data": {"r0": {"eid": "a"}}})
+        results = anvil.get_casts_by_eid(["a"], fields=["eid"], version_number=2)
+
+        assert results == {"a": BulkItem({"eid": "a"})}
+        body = anvil.client.do_request.call_args[1]["json"]
+        assert body["variables"] == {"e0": "a", "versionNumber": 2}
+        assert "versionNumber:$versionNumber" in body["query"]
+
+    def test_get_weld_datas_and_etch_packets(anvil):
+        anvil.client.do_request.side_effect = None
+        anvil.client.do_request.return_value = _response({"data": {"r0": None}})
+        assert anvil.get_weld_datas(["a"]) == {"a": BulkItem(None)}
+        assert (
+            "weldData(eid:$e0)" in anvil.client.do_request.call_args[1]["json"]["query"]
+        )
+        assert anvil.get_etch_packets(["a"]) == {"a": BulkItem(None)}
+
+    def test_async():
+        from python_anvil.async_api import AsyncAnvil
+
+        requests_sent = []
+
+        async def handler(request):
+            body = json.loads(request.content)
+            requests_sent.append(body)
+            return httpx.Response(200, json=_signers(body))
+
+        async def run():
+            anvil = AsyncAnvil(api_key="my_key")
+            anvil.client._session = httpx.AsyncClient(
+                transport=httpx.MockTransport(handler)
+            )
+            async with anvil:
+                return await anvil.get_signers(["a", "b", "xc"], chunk_size=2)
+
+        results = asyncio.run(run())
+        assert len(requests_sent) == 2
+        assert results["b"].data == {"eid": "b", "name": "B"}
+        assert str(results["xc"].error) == "Not found: xc"
@@ -0,0 +1,158 @@
+# pylint: disable=redefined-outer-name,unused-variable,protected-access
+import asyncio
+import httpx
+import json
+import pickle
+import pytest
+import requests
+from unittest import mock
+
+from python_anvil.api import Anvil
+from python_anvil.bulk import BulkItem
+from python_anvil.casts import Cast
+from python_anvil.exceptions import AnvilGraphQLError
+
+
+def _response(body):
+    res = requests.Response()
+    res.status_code = 200
+    res._content = json.dumps(body).encode()
+    return res
+
+
+def _field_info(eid):
+    return {"fields": [{"id": f"{eid}-field"}]}
+
+
+def _answer(body):
+    """Answer a casts listing, or a bulk cast query with each `fieldInfo`."""
+    if "currentUser" in body["query"]:
+        casts = [{"eid": f"c{i}", "title": f"Cast {i}"} for i in range(120)]
+        return {"data": {"currentUser": {"organizations": [{"casts": casts}]}}}
+    data = {
+        "r" + name[1:]: {"eid": eid, "fieldInfo": _field_info(eid)}
+        for name, eid in body["variables"].items()
+    }
+    return {"data": data}
+
+
+@pytest.fixture
+def anvil():
+    anvil = Anvil(api_key="my_key")
+    with mock.patch.object(anvil.client, "do_request") as do_request:
+        do_request.side_effect = lambda *args, **kwargs: _response(
+            _answer(kwargs["json"])
+        )
+        yield anvil
+
+
+def describe_cast():
+    def test_loads_on_access():
+        loader = mock.Mock(
+            side_effect=lambda casts, fields: casts[0].update(fieldInfo={}) or {}
+        )
+        cast = Cast({"eid": "c1", "title": "Cast"}, loader)
+
+        assert cast["fieldInfo"] == {}
+        assert cast.get("fieldInfo") == {}
+        loader.assert_called_once_with([cast], ["fieldInfo"])
+
+    def test_other_fields():
+        loader = mock.Mock()
+        cast = Cast({"eid": "c1"}, loader)
+        with pytest.raises(KeyError):
+            _ = cast["name"]
+        assert cast.get("name", "default") == "default"
+        loader.assert_not_called()
+
+    def test_without_loader():
+        with pytest.raises(KeyError):
+            _ = Cast({"eid": "c1"})["fieldInfo"]
+
+    def test_not_found():
+        cast = Cast({"eid": "c1"}, mock.Mock(return_value={"c1": BulkItem(None)}))
+        assert cast.get("fieldInfo") is None
+
+    def test_error():
+        error = AnvilGraphQLError("Denied")
+        cast = Cast(
+            {"eid": "c1"}, mock.Mock(return_value={"c1": BulkItem(None, error)})
+        )
+        with pytest.raises(AnvilGraphQLError):
+            _ = cast["fieldInfo"]
+
+    def test_pickle():
+        cast = pickle.loads(pickle.dumps(Cast({"eid": "c1"}, mock.Mock())))
+        assert cast == {"eid": "c1"}
+        assert cast._loader is None
+
+
+def describe_anvil():
+    def test_lightweight_listing(anvil):
+        casts = anvil.get_casts()
+
+        assert len(casts) == 120
+        assert casts[0] == {"eid": "c0", "title": "Cast 0"}
+        assert isinstance(casts[0], Cast)
+        query = anvil.client.do_request.call_args[1]["json"]["query"]
+        assert "fieldInfo" not in query
+
+    def test_lazy_field_info(anvil):
+        cast = anvil.get_casts()[3]
+        assert cast["fieldInfo"] == _field_info("c3")
+        assert cast["fieldInfo"] == _field_info("c3")
+        assert anvil.client.do_request.call_count == 2
+        body = anvil.client.do_request.call_args[1]["json"]
+        assert body["variables"] == {"e0": "c3"}
+
+    def test_load_cast_fields(anvil):
+        casts = anvil.get_casts()
+        assert casts[0]["fieldInfo"] == _field_info("c0")
+        anvil.client.do_request.reset_mock()
+
+        results = anvil.load_cast_fields(casts)
+
+        # The cast that was loaded already isn't fetched again.
+        assert anvil.client.do_request.call_count == 3
+        assert len(results) == 119
+        assert casts[100]["fieldInfo"] == _field_info("c100")
+        assert anvil.client.do_request.call_count == 3
+
+    def test_requested_fields(anvil):
+        anvil.client.do_request.side_effect = None
+        anvil.client.do_request.return_value = _response(
+            {
+                "data": {
+                    "currentUser": {
+                        "organizations": [
+                            {"casts": [{"eid": "c1", "fieldInfo": {"fields": []}}]}
+                        ]
+                    }
+                }
+            }
+        )
+        (cast,) = anvil.get_casts(fields=["eid", "fieldInfo"])
+        assert cast["fieldInfo"] == {"fields": []}
+        assert anvil.client.do_request.call_count == 1
+
+    def test_async():
+        from python_anvil.async_api import AsyncAnvil
+
+        async def handler(request):
+            return httpx.Response(200, json=_answer(json.loads(request.content)))
+
+        async def run():
+            anvil = AsyncAnvil(api_key="my_key")
+            anvil.client._session = httpx.AsyncClient(
+                transport=httpx.MockTransport(handler)
+            )
+            async with anvil:
+                casts = await anvil.get_casts()
+                with pytest.raises(KeyError):
+                    _ = casts[0]["fieldInfo"]
+                await anvil.load_cast_fields(casts[:2])
+            return casts
+
+        casts = asyncio.run(run())
+        assert casts[1]["fieldInfo"] == _field_info("c1")
+        assert "fieldInfo" not in casts[2]
@@ -1,11 +1,16 @@
 # pylint: disable=redefined-outer-name,unused-variable,expression-not-assigned
 
+import io
 import json
+import os
 import pytest
+import requests
 from click.testing import CliRunner
 from unittest import mock
 
 from python_anvil.cli import cli
+from python_anvil.exceptions import AnvilClientError
+from python_anvil.http import StreamedContent
 
 
 @pytest.fixture
@@ -31,6 +36,23 @@ def describe_cli():
         assert anvil.call_count == 1
         assert not isinstance(res.exception, ValueError)
 
+    @mock.patch("python_anvil.cli.Anvil")
+    def it_passes_limiter_options(anvil, runner, monkeypatch):
+        set_key(monkeypatch)
+        runner.invoke(
+            cli,
+            [
+                "--limiter-backend",
+                "sqlite",
+                "--limiter-path",
+                "/tmp/limits.db",
+                "current-user",
+            ],
+        )
+        anvil.assert_called_once_with(
+            "MY_KEY", limiter_backend="sqlite", limiter_path="/tmp/limits.db"
+        )
+
     def describe_current_user():
         @mock.patch("python_anvil.api.Anvil.query")
         def it_queries(query, runner, monkeypatch):
@@ -110,3 +132,79 @@ def describe_cli():
 
             runner.invoke(cli, ['gql-query', '-q', query_str, '-v', variables])
             query.assert_called_once_with(query_str, variables=variables, debug=False)
+
+    def describe_cast():
+        @mock.patch("python_anvil.api.Anvil.get_casts")
+        def it_lists_eids_and_titles(get_casts, runner, monkeypatch):
+            set_key(monkeypatch)
+            get_casts.return_value = [dict(eid="abc123", title="Some Cast")]
+
+            res = runner.invoke(cli, ["cast", "--list"])
+
+            get_casts.assert_called_once_with(
+                fields=["eid", "title"], show_all=False, debug=False
+            )
+            assert "Some Cast" in res.output
+
+    def describe_download_documents():
+        def _streamed(body):
+            res = requests.Response()
+            res.status_code = 200
+            res.raw = io.BytesIO(body)
+            return StreamedContent(res)
+
+        @mock.patch("python_anvil.api.Anvil.download_documents")
+        def it_saves_the_zip(download_documents, runner, monkeypatch):
+            set_key(monkeypatch)
+            download_documents.return_value = _streamed(b"zip")
+
+            with runner.isolated_filesystem():
+                res = runner.invoke(cli, ["download-documents", "-d", "abc123"])
+                with open("abc123.zip", "rb") as f:
+                    assert f.read() == b"zip"
+
+            download_documents.assert_called_once_with(
+                "abc123", debug=False, stream=True
+            )
+            assert "Saved as 'abc123.zip'" in res.output
+
+        @mock.patch("python_anvil.api.Anvil.download_documents")
+        def it_writes_to_stdout(download_documents, runner, monkeypatch):
+            set_key(monkeypatch)
+            download_documents.return_value = _streamed(b"zip")
+
+            with runner.isolated_filesystem():
+                res = runner.invoke(
+                    cli, ["download-documents", "-d", "abc123", "-f", "-"]
+                )
+                assert not os.path.exists("-")
+            assert res.stdout_bytes == b"zip"
+
+        @mock.patch("python_anvil.api.Anvil.download_documents")
+        def it_resumes(download_documents, runner, monkeypatch):
+            set_key(monkeypatch)
+            download_documents.return_value = "out.zip"
+
+            res = runner.invoke(
+                cli, ["download-documents", "-d", "abc123", "-f", "out.zip", "--resume"]
+            )
+
+            download_documents.assert_called_once_with(
+                "abc123", debug=False, output="out.zip", resume=True
+            )
+            assert "Saved as 'out.zip'" in res.output
+
+        @mock.patch("python_anvil.api.Anvil.download_documents")
+        def it_keeps_the_file_on_error(download_documents, runner, monkeypatch):
+            set_key(monkeypatch)
+            download_documents.side_effect = AnvilClientError("Not found", 404)
+
+            with runner.isolated_filesystem():
+                with open("out.zip", "wb") as f:
+                    f.write(b"old")
+                res = runner.invoke(
+                    cli, ["download-documents", "-d", "abc123", "-f", "out.zip"]
+                )
+                assert isinstance(res.exception, AnvilClientError)
+                with open("out.zip", "rb") as f:
+                    assert f.read() == b"old"
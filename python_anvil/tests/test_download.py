@@ -0,0 +1,266 @@
+# pylint: disable=redefined-outer-name,unused-variable,protected-access
+import asyncio
+import base64
+import hashlib
+import json
+import pytest
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from python_anvil.api import Anvil
+from python_anvil.exceptions import (
+    AnvilClientError,
+    AnvilConnectionError,
+    AnvilDownloadError,
+)
+from python_anvil.http import HTTPClient
+from python_anvil.limiter import TokenBucketLimiter
+from python_anvil.retry import RetryPolicy
+
+
+BODY = bytes(range(256)) * 64
+ETAG = '"v1"'
+# Divides the 1000 bytes sent before a dropped connection.
+CHUNK_SIZE = 500
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        server = self.server
+        server.requests.append(dict(self.headers))
+        if self.path != "/file.zip":
+            self.send_response(404)
+            self.send_header("Content-Length", "9")
+            self.end_headers()
+            self.wfile.write(b"not found")
+            return
+
+        body = server.body
+        start = 0
+        range_header = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if server.ranges and range_header and if_range in (None, ETAG):
+            start = int(range_header[len("bytes=") : -1])
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(body)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}"
+            )
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body) - start))
+        self.send_header("ETag", ETAG)
+        for name, value in server.extra_headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        if server.drops:
+            # Drop the connection partway through the body.
+            server.drops -= 1
+            self.wfile.write(body[start : start + 1000])
+            self.close_connection = True
+            return
+        self.wfile.write(body[start:])
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    httpd.body = BODY
+    httpd.requests = []
+    httpd.ranges = True
+    httpd.drops = 0
+    httpd.extra_headers = {}
+    thread = threading.Thread(
+        target=httpd.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    )
+    thread.start()
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}/file.zip"
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _write_part(directory, data, etag=ETAG):
+    """Leave a partial download behind, as an earlier call would."""
+    (directory / "docs.zip.part").write_bytes(data)
+    (directory / "docs.zip.part.meta").write_text(json.dumps({"etag": etag}))
+
+
+def _policy():
+    return RetryPolicy(backoff_base=0, jitter=False)
+
+
+@pytest.fixture
+def client():
+    return HTTPClient(
+        api_key="my_key", limiter=TokenBucketLimiter(calls=100), retry_policy=_policy()
+    )
+
+
+def describe_download():
+    def test_download(server, client, tmp_path):
+        path = tmp_path / "docs.zip"
+        content, status_code, _ = client.download(server.url, path)
+
+        assert (content, status_code) == (str(path), 200)
+        assert path.read_bytes() == BODY
+        assert not (tmp_path / "docs.zip.part").exists()
+        assert server.requests[0]["Accept-Encoding"] == "identity"
+        assert "Range" not in server.requests[0]
+
+    def test_resumes_dropped_connection(server, client, tmp_path):
+        server.drops = 2
+        path = tmp_path / "docs.zip"
+        client.download(
+            server.url,
+            path,
+            sha256=hashlib.sha256(BODY).hexdigest(),
+            chunk_size=CHUNK_SIZE,
+        )
+
+        assert path.read_bytes() == BODY
+        assert [r.get("Range") for r in server.requests] == [
+            None,
+            "bytes=1000-",
+            "bytes=2000-",
+        ]
+        assert server.requests[1]["If-Range"] == ETAG
+
+    def test_resumes_partial_file(server, client, tmp_path):
+        path = tmp_path / "docs.zip"
+        _write_part(tmp_path, BODY[:5000])
+        client.download(server.url, path, sha256=hashlib.sha256(BODY).hexdigest())
+
+        assert path.read_bytes() == BODY
+        assert server.requests[0]["Range"] == "bytes=5000-"
+        assert server.requests[0]["If-Range"] == ETAG
+        assert not (tmp_path / "docs.zip.part.meta").exists()
+
+    def test_partial_file_already_complete(server, client, tmp_path):
+        path = tmp_path / "docs.zip"
+        _write_part(tmp_path, BODY)
+        client.download(server.url, path, sha256=hashlib.sha256(BODY).hexdigest())
+        assert path.read_bytes() == BODY
+        assert len(server.requests) == 1
+
+    def test_changed_since_last_run(server, client, tmp_path):
+        path = tmp_path / "docs.zip"
+        _write_part(tmp_path, b"old zip", etag='"v0"')
+        client.download(server.url, path)
+
+        # The server ignores the range, since the file changed.
+        assert server.requests[0]["If-Range"] == '"v0"'
+        assert path.read_bytes() == BODY
+
+    def test_changed_since_last_run_same_length(server, client, tmp_path):
+        path = tmp_path / "docs.zip"
+        _write_part(tmp_path, b"x" * len(BODY), etag='"v0"')
+        client.download(server.url, path)
+        assert path.read_bytes() == BODY
+
+    def test_partial_file_without_validator(server, client, tmp_path):
+        path = tmp_path / "docs.zip"
+        (tmp_path / "docs.zip.part").write_bytes(b"old zip")
+        client.download(server.url, path)
+
+        assert "Range" not in server.requests[0]
+        assert path.read_bytes() == BODY
+
+    def test_ranges_not_supported(server, client, tmp_path):
+        server.ranges = False
+        server.drops = 1
+        path = tmp_path / "docs.zip"
+        client.download(server.url, path)
+        assert path.read_bytes() == BODY
+        assert len(server.requests) == 2
+
+    def test_gives_up(server, tmp_path):
+        server.drops = 5
+        client = HTTPClient(
+            limiter=TokenBucketLimiter(calls=100),
+            retry_policy=RetryPolicy(max_retries=0),
+        )
+        path = tmp_path / "docs.zip"
+        with pytest.raises(AnvilConnectionError):
+            client.download(server.url, path, chunk_size=CHUNK_SIZE)
+
+        assert not path.exists()
+        assert (tmp_path / "docs.zip.part").read_bytes() == BODY[:1000]
+        meta = json.loads((tmp_path / "docs.zip.part.meta").read_text())
+        assert meta["etag"] == ETAG
+
+    def test_checksum_mismatch(server, client, tmp_path):
+        path = tmp_path / "docs.zip"
+        with pytest.raises(AnvilDownloadError, match="Checksum mismatch"):
+            client.download(server.url, path, sha256="00" * 32, retry=False)
+
+        assert not path.exists()
+        assert not (tmp_path / "docs.zip.part").exists()
+
+    def test_checksum_header(server, client, tmp_path):
+        digest = base64.b64encode(hashlib.sha256(b"other").digest()).decode()
+        server.extra_headers = {"Repr-Digest": f"sha-256=:{digest}:"}
+        with pytest.raises(AnvilDownloadError, match="Checksum mismatch"):
+            client.download(server.url, tmp_path / "docs.zip", retry=False)
+
+    def test_error_response(server, client, tmp_path):
+        content, status_code, _ = client.download(
+            server.url.replace("file.zip", "missing"), tmp_path / "docs.zip"
+        )
+        assert (content, status_code) == (b"not found", 404)
+
+    def test_async(server, tmp_path):
+        from python_anvil.async_http import AsyncHTTPClient
+
+        server.drops = 1
+        path = tmp_path / "docs.zip"
+
+        async def run():
+            client = AsyncHTTPClient(
+                limiter=TokenBucketLimiter(calls=100), retry_policy=_policy()
+            )
+            try:
+                return await client.download(server.url, path, chunk_size=CHUNK_SIZE)
+            finally:
+                await client.close()
+
+        assert asyncio.run(run())[1] == 206
+        assert path.read_bytes() == BODY
+        assert server.requests[1]["Range"] == "bytes=1000-"
+
+    def describe_download_documents():
+        @pytest.fixture
+        def anvil():
+            return Anvil(api_key="my_key")
+
+        def test_resume(anvil, tmp_path):
+            path = tmp_path / "docs.zip"
+            with mock.patch.object(anvil.client, "download") as download:
+                download.return_value = (str(path), 200, {})
+                res = anvil.download_documents("abc", output=path, resume=True)
+
+            assert res == str(path)
+            assert download.call_args[0][0].endswith("/document-group/abc.zip")
+            assert download.call_args[1]["path"] == path
+
+        def test_resume_error(anvil, tmp_path):
+            with mock.patch.object(anvil.client, "download") as download:
+                download.return_value = (b"nope", 404, {})
+                with pytest.raises(AnvilClientError):
+                    anvil.download_documents(
+                        "abc", output=tmp_path / "docs.zip", resume=True
+                    )
+
+        def test_resume_requires_path(anvil):
+            with pytest.raises(ValueError):
+                anvil.download_documents("abc", resume=True)
@@ -0,0 +1,62 @@
+# pylint: disable=redefined-outer-name,unused-variable,protected-access
+import os
+import pytest
+import threading
+
+from python_anvil.forksafe import ForkSafeLock, register_after_fork
+
+
+def _in_child(check) -> bool:
+    """Fork, and run `check` in the child process."""
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0 if check() else 1)
+    _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status) == 0
+
+
+def describe_fork_safe_lock():
+    def test_lock():
+        lock = ForkSafeLock()
+        with lock:
+            assert lock.locked()
+            assert not lock.acquire(timeout=0)
+        assert lock.acquire()
+        lock.release()
+
+    @pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+    def test_replaced_in_child():
+        lock = ForkSafeLock()
+        held = threading.Event()
+        done = threading.Event()
+
+        def hold():
+            with lock:
+                held.set()
+                done.wait()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        held.wait()
+        try:
+            # The thread holding the lock doesn't exist in the child.
+            assert _in_child(lambda: lock.acquire(timeout=1))
+            assert lock.locked()
+        finally:
+            done.set()
+            thread.join()
+
+
+def describe_register_after_fork():
+    @pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+    def test_called_in_child():
+        class State:
+            forked = False
+
+            def after_fork(self):
+                self.forked = True
+
+        state = State()
+        register_after_fork(state)
+        assert _in_child(lambda: state.forked)
+        assert not state.forked
@@ -0,0 +1,196 @@
+# pylint: disable=redefined-outer-name,unused-variable,protected-access
+import asyncio
+import httpx
+import pytest
+import threading
+import time
+from gql import gql
+from unittest import mock
+
+from python_anvil.gql_transport import HTTPClientTransport
+from python_anvil.hedge import HedgePolicy, should_hedge
+from python_anvil.http import HTTPClient
+from python_anvil.limiter import TokenBucketLimiter
+from python_anvil.retry import RetryBudget, RetryPolicy
+
+
+class _Response:
+    def __init__(self, name):
+        self.name = name
+        self.status_code = 200
+        self.headers = {}
+        self.closed = threading.Event()
+
+    def close(self):
+        self.closed.set()
+
+
+def _policy(**kwargs):
+    return HedgePolicy(initial_delay=0.05, min_delay=0, **kwargs)
+
+
+def describe_hedge_policy():
+    def test_initial_delay():
+        policy = HedgePolicy(initial_delay=0.3, min_samples=3)
+        policy.record(0.01)
+        assert policy.delay() == 0.3
+
+    def test_percentile():
+        policy = HedgePolicy(percentile=90, min_delay=0, min_samples=10)
+        for i in range(100):
+            policy.record(i / 100)
+        assert policy.delay() == 0.89
+
+    def test_bounds():
+        policy = HedgePolicy(min_delay=0.1, max_delay=1, min_samples=1)
+        policy.record(0.001)
+        assert policy.delay() == 0.1
+        policy = HedgePolicy(min_delay=0.1, max_delay=1, min_samples=1)
+        policy.record(10)
+        assert policy.delay() == 1
+
+    def test_window():
+        policy = HedgePolicy(window=2, min_samples=1, min_delay=0)
+        for latency in (5, 0.1, 0.1):
+            policy.record(latency)
+        assert policy.delay() == 0.1
+
+    def test_invalid():
+        with pytest.raises(ValueError):
+            HedgePolicy(percentile=100)
+
+    def test_should_hedge():
+        assert should_hedge("GET", None)
+        assert not should_hedge("POST", None)
+        assert should_hedge("POST", True)
+        assert not should_hedge("GET", False)
+
+
+def describe_hedged_requests():
+    @pytest.fixture
+    def session():
+        with mock.patch("python_anvil.http.requests.Session") as session:
+            yield session.return_value
+
+    def _client(**kwargs):
+        kwargs.setdefault("limiter", TokenBucketLimiter(calls=100))
+        kwargs.setdefault("hedge_policy", _policy())
+        return HTTPClient(retry_policy=RetryPolicy(backoff_base=0), **kwargs)
+
+    def _slow_then_fast(delay=1.0):
+        calls = []
+        slow = _Response("slow")
+
+        def request(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                time.sleep(delay)
+                return slow
+            return _Response("fast")
+
+        return request, calls, slow
+
+    def test_hedges_slow_request(session):
+        request, calls, slow = _slow_then_fast()
+        session.request.side_effect = request
+
+        started = time.monotonic()
+        res = _client().do_request("GET", "https://x.example")
+
+        assert res.name == "fast"
+        assert time.monotonic() - started < 0.5
+        assert len(calls) == 2
+        # The slow response is released once it arrives.
+        assert slow.closed.wait(2)
+
+    def test_fast_request_not_hedged(session):
+        session.request.return_value = _Response("fast")
+        client = _client()
+        assert client.do_request("GET", "https://x.example").name == "fast"
+        assert session.request.call_count == 1
+        assert len(client.hedge_policy._latencies) == 1
+
+    @pytest.mark.parametrize(
+        "method, kwargs",
+        [("POST", {}), ("GET", {"hedge": False}), ("GET", {"stream": True})],
+    )
+    def test_not_hedged(session, method, kwargs):
+        request, calls, _ = _slow_then_fast(delay=0.2)
+        session.request.side_effect = request
+        assert _client().do_request(method, "https://x.example", **kwargs).name == (
+            "slow"
+        )
+        assert len(calls) == 1
+
+    def test_uses_rate_limiter(session):
+        request, calls, _ = _slow_then_fast(delay=0.2)
+        session.request.side_effect = request
+        limiter = TokenBucketLimiter(calls=1, period=60, burst=1)
+
+        res = _client(limiter=limiter).do_request("GET", "https://x.example")
+
+        # The only token went to the first request, so there was no hedge.
+        assert res.name == "slow"
+        assert len(calls) == 1
+
+    def test_budget(session):
+        request, calls, _ = _slow_then_fast(delay=0.2)
+        session.request.side_effect = request
+        policy = _policy(budget=RetryBudget(ratio=0, min_retries=0))
+        _client(hedge_policy=policy).do_request("GET", "https://x.example")
+        assert len(calls) == 1
+
+    def test_hedge_rescues_failure(session):
+        calls = []
+
+        def request(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                time.sleep(0.2)
+                raise ConnectionResetError("reset")
+            return _Response("hedge")
+
+        session.request.side_effect = request
+        res = _client().do_request("GET", "https://x.example", retry=False)
+        assert res.name == "hedge"
+
+    def test_all_fail(session):
+        session.request.side_effect = ConnectionError("refused")
+        with pytest.raises(ConnectionError):
+            _client().do_request("GET", "https://x.example", retry=False)
+
+    def test_graphql_queries_hedged():
+        client = _client()
+        transport = HTTPClientTransport(client, url="https://x.example")
+        transport.connect()
+        with mock.patch.object(client, "do_request") as do_request:
+            do_request.return_value.json.return_value = {"data": {}}
+            transport.execute(gql("query { currentUser { eid } }"))
+            assert do_request.call_args[1]["hedge"] is True
+            transport.execute(gql("mutation { removeWeldData(eid: \"a\") }"))
+            assert do_request.call_args[1]["hedge"] is False
+
+    def test_async():
+        from python_anvil.async_http import AsyncHTTPClient
+
+        calls = []
+
+        async def handler(request):
+            calls.append(request)
+            if len(calls) == 1:
+                await asyncio.sleep(1)
+                return httpx.Response(200, content=b"slow")
+            return httpx.Response(200, content=b"fast")
+
+        async def run():
+            client = AsyncHTTPClient(
+                limiter=TokenBucketLimiter(calls=100), hedge_policy=_policy()
+            )
+            client._session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            async with client._session:
+                return await client.do_request("GET", "https://x.example")
+
+        started = time.monotonic()
+        assert asyncio.run(run()).content == b"fast"
+        assert time.monotonic() - started < 0.5
+        assert len(calls) == 2
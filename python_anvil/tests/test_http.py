@@ -1,10 +1,29 @@
-# pylint: disable=redefined-outer-name,unused-variable,expression-not-assigned,singleton-comparison
+# pylint: disable=redefined-outer-name,unused-variable,expression-not-assigned,singleton-comparison,protected-access
+import gzip
+import io
+import json
+import os
 import pytest
+import requests
+import zstandard
 from typing import Dict
 from unittest import mock
 
-from python_anvil.exceptions import AnvilRequestException
-from python_anvil.http import HTTPClient
+from python_anvil.constants import DEFAULT_TIMEOUT
+from python_anvil.exceptions import (
+    AnvilConnectionError,
+    AnvilRateLimitException,
+    AnvilRequestException,
+    AnvilTimeoutError,
+)
+from python_anvil.http import (
+    HTTPClient,
+    StreamedContent,
+    _cap_timeout,
+    parse_retry_after,
+)
+from python_anvil.limiter import TokenBucketLimiter
+from python_anvil.retry import RetryBudget, RetryPolicy
 
 
 class HTTPResponse:
@@ -19,6 +38,10 @@ def describe_http_client():
         class MockResponse:
             status_code = 429
             headers = {"Retry-After": 1}
+            closed = False
+
+            def close(self):
+                self.closed = True
 
         return MockResponse
 
@@ -26,6 +49,110 @@ def describe_http_client():
         client = HTTPClient()
         assert isinstance(client, HTTPClient)
 
+    def describe_limiter():
+        def test_environment_limits():
+            assert HTTPClient(environment="dev").limiter.calls == 2
+            assert HTTPClient(environment="prod").limiter.calls == 40
+
+        def test_limiter_per_client():
+            assert HTTPClient().limiter is not HTTPClient().limiter
+
+        def test_custom_limiter():
+            limiter = TokenBucketLimiter(calls=5, period=1)
+            assert HTTPClient(limiter=limiter).limiter is limiter
+
+        @mock.patch("python_anvil.http.requests.Session")
+        def test_acquires_per_request(session):
+            limiter = mock.MagicMock()
+            client = HTTPClient(api_key="my_key", limiter=limiter)
+            client.do_request("GET", "http://localhost")
+            limiter.acquire.assert_called_once_with(timeout=None)
+
+        @mock.patch("python_anvil.http.requests.Session")
+        def test_observes_responses(session):
+            response = HTTPResponse()
+            session.return_value.request.return_value = response
+            limiter = mock.MagicMock()
+            client = HTTPClient(api_key="my_key", limiter=limiter)
+            client.do_request("GET", "http://localhost")
+            limiter.observe.assert_called_once_with(200, response.headers)
+
+    def describe_connection_pool():
+        def test_pool_size():
+            client = HTTPClient(pool_connections=2, pool_maxsize=20)
+            adapter = client._session.get_adapter("https://app.useanvil.com")
+            assert adapter._pool_connections == 2
+            assert adapter._pool_maxsize == 20
+
+        def test_keep_alive():
+            assert HTTPClient()._session.headers["Connection"] == "keep-alive"
+            client = HTTPClient(keep_alive=False)
+            assert client._session.headers["Connection"] == "close"
+
+        def test_close():
+            client = HTTPClient()
+            with mock.patch.object(client._session, "close") as close:
+                client.close()
+            close.assert_called_once_with()
+
+        def test_warmup():
+            client = HTTPClient(limiter=mock.MagicMock())
+            with mock.patch.object(client, "_session") as session:
+                client.warmup(["https://one.example", "https://two.example"])
+            assert session.request.call_args_list == [
+                mock.call(
+                    "HEAD",
+                    url,
+                    headers=None,
+                    data=None,
+                    auth=None,
+                    params=None,
+                    files=None,
+                    timeout=DEFAULT_TIMEOUT,
+                )
+                for url in ["https://one.example", "https://two.example"]
+            ]
+
+        def test_warmup_ignores_errors():
+            client = HTTPClient(limiter=mock.MagicMock())
+            with mock.patch.object(client, "_session") as session:
+                session.request.side_effect = requests.ConnectionError("nope")
+                client.warmup(["https://one.example"])
+
+    def describe_fork_safety():
+        def test_resets_after_pid_change():
+            limiter = mock.MagicMock()
+            client = HTTPClient(limiter=limiter)
+            session = client._session
+            with mock.patch("python_anvil.http.os.getpid", return_value=-1):
+                with mock.patch.object(HTTPClient, "_create_session") as create:
+                    client.do_request("GET", "http://localhost")
+            assert client._session is create.return_value
+            assert client._pid == -1
+            limiter.after_fork.assert_called_once_with()
+            # The parent's connections are left alone.
+            assert session is not client._session
+
+        def test_no_reset_in_same_process():
+            limiter = mock.MagicMock()
+            client = HTTPClient(limiter=limiter)
+            with mock.patch.object(client, "_session"):
+                client.do_request("GET", "http://localhost")
+            assert limiter.after_fork.call_count == 0
+
+        @pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+        def test_fork():
+            client = HTTPClient()
+            session = client._session
+            pid = os.fork()
+            if pid == 0:
+                # Child: the hook has already replaced the session.
+                ok = client._session is not session and client._pid == os.getpid()
+                os._exit(0 if ok else 1)
+            _, status = os.waitpid(pid, 0)
+            assert os.waitstatus_to_exitcode(status) == 0
+            assert client._session is session
+
     def describe_get_auth():
         def test_no_key():
             """Test that no key will raise an exception."""
@@ -68,6 +195,118 @@ def describe_http_client():
                 files=None,
             )
 
+    def describe_streaming():
+        def _streamed_response(body: bytes):
+            res = requests.Response()
+            res.status_code = 200
+            res.raw = io.BytesIO(body)
+            return res
+
+        def test_iterates_in_chunks():
+            res = _streamed_response(b"x" * 10)
+            with mock.patch.object(res, "close") as close:
+                content = StreamedContent(res, chunk_size=4)
+                assert list(content) == [b"xxxx", b"xxxx", b"xx"]
+            close.assert_called_once()
+
+        def test_write_to_path(tmp_path):
+            path = tmp_path / "out.zip"
+            written = StreamedContent(_streamed_response(b"zip" * 100)).write_to(path)
+            assert written == 300
+            assert path.read_bytes() == b"zip" * 100
+
+        def test_write_to_file_object():
+            out = io.BytesIO()
+            StreamedContent(_streamed_response(b"pdf"), chunk_size=1).write_to(out)
+            assert out.getvalue() == b"pdf"
+            assert not out.closed
+
+        @mock.patch("python_anvil.http.HTTPClient.do_request")
+        def test_request_stream(do_request):
+            do_request.return_value = _streamed_response(b"pdf")
+            client = HTTPClient(api_key="my_key")
+            content, status_code, _ = client.request(
+                "GET", "http://localhost", stream=True, chunk_size=2
+            )
+
+            assert isinstance(content, StreamedContent)
+            assert content.chunk_size == 2
+            assert content.read() == b"pdf"
+            assert do_request.call_args[1]["stream"] is True
+
+    def describe_compression():
+        payload = {"data": {"text": "Lorem ipsum dolor sit amet. " * 1000}}
+
+        @pytest.fixture
+        def session():
+            with mock.patch("python_anvil.http.requests.Session") as session:
+                session.return_value.request.return_value = HTTPResponse()
+                yield session.return_value
+
+        def _client(**kwargs):
+            return HTTPClient(limiter=mock.MagicMock(), **kwargs)
+
+        def test_off_by_default(session):
+            _client().do_request("POST", "http://localhost", json=payload)
+            assert session.request.call_args[1]["json"] == payload
+
+        def test_gzip(session):
+            _client(compression="gzip").do_request(
+                "POST", "http://localhost", json=payload
+            )
+
+            kwargs = session.request.call_args[1]
+            assert "json" not in kwargs
+            assert kwargs["headers"]["Content-Encoding"] == "gzip"
+            assert kwargs["headers"]["Content-Type"] == "application/json"
+            assert len(kwargs["data"]) < 1000
+            assert json.loads(gzip.decompress(kwargs["data"])) == payload
+
+        def test_zstd(session):
+            _client(compression="zstd").do_request(
+                "POST", "http://localhost", json=payload
+            )
+
+            kwargs = session.request.call_args[1]
+            assert kwargs["headers"]["Content-Encoding"] == "zstd"
+            body = zstandard.ZstdDecompressor().decompress(kwargs["data"])
+            assert json.loads(body) == payload
+
+        def test_below_threshold(session):
+            _client(compression="gzip").do_request(
+                "POST", "http://localhost", json={"a": 1}
+            )
+            assert session.request.call_args[1]["json"] == {"a": 1}
+
+        def test_files_not_compressed(session):
+            _client(compression="gzip", compression_threshold=0).do_request(
+                "POST", "http://localhost", data={"a": "1"}, files={"f": b"x"}
+            )
+            assert session.request.call_args[1]["data"] == {"a": "1"}
+
+        def test_unsupported_media_type(session):
+            session.request.side_effect = [
+                mock.MagicMock(status_code=415, headers={}),
+                HTTPResponse(),
+            ]
+            res = _client(compression="gzip").do_request(
+                "POST", "http://localhost", json=payload
+            )
+
+            assert res.status_code == 200
+            retried = session.request.call_args_list[1][1]
+            assert retried["json"] == payload
+            assert retried["data"] is None
+            assert retried["headers"] is None
+
+        def test_invalid():
+            with pytest.raises(ValueError):
+                HTTPClient(compression="brotli")
+
+        def test_accepts_compressed_responses():
+            client = HTTPClient()
+            assert "gzip" in client._session.headers["Accept-Encoding"]
+
     def describe_do_request():
         @mock.patch("python_anvil.http.requests.Session")
         def test_default_args(session):
@@ -85,53 +324,56 @@ def describe_http_client():
                 auth=None,
                 params=None,
                 files=None,
+                timeout=DEFAULT_TIMEOUT,
             )
 
-        @mock.patch("python_anvil.http.RateLimitException")
         @mock.patch("python_anvil.http.requests.Session")
-        def test_default_args_with_retry(session, ratelimit_exc, mock_response):
-            class MockException(Exception):
-                pass
+        def test_default_args_with_retry(session, mock_response):
+            ok_response = HTTPResponse()
+            limited = mock_response()
+            mock_session = mock.MagicMock()
+            mock_session.request.side_effect = [limited, ok_response]
+            session.return_value = mock_session
+            limiter = mock.MagicMock()
+
+            client = HTTPClient(api_key="my_key", limiter=limiter)
+            res = client.do_request("GET", "http://localhost", retry=True)
 
+            assert res is ok_response
+            # The rate-limited response is closed, to free its connection.
+            assert limited.closed
+            # The whole limiter is paused for `Retry-After`, then the request
+            # waits for its turn again.
+            limiter.pause.assert_called_once_with(1)
+            assert limiter.acquire.call_count == 2
+            assert mock_session.request.call_count == 2
+
+        @mock.patch("python_anvil.http.requests.Session")
+        def test_retry_limit(session, mock_response):
             mock_session = mock.MagicMock()
             mock_session.request.return_value = mock_response()
             session.return_value = mock_session
-            ratelimit_exc.return_value = MockException()
-
-            client = HTTPClient(api_key="my_key")
-            with pytest.raises(MockException):
-                client.do_request("GET", "http://localhost", retry=True)
+            limiter = mock.MagicMock()
 
-            assert ratelimit_exc.call_count == 1
+            client = HTTPClient(api_key="my_key", limiter=limiter)
+            res = client.do_request("GET", "http://localhost", retry=True)
 
-            # Should only be called once, would retry but RateLimitException
-            # is mocked here.
-            mock_session.request.assert_called_once_with(
-                "GET",
-                "http://localhost",
-                headers=None,
-                data=None,
-                auth=None,
-                params=None,
-                files=None,
-            )
+            assert res.status_code == 429
+            assert mock_session.request.call_count == 5
+            assert limiter.pause.call_count == 5
 
-        @mock.patch("python_anvil.http.RateLimitException")
         @mock.patch("python_anvil.http.requests.Session")
-        def test_default_args_without_retry(session, ratelimit_exc, mock_response):
-            class MockException(Exception):
-                pass
-
+        def test_default_args_without_retry(session, mock_response):
             mock_session = mock.MagicMock()
             mock_session.request.return_value = mock_response()
             session.return_value = mock_session
-            ratelimit_exc.return_value = MockException()
+            limiter = mock.MagicMock()
 
-            client = HTTPClient(api_key="my_key")
+            client = HTTPClient(api_key="my_key", limiter=limiter)
             with pytest.raises(AnvilRequestException):
                 client.do_request("GET", "http://localhost", retry=False)
 
-            assert ratelimit_exc.call_count == 0
+            assert limiter.pause.call_count == 0
 
             # Should only be called once, never retried.
             mock_session.request.assert_called_once_with(
@@ -142,4 +384,251 @@ def describe_http_client():
                 auth=None,
                 params=None,
                 files=None,
+                timeout=DEFAULT_TIMEOUT,
+            )
+
+    def describe_retries():
+        @pytest.fixture
+        def policy():
+            return RetryPolicy(max_retries=2, jitter=False)
+
+        @pytest.fixture
+        def client(policy):
+            return HTTPClient(
+                api_key="my_key", limiter=mock.MagicMock(), retry_policy=policy
+            )
+
+        def _error_response(status_code=502, headers=None):
+            res = mock.MagicMock()
+            res.status_code = status_code
+            res.headers = headers or {}
+            return res
+
+        @mock.patch("python_anvil.http.sleep")
+        def test_retries_server_errors(sleep, client):
+            ok_response = HTTPResponse()
+            with mock.patch.object(client, "_session") as session:
+                session.request.side_effect = [_error_response(), ok_response]
+                assert client.do_request("GET", "http://localhost") is ok_response
+            sleep.assert_called_once_with(0.5)
+
+        @mock.patch("python_anvil.http.sleep")
+        def test_honors_retry_after(sleep, client):
+            with mock.patch.object(client, "_session") as session:
+                session.request.side_effect = [
+                    _error_response(503, {"Retry-After": "4"}),
+                    HTTPResponse(),
+                ]
+                client.do_request("GET", "http://localhost")
+            sleep.assert_called_once_with(4)
+
+        @mock.patch("python_anvil.http.sleep")
+        def test_gives_up_after_max_retries(sleep, client):
+            with mock.patch.object(client, "_session") as session:
+                session.request.return_value = _error_response()
+                res = client.do_request("GET", "http://localhost")
+            assert res.status_code == 502
+            assert session.request.call_count == 3
+            assert [c.args[0] for c in sleep.call_args_list] == [0.5, 1]
+
+        @mock.patch("python_anvil.http.sleep")
+        def test_no_retry_for_post(sleep, client):
+            with mock.patch.object(client, "_session") as session:
+                session.request.return_value = _error_response()
+                client.do_request("POST", "http://localhost")
+            assert session.request.call_count == 1
+
+        @mock.patch("python_anvil.http.sleep")
+        def test_retry_idempotent_post(sleep, client):
+            with mock.patch.object(client, "_session") as session:
+                session.request.side_effect = [_error_response(), HTTPResponse()]
+                client.do_request("POST", "http://localhost", idempotent=True)
+            assert session.request.call_count == 2
+
+        @mock.patch("python_anvil.http.sleep")
+        def test_no_retry_for_client_errors(sleep, client):
+            with mock.patch.object(client, "_session") as session:
+                session.request.return_value = _error_response(400)
+                client.do_request("GET", "http://localhost")
+            assert session.request.call_count == 1
+
+        @mock.patch("python_anvil.http.sleep")
+        def test_retry_disabled(sleep, client):
+            with mock.patch.object(client, "_session") as session:
+                session.request.return_value = _error_response()
+                client.do_request("GET", "http://localhost", retry=False)
+            assert session.request.call_count == 1
+
+        @mock.patch("python_anvil.http.sleep")
+        def test_retries_connection_errors(sleep, client):
+            ok_response = HTTPResponse()
+            with mock.patch.object(client, "_session") as session:
+                session.request.side_effect = [
+                    requests.ConnectionError("reset"),
+                    requests.ReadTimeout("slow"),
+                    ok_response,
+                ]
+                assert client.do_request("GET", "http://localhost") is ok_response
+
+        @mock.patch("python_anvil.http.sleep")
+        def test_raises_typed_errors(sleep, client):
+            with mock.patch.object(client, "_session") as session:
+                session.request.side_effect = requests.ReadTimeout("slow")
+                with pytest.raises(AnvilTimeoutError) as exc_info:
+                    client.do_request("GET", "http://localhost")
+            assert exc_info.value.retryable
+            assert session.request.call_count == 3
+
+            with mock.patch.object(client, "_session") as session:
+                session.request.side_effect = requests.ConnectionError("reset")
+                with pytest.raises(AnvilConnectionError):
+                    client.do_request("GET", "http://localhost", retry=False)
+
+        @mock.patch("python_anvil.http.sleep")
+        def test_post_retried_only_if_not_sent(sleep, client):
+            with mock.patch.object(client, "_session") as session:
+                session.request.side_effect = requests.ReadTimeout("slow")
+                with pytest.raises(AnvilTimeoutError):
+                    client.do_request("POST", "http://localhost")
+            assert session.request.call_count == 1
+
+            with mock.patch.object(client, "_session") as session:
+                session.request.side_effect = [
+                    requests.ConnectTimeout("never connected"),
+                    HTTPResponse(),
+                ]
+                client.do_request("POST", "http://localhost")
+            assert session.request.call_count == 2
+
+        @mock.patch("python_anvil.http.sleep")
+        def test_budget(sleep, policy, client):
+            policy.budget = RetryBudget(ratio=0, min_retries=1)
+            with mock.patch.object(client, "_session") as session:
+                session.request.return_value = _error_response()
+                client.do_request("GET", "http://localhost")
+                client.do_request("GET", "http://localhost")
+            # One retry for the first request, none left for the second.
+            assert session.request.call_count == 3
+
+    def describe_timeouts():
+        class _Clock:
+            def __init__(self):
+                self.now = 100.0
+
+            def __call__(self):
+                return self.now
+
+            def sleep(self, seconds):
+                self.now += seconds
+
+        @pytest.fixture
+        def clock():
+            clock = _Clock()
+            with mock.patch("python_anvil.http.monotonic", clock), mock.patch(
+                "python_anvil.http.sleep", clock.sleep
+            ):
+                yield clock
+
+        @pytest.fixture
+        def limiter():
+            limiter = mock.MagicMock()
+            limiter.acquire.return_value = True
+            return limiter
+
+        def _response(status_code=200, headers=None):
+            res = mock.MagicMock()
+            res.status_code = status_code
+            res.headers = headers or {}
+            return res
+
+        def test_client_timeout(limiter):
+            client = HTTPClient(limiter=limiter, timeout=5)
+            with mock.patch.object(client, "_session") as session:
+                client.do_request("GET", "http://localhost")
+                assert session.request.call_args[1]["timeout"] == 5
+
+                client.do_request("GET", "http://localhost", timeout=(1, 2))
+                assert session.request.call_args[1]["timeout"] == (1, 2)
+
+                client.do_request("GET", "http://localhost", timeout=None)
+                assert session.request.call_args[1]["timeout"] is None
+
+        def test_deadline_caps_timeout(clock, limiter):
+            client = HTTPClient(limiter=limiter, timeout=(10, 60))
+            with mock.patch.object(client, "_session") as session:
+                session.request.return_value = _response()
+                client.do_request("GET", "http://localhost", deadline=3)
+            assert session.request.call_args[1]["timeout"] == (3, 3)
+            limiter.acquire.assert_called_once_with(timeout=3)
+
+        def test_deadline_limits_rate_limiter_wait(clock, limiter):
+            limiter.acquire.return_value = False
+            client = HTTPClient(limiter=limiter)
+            with mock.patch.object(client, "_session") as session:
+                with pytest.raises(AnvilTimeoutError):
+                    client.do_request("GET", "http://localhost", deadline=1)
+            assert session.request.call_count == 0
+
+        def test_deadline_stops_retries(clock, limiter):
+            policy = RetryPolicy(max_retries=5, jitter=False)
+            client = HTTPClient(limiter=limiter, retry_policy=policy)
+            with mock.patch.object(client, "_session") as session:
+                session.request.return_value = _response(503)
+                res = client.do_request("GET", "http://localhost", deadline=2)
+            # Waits 0.5 and 1 seconds, but not another 2.
+            assert res.status_code == 503
+            assert session.request.call_count == 3
+            assert clock.now == pytest.approx(101.5)
+
+        def test_deadline_stops_connection_retries(clock, limiter):
+            client = HTTPClient(
+                limiter=limiter, retry_policy=RetryPolicy(backoff_base=5, jitter=False)
             )
+            with mock.patch.object(client, "_session") as session:
+                session.request.side_effect = requests.ConnectionError("reset")
+                with pytest.raises(AnvilConnectionError):
+                    client.do_request("GET", "http://localhost", deadline=2)
+            assert session.request.call_count == 1
+
+        def test_deadline_shorter_than_retry_after(clock, limiter):
+            client = HTTPClient(limiter=limiter)
+            with mock.patch.object(client, "_session") as session:
+                session.request.return_value = _response(429, {"Retry-After": "5"})
+                with pytest.raises(AnvilRateLimitException) as exc_info:
+                    client.do_request("GET", "http://localhost", deadline=2)
+            assert exc_info.value.retry_after == 5
+            assert limiter.pause.call_count == 0
+
+    def describe_cap_timeout():
+        @pytest.mark.parametrize(
+            "timeout, remaining, expected",
+            [
+                (5, None, 5),
+                (5, 2, 2),
+                (1, 2, 1),
+                (None, 2, 2),
+                ((1, 10), 2, (1, 2)),
+                ((None, None), 2, (2, 2)),
+            ],
+        )
+        def test_values(timeout, remaining, expected):
+            assert _cap_timeout(timeout, remaining) == expected
+
+    def describe_estimated_wait():
+        def test_estimated_wait():
+            limiter = mock.MagicMock()
+            limiter.estimated_wait.return_value = 1.5
+            assert HTTPClient(limiter=limiter).estimated_wait() == 1.5
+
+    def describe_parse_retry_after():
+        @pytest.mark.parametrize(
+            "value, expected",
+            [(None, 1), ("3", 3), ("0.5", 0.5), ("-2", 0), ("soon", 1)],
+        )
+        def test_values(value, expected):
+            assert parse_retry_after(value) == expected
+
+        @mock.patch("python_anvil.http.time")
+        def test_http_date(m_time):
+            m_time.return_value = 1445412480
+            assert parse_retry_after("Wed, 21 Oct 2015 07:28:10 GMT") == 10
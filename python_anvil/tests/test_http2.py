@@ -0,0 +1,177 @@
+# pylint: disable=redefined-outer-name,unused-variable,protected-access
+import httpx
+import pytest
+import requests
+import threading
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectTimeout
+from requests_toolbelt.multipart.encoder import MultipartEncoder
+from unittest import mock
+
+from python_anvil.exceptions import AnvilConnectionError, AnvilTimeoutError
+from python_anvil.http import HTTPClient
+from python_anvil.http2 import HTTP2Adapter
+from python_anvil.retry import RetryPolicy
+
+
+def _session(handler, **kwargs):
+    session = requests.Session()
+    # Leave out settings from the environment, e.g. `REQUESTS_CA_BUNDLE`.
+    session.trust_env = False
+    adapter = HTTP2Adapter(transport=httpx.MockTransport(handler), **kwargs)
+    session.mount("https://", adapter)
+    return session, adapter
+
+
+def describe_http2_adapter():
+    def test_mounted_for_https():
+        client = HTTPClient(http2=True)
+        assert isinstance(
+            client._session.get_adapter("https://x.example"), HTTP2Adapter
+        )
+        assert isinstance(client._session.get_adapter("http://x.example"), HTTPAdapter)
+        assert not isinstance(
+            HTTPClient()._session.get_adapter("https://x.example"), HTTP2Adapter
+        )
+
+    def test_request():
+        sent = []
+
+        def handler(request):
+            sent.append(request)
+            return httpx.Response(201, content=b"done", headers={"X-Thing": "1"})
+
+        session, _ = _session(handler)
+        res = session.post("https://x.example/path", json={"a": 1}, timeout=(1, 2))
+
+        assert res.status_code == 201
+        assert res.content == b"done"
+        assert res.headers["x-thing"] == "1"
+        assert sent[0].content == b'{"a": 1}'
+        assert sent[0].headers["content-type"] == "application/json"
+
+    def test_multipart_body():
+        sent = []
+
+        def handler(request):
+            sent.append(request.read())
+            return httpx.Response(200)
+
+        session, _ = _session(handler)
+        body = MultipartEncoder(fields={"file": ("a.pdf", b"x" * 100_000, "a/b")})
+        res = session.post(
+            "https://x.example", data=body, headers={"Content-Type": body.content_type}
+        )
+
+        assert res.status_code == 200
+        assert len(sent[0]) == body.len
+        assert b"x" * 100_000 in sent[0]
+
+    def test_iterable_body():
+        sent = []
+
+        def handler(request):
+            sent.append(request.read())
+            return httpx.Response(200)
+
+        session, _ = _session(handler)
+        session.post("https://x.example", data=iter([b"a", b"b"]))
+        assert sent == [b"ab"]
+
+    def test_request_settings():
+        session, adapter = _session(lambda request: httpx.Response(200))
+        assert session.get("https://x.example", verify=False).status_code == 200
+        assert set(adapter._pools) == {(True, None, None), (False, None, None)}
+
+        proxy = "http://proxy.example:3128"
+        with mock.patch.object(
+            adapter, "_pool", return_value=adapter._connections
+        ) as pool:
+            session.get("https://x.example", proxies={"https": proxy})
+        pool.assert_called_once_with((True, None, proxy))
+
+        with mock.patch.object(httpx, "Client") as client:
+            adapter._pool((True, None, proxy))
+        assert client.call_args[1]["proxy"] == proxy
+        assert client.call_args[1]["trust_env"] is False
+
+    def test_stream():
+        session, adapter = _session(
+            lambda request: httpx.Response(200, content=b"x" * 10)
+        )
+        res = session.get("https://x.example", stream=True)
+        assert adapter._connections[0].in_flight == 1
+        assert list(res.iter_content(4)) == [b"xxxx", b"xxxx", b"xx"]
+        assert adapter._connections[0].in_flight == 0
+
+    def test_spreads_streams_over_connections():
+        _, adapter = _session(lambda request: httpx.Response(200), connections=2)
+        first = adapter._checkout()
+        second = adapter._checkout()
+        assert first is not second
+        adapter._checkin(first)
+        assert adapter._checkout() is first
+
+    def test_max_streams():
+        _, adapter = _session(lambda request: httpx.Response(200), max_streams=1)
+        conn = adapter._checkout()
+        waited = threading.Event()
+
+        def worker():
+            adapter._checkout()
+            waited.set()
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        assert not waited.wait(0.05)
+        adapter._checkin(conn)
+        assert waited.wait(1)
+        thread.join()
+
+    def test_max_streams_timeout():
+        session, adapter = _session(lambda request: httpx.Response(200), max_streams=1)
+        adapter._checkout()
+        with pytest.raises(ConnectTimeout):
+            session.get("https://x.example", timeout=(0.05, 1))
+        assert adapter._connections[0].in_flight == 1
+
+    def test_invalid_connections():
+        with pytest.raises(ValueError):
+            HTTP2Adapter(connections=0)
+
+    def describe_errors():
+        def _client(handler):
+            client = HTTPClient(
+                limiter=mock.MagicMock(), retry_policy=RetryPolicy(backoff_base=0)
+            )
+            client._session.mount(
+                "https://", HTTP2Adapter(transport=httpx.MockTransport(handler))
+            )
+            return client
+
+        def test_connect_error_is_retried():
+            calls = []
+
+            def handler(request):
+                calls.append(request)
+                if len(calls) == 1:
+                    raise httpx.ConnectError("refused")
+                return httpx.Response(200)
+
+            res = _client(handler).do_request("POST", "https://x.example")
+            assert res.status_code == 200
+            assert len(calls) == 2
+
+        def test_read_timeout():
+            def handler(request):
+                raise httpx.ReadTimeout("slow")
+
+            with pytest.raises(AnvilTimeoutError):
+                _client(handler).do_request("POST", "https://x.example")
+
+        def test_other_errors():
+            def handler(request):
+                raise httpx.RemoteProtocolError("reset")
+
+            with pytest.raises(AnvilConnectionError):
+                _client(handler).do_request("GET", "https://x.example", retry=False)
@@ -0,0 +1,400 @@
+# pylint: disable=redefined-outer-name,unused-variable,expression-not-assigned
+import asyncio
+import os
+import pytest
+import sqlite3
+import threading
+from unittest import mock
+
+from python_anvil.limiter import (
+    BaseLimiter,
+    RateLimitInfo,
+    SQLiteTokenBucketLimiter,
+    TokenBucketLimiter,
+    api_key_bucket_key,
+    create_limiter,
+    default_sqlite_path,
+    parse_rate_limit_headers,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def describe_token_bucket_limiter():
+    @pytest.fixture
+    def clock():
+        return FakeClock()
+
+    def describe_for_environment():
+        def test_dev():
+            limiter = TokenBucketLimiter.for_environment("dev")
+            assert limiter.calls == 2
+            assert limiter.period == 1
+            assert limiter.burst == 2
+
+        def test_prod():
+            limiter = TokenBucketLimiter.for_environment("prod", burst=10)
+            assert limiter.calls == 40
+            assert limiter.burst == 10
+
+        def test_invalid():
+            with pytest.raises(ValueError):
+                TokenBucketLimiter.for_environment("staging")
+
+    def test_invalid_args():
+        with pytest.raises(ValueError):
+            TokenBucketLimiter(calls=0)
+        with pytest.raises(ValueError):
+            TokenBucketLimiter(calls=1, burst=0)
+
+    def test_burst_then_wait(clock):
+        limiter = TokenBucketLimiter(
+            calls=2, period=1, burst=2, clock=clock, sleep=clock.sleep
+        )
+        assert limiter.acquire()
+        assert limiter.acquire()
+        assert not clock.sleeps
+
+        assert limiter.acquire()
+        assert clock.sleeps == [pytest.approx(0.5)]
+
+    def test_try_acquire(clock):
+        limiter = TokenBucketLimiter(calls=1, period=1, clock=clock)
+        assert limiter.try_acquire()
+        assert not limiter.try_acquire()
+        clock.now += 1
+        assert limiter.try_acquire()
+
+    def test_acquire_timeout(clock):
+        limiter = TokenBucketLimiter(calls=1, period=10, clock=clock, sleep=clock.sleep)
+        assert limiter.acquire()
+        # Gives up right away, since the next token is 10 seconds out.
+        assert not limiter.acquire(timeout=1)
+        assert clock.now == 0
+        assert limiter.acquire(timeout=10)
+        assert clock.now == pytest.approx(10)
+
+    def test_refill_caps_at_burst(clock):
+        limiter = TokenBucketLimiter(calls=10, period=1, burst=3, clock=clock)
+        clock.now += 100
+        assert all(limiter.try_acquire() for _ in range(3))
+        assert not limiter.try_acquire()
+
+    def test_reservations_are_fifo(clock):
+        limiter = TokenBucketLimiter(calls=2, period=1, burst=1, clock=clock)
+        assert limiter.reserve() == 0
+        assert limiter.reserve() == pytest.approx(0.5)
+        assert limiter.reserve() == pytest.approx(1.0)
+        assert limiter.reserve() == pytest.approx(1.5)
+        assert limiter.estimated_wait() == pytest.approx(2.0)
+
+    def test_reserve_timeout(clock):
+        limiter = TokenBucketLimiter(calls=1, period=1, clock=clock)
+        assert limiter.reserve() == 0
+        assert limiter.reserve(timeout=0.5) is None
+        # Nothing was reserved by the failed call.
+        assert limiter.reserve(timeout=1) == pytest.approx(1)
+
+    def test_reserve_too_many(clock):
+        limiter = TokenBucketLimiter(calls=1, clock=clock)
+        with pytest.raises(ValueError):
+            limiter.reserve(2)
+
+    def describe_pause():
+        def test_pause_delays_new_callers(clock):
+            limiter = TokenBucketLimiter(
+                calls=2, period=1, clock=clock, sleep=clock.sleep
+            )
+            limiter.pause(3)
+            assert limiter.estimated_wait() == pytest.approx(3.5)
+            assert limiter.acquire()
+            assert clock.now == pytest.approx(3.5)
+
+        def test_released_at_rate_after_pause(clock):
+            limiter = TokenBucketLimiter(calls=2, period=1, clock=clock)
+            limiter.pause(2)
+            # No burst once the cooldown is over.
+            assert limiter.reserve() == pytest.approx(2.5)
+            assert limiter.reserve() == pytest.approx(3.0)
+
+        def test_shorter_pause_is_ignored(clock):
+            limiter = TokenBucketLimiter(calls=2, period=1, clock=clock)
+            limiter.pause(5)
+            limiter.pause(1)
+            assert limiter.estimated_wait() == pytest.approx(5.5)
+
+        def test_pause_delays_waiting_callers(clock):
+            limiter = TokenBucketLimiter(calls=1, period=1, clock=clock)
+
+            def sleep(seconds):
+                # Another thread gets a 429 while this one is waiting.
+                if not clock.sleeps:
+                    clock.now += 0.5
+                    limiter.pause(10)
+                    seconds -= 0.5
+                clock.sleep(seconds)
+
+            limiter._sleep = sleep  # pylint: disable=protected-access
+            assert limiter.acquire()
+            assert limiter.acquire()
+            # 0.5s left before the pause at t=0.5, added after it ends at 10.5.
+            assert clock.now == pytest.approx(11)
+
+        def test_pause_past_timeout(clock):
+            limiter = TokenBucketLimiter(calls=1, period=1, clock=clock)
+
+            def sleep(seconds):
+                limiter.pause(10)
+                clock.sleep(seconds)
+
+            limiter._sleep = sleep  # pylint: disable=protected-access
+            assert limiter.acquire()
+            assert not limiter.acquire(timeout=2)
+
+        def test_base_limiter_sleeps():
+            with mock.patch("python_anvil.limiter.time.sleep") as sleep:
+                BaseLimiter().pause(2)
+            sleep.assert_called_once_with(2)
+
+    def describe_acquire_async():
+        def test_waits_with_asyncio(clock):
+            limiter = TokenBucketLimiter(calls=2, period=1, burst=1, clock=clock)
+
+            async def fake_sleep(seconds):
+                clock.sleep(seconds)
+
+            with mock.patch("python_anvil.limiter.asyncio.sleep", fake_sleep):
+                assert asyncio.run(limiter.acquire_async())
+                assert asyncio.run(limiter.acquire_async())
+            assert clock.sleeps == [pytest.approx(0.5)]
+
+        def test_timeout(clock):
+            limiter = TokenBucketLimiter(calls=1, period=10, clock=clock)
+            assert limiter.try_acquire()
+            assert not asyncio.run(limiter.acquire_async(timeout=1))
+
+        def test_base_limiter_uses_thread():
+            class Limiter(BaseLimiter):
+                def acquire(self, tokens=1, timeout=None):
+                    return threading.current_thread() is not threading.main_thread()
+
+            assert asyncio.run(Limiter().acquire_async())
+
+    def test_thread_safe():
+        limiter = TokenBucketLimiter(calls=1, period=60, burst=50)
+        acquired = []
+
+        def worker():
+            acquired.append(limiter.try_acquire())
+
+        threads = [threading.Thread(target=worker) for _ in range(100)]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+
+        assert acquired.count(True) == 50
+
+
+def describe_sqlite_token_bucket_limiter():
+    @pytest.fixture
+    def clock():
+        return FakeClock()
+
+    @pytest.fixture
+    def db_path(tmp_path):
+        return str(tmp_path / "limits.db")
+
+    def test_shared_budget(clock, db_path):
+        # Two limiters on the same file behave like two processes.
+        one = SQLiteTokenBucketLimiter(
+            calls=2, period=1, path=db_path, key="k", clock=clock
+        )
+        two = SQLiteTokenBucketLimiter(
+            calls=2, period=1, path=db_path, key="k", clock=clock
+        )
+        assert one.try_acquire()
+        assert two.try_acquire()
+        assert not one.try_acquire()
+        assert not two.try_acquire()
+
+        clock.now += 0.5
+        assert two.try_acquire()
+        assert not one.try_acquire()
+
+    def test_separate_keys(clock, db_path):
+        one = SQLiteTokenBucketLimiter(
+            calls=1, period=1, path=db_path, key="a", clock=clock
+        )
+        two = SQLiteTokenBucketLimiter(
+            calls=1, period=1, path=db_path, key="b", clock=clock
+        )
+        assert one.try_acquire()
+        assert two.try_acquire()
+
+    def test_acquire_waits(clock, db_path):
+        limiter = SQLiteTokenBucketLimiter(
+            calls=4, period=1, path=db_path, clock=clock, sleep=clock.sleep
+        )
+        for _ in range(5):
+            assert limiter.acquire()
+        assert clock.sleeps == [pytest.approx(0.25)]
+        limiter.close()
+
+    def test_reconnects_after_fork(clock, db_path):
+        limiter = SQLiteTokenBucketLimiter(calls=2, period=1, path=db_path, clock=clock)
+        assert limiter.try_acquire()
+        conn = limiter._conn  # pylint: disable=protected-access
+        limiter.after_fork()
+        assert limiter.try_acquire()
+        assert limiter._conn is not conn  # pylint: disable=protected-access
+        assert not limiter.try_acquire()
+
+    def test_shared_pause(clock, db_path):
+        one = SQLiteTokenBucketLimiter(calls=2, period=1, path=db_path, clock=clock)
+        two = SQLiteTokenBucketLimiter(calls=2, period=1, path=db_path, clock=clock)
+        one.pause(5)
+        assert two.estimated_wait() == pytest.approx(5.5)
+
+    def test_acquire_async_does_not_block_loop(db_path):
+        limiter = SQLiteTokenBucketLimiter(calls=2, period=1, path=db_path)
+        assert limiter.try_acquire()
+        # Another process holding the database lock.
+        other = sqlite3.connect(db_path, isolation_level=None)
+        other.execute("BEGIN IMMEDIATE")
+
+        async def run():
+            task = asyncio.ensure_future(limiter.acquire_async())
+            await asyncio.sleep(0.1)
+            assert not task.done()
+            other.execute("COMMIT")
+            return await task
+
+        try:
+            assert asyncio.run(run())
+        finally:
+            other.close()
+            limiter.close()
+
+    def describe_default_path():
+        def test_runtime_dir(monkeypatch, tmp_path):
+            monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+            assert default_sqlite_path() == str(
+                tmp_path / "python-anvil" / "ratelimit.db"
+            )
+
+        def test_cache_dir(monkeypatch, tmp_path):
+            monkeypatch.delenv("XDG_RUNTIME_DIR", raising=False)
+            monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+            assert default_sqlite_path() == str(
+                tmp_path / "python-anvil" / "ratelimit.db"
+            )
+
+        def test_private_dir(monkeypatch, tmp_path):
+            monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+            limiter = SQLiteTokenBucketLimiter(calls=2, period=1)
+            assert limiter.try_acquire()
+            limiter.close()
+            mode = os.stat(tmp_path / "python-anvil").st_mode & 0o777
+            assert mode == 0o700
+
+
+def describe_create_limiter():
+    def test_memory():
+        limiter = create_limiter("memory", environment="prod")
+        assert not isinstance(limiter, SQLiteTokenBucketLimiter)
+        assert limiter.calls == 40
+
+    def test_sqlite(tmp_path):
+        path = str(tmp_path / "limits.db")
+        limiter = create_limiter("sqlite", environment="prod", api_key="k", path=path)
+        assert isinstance(limiter, SQLiteTokenBucketLimiter)
+        assert limiter.calls == 40
+        assert limiter.key == api_key_bucket_key("k", "prod")
+
+    def test_invalid():
+        with pytest.raises(ValueError):
+            create_limiter("redis")
+
+
+def describe_parse_rate_limit_headers():
+    def test_empty():
+        assert parse_rate_limit_headers(None) == RateLimitInfo()
+        assert parse_rate_limit_headers({}) == RateLimitInfo()
+
+    def test_x_ratelimit_headers():
+        headers = {
+            "X-RateLimit-Limit": "40",
+            "X-RateLimit-Remaining": "12",
+            "X-RateLimit-Reset": "1",
+        }
+        assert parse_rate_limit_headers(headers) == RateLimitInfo(40, 12, 1)
+
+    def test_ietf_headers():
+        headers = {"RateLimit-Limit": "40, 40;w=1", "RateLimit-Remaining": "3"}
+        assert parse_rate_limit_headers(headers) == RateLimitInfo(40, 3, None)
+
+    def test_reset_timestamp():
+        headers = {"X-RateLimit-Reset": "1700000002"}
+        info = parse_rate_limit_headers(headers, now=1700000000)
+        assert info.reset == 2
+
+    def test_invalid_value():
+        assert parse_rate_limit_headers({"X-RateLimit-Limit": "lots"}).limit is None
+
+
+def describe_adaptive():
+    def test_disabled_by_default():
+        limiter = TokenBucketLimiter(calls=10)
+        limiter.observe(429, {})
+        assert limiter.calls == 10
+
+    def test_decrease_on_429():
+        limiter = TokenBucketLimiter(calls=10, adaptive=True, min_calls=2)
+        limiter.observe(429, {})
+        assert limiter.calls == 5
+        assert limiter.burst == 5
+        limiter.observe(429, {})
+        limiter.observe(429, {})
+        assert limiter.calls == 2
+
+    def test_no_increase_without_headers():
+        limiter = TokenBucketLimiter(calls=10, adaptive=True)
+        limiter.observe(200, {})
+        assert limiter.calls == 10
+
+    def test_increase_up_to_server_limit():
+        limiter = TokenBucketLimiter(calls=2, adaptive=True)
+        headers = {"X-RateLimit-Limit": "4", "X-RateLimit-Remaining": "30"}
+        limiter.observe(200, headers)
+        assert limiter.calls == 3
+        limiter.observe(200, headers)
+        limiter.observe(200, headers)
+        assert limiter.calls == 4
+
+    def test_increase_up_to_max_calls():
+        limiter = TokenBucketLimiter(calls=2, adaptive=True, max_calls=2.5)
+        limiter.observe(200, {"X-RateLimit-Remaining": "30"})
+        assert limiter.calls == 2.5
+
+    def test_decrease_when_budget_is_low():
+        limiter = TokenBucketLimiter(calls=40, adaptive=True, burst=5)
+        headers = {"X-RateLimit-Remaining": "30", "X-RateLimit-Reset": "1"}
+        limiter.observe(200, headers)
+        assert limiter.calls == 30
+        # An explicit burst size is kept.
+        assert limiter.burst == 5
+
+    def test_create_limiter(tmp_path):
+        assert create_limiter(adaptive=True).adaptive
+        path = str(tmp_path / "limits.db")
+        assert create_limiter("sqlite", path=path, adaptive=True).adaptive
@@ -0,0 +1,286 @@
+# pylint: disable=redefined-outer-name,unused-variable,protected-access
+import asyncio
+import json
+import os
+import pytest
+import requests
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from gql.transport.exceptions import TransportQueryError
+from unittest import mock
+
+from python_anvil.api import Anvil
+from python_anvil.bulk import CAST, SIGNER, BulkItem
+from python_anvil.exceptions import AnvilServerError
+from python_anvil.loader import AsyncLoader, Loader, _Batch
+
+
+def _fetch(field, eids, fields, arguments):
+    return {eid: BulkItem({"eid": eid}) for eid in eids}
+
+
+def _load_all(loader, eids, field=SIGNER, **kwargs):
+    """Look up `eids` at the same time, each from its own thread."""
+    barrier = threading.Barrier(len(eids))
+
+    def load(eid):
+        barrier.wait()
+        return loader.load(field, eid, **kwargs)
+
+    with ThreadPoolExecutor(len(eids)) as pool:
+        return list(pool.map(load, eids))
+
+
+def _response(body):
+    res = requests.Response()
+    res.status_code = 200
+    res._content = json.dumps(body).encode()
+    return res
+
+
+def describe_loader():
+    def test_coalesces():
+        fetch = mock.Mock(side_effect=_fetch)
+        loader = Loader(fetch, window=0.1)
+        results = _load_all(loader, ["a", "b", "a", "c", "b"])
+
+        assert [item.data["eid"] for item in results] == ["a", "b", "a", "c", "b"]
+        fetch.assert_called_once()
+        field, eids, fields, arguments = fetch.call_args[0]
+        assert field is SIGNER
+        assert sorted(eids) == ["a", "b", "c"]
+
+    def test_max_batch():
+        fetch = mock.Mock(side_effect=_fetch)
+        loader = Loader(fetch, window=0.1, max_batch=2)
+        _load_all(loader, ["a", "b", "c", "d", "e"])
+        assert fetch.call_count == 3
+        assert all(len(call[0][1]) <= 2 for call in fetch.call_args_list)
+
+    def test_batched_by_fields():
+        fetch = mock.Mock(side_effect=_fetch)
+        loader = Loader(fetch, window=0.1)
+        barrier = threading.Barrier(3)
+
+        def load(fields, arguments):
+            barrier.wait()
+            return loader.load(CAST, "a", fields, arguments)
+
+        with ThreadPoolExecutor(3) as pool:
+            list(
+                pool.map(
+                    load,
+                    [["eid"], ["eid"], ["eid", "title"]],
+                    [{"versionNumber": None}, None, None],
+                )
+            )
+        assert fetch.call_count == 2
+        assert sorted(call[0][2] for call in fetch.call_args_list) == [
+            ["eid"],
+            ["eid", "title"],
+        ]
+
+    def test_request_error():
+        loader = Loader(mock.Mock(side_effect=AnvilServerError("Oops")), window=0.05)
+        with pytest.raises(AnvilServerError):
+            _load_all(loader, ["a", "b"])
+
+    def test_missing_result():
+        loader = Loader(mock.Mock(return_value={}), window=0)
+        assert loader.load(SIGNER, "a") == BulkItem(None)
+
+    def test_leader_interrupted():
+        loader = Loader(_fetch, window=1)
+
+        class _InterruptedBatch(_Batch):
+            def __init__(self):
+                super().__init__()
+                self.full = mock.Mock()
+                self.full.wait.side_effect = self.interrupt
+
+            def interrupt(self, timeout):
+                # Interrupted once another lookup has joined.
+                while len(self.futures) < 2:
+                    time.sleep(0.001)
+                raise RuntimeError("Interrupted")
+
+        with mock.patch("python_anvil.loader._Batch", _InterruptedBatch):
+            with ThreadPoolExecutor(2) as pool:
+                leader = pool.submit(loader.load, SIGNER, "a")
+                while not loader._pending:
+                    time.sleep(0.001)
+                follower = pool.submit(loader.load, SIGNER, "b")
+                with pytest.raises(RuntimeError):
+                    leader.result(timeout=5)
+                with pytest.raises(CancelledError):
+                    follower.result(timeout=5)
+
+        assert not loader._pending
+
+    @pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+    def test_pending_batch_dropped_in_child():
+        fetched = threading.Event()
+
+        def fetch(*args):
+            fetched.set()
+            return _fetch(*args)
+
+        loader = Loader(fetch, window=1)
+        thread = threading.Thread(target=loader.load, args=(SIGNER, "a"))
+        thread.start()
+        while not loader._pending:
+            pass
+        pid = os.fork()
+        if pid == 0:
+            # The parent's batch would only be sent by its leader thread,
+            # which wasn't copied into the child.
+            ok = loader.load(SIGNER, "b").data == {"eid": "b"} and fetched.is_set()
+            os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        thread.join()
+        assert os.waitstatus_to_exitcode(status) == 0
+
+    def test_invalid():
+        with pytest.raises(ValueError):
+            Loader(_fetch, max_batch=0)
+
+
+def describe_async_loader():
+    def test_coalesces():
+        calls = []
+
+        async def fetch(field, eids, fields, arguments):
+            calls.append(eids)
+            return _fetch(field, eids, fields, arguments)
+
+        async def run():
+            loader = AsyncLoader(fetch, window=0.01)
+            return await asyncio.gather(
+                *(loader.load(SIGNER, eid) for eid in ["a", "b", "a"])
+            )
+
+        results = asyncio.run(run())
+        assert [item.data["eid"] for item in results] == ["a", "b", "a"]
+        assert calls == [["a", "b"]]
+
+    def test_cancelled_caller():
+        async def fetch(field, eids, fields, arguments):
+            await asyncio.sleep(0.01)
+            return _fetch(field, eids, fields, arguments)
+
+        async def run():
+            loader = AsyncLoader(fetch, window=0)
+            first = asyncio.ensure_future(loader.load(SIGNER, "a"))
+            second = asyncio.ensure_future(loader.load(SIGNER, "a"))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+
+        assert asyncio.run(run()).data == {"eid": "a"}
+
+    def test_dispatch_cancelled():
+        async def run():
+            loader = AsyncLoader(mock.AsyncMock(side_effect=_fetch), window=1)
+            lookup = asyncio.ensure_future(loader.load(SIGNER, "a"))
+            await asyncio.sleep(0)
+            next(iter(loader._pending.values())).task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await asyncio.wait_for(lookup, 5)
+            assert not loader._pending
+
+        asyncio.run(run())
+
+    def test_request_error():
+        async def fetch(*args):
+            raise AnvilServerError("Oops")
+
+        async def run():
+            loader = AsyncLoader(fetch, window=0)
+            await loader.load(SIGNER, "a")
+
+        with pytest.raises(AnvilServerError):
+            asyncio.run(run())
+
+
+def describe_anvil():
+    def _answer(*args, **kwargs):
+        variables = {
+            k: v for k, v in kwargs["json"]["variables"].items() if k.startswith("e")
+        }
+        data = {"r" + name[1:]: {"eid": eid} for name, eid in variables.items()}
+        errors = [
+            {"message": f"Not found: {eid}", "path": ["r" + name[1:]]}
+            for name, eid in variables.items()
+            if eid.startswith("x")
+        ]
+        return _response({"data": data, "errors": errors or None})
+
+    @pytest.fixture
+    def anvil():
+        anvil = Anvil(api_key="my_key", coalesce_window=0.1)
+        with mock.patch.object(anvil.client, "do_request", side_effect=_answer):
+            yield anvil
+
+    def test_off_by_default():
+        assert Anvil(api_key="my_key").loader is None
+
+    def test_coalesces_lookups(anvil):
+        eids = ["a", "b", "c", "a"]
+        barrier = threading.Barrier(len(eids))
+
+        def get_signer(eid):
+            barrier.wait()
+            return anvil.get_signer(eid)
+
+        with ThreadPoolExecutor(len(eids)) as pool:
+            results = list(pool.map(get_signer, eids))
+
+        assert results == [{"eid": eid} for eid in eids]
+        assert anvil.client.do_request.call_count == 1
+        body = anvil.client.do_request.call_args[1]["json"]
+        assert sorted(body["variables"].values()) == ["a", "b", "c"]
+
+    def test_concurrent_batches(anvil):
+        barrier = threading.Barrier(2)
+
+        def do_request(*args, **kwargs):
+            # Both batches are in flight at the same time.
+            barrier.wait(timeout=5)
+            return _answer(*args, **kwargs)
+
+        anvil.client.do_request.side_effect = do_request
+        with ThreadPoolExecutor(2) as pool:
+            signer = pool.submit(anvil.get_signer, "a")
+            packet = pool.submit(anvil.get_etch_packet, "b")
+            assert signer.result() == {"eid": "a"}
+            assert packet.result() == {"eid": "b"}
+        assert anvil.client.do_request.call_count == 2
+
+    def test_get_cast(anvil):
+        assert anvil.get_cast("a", fields=["eid"], version_number=2) == {"eid": "a"}
+        body = anvil.client.do_request.call_args[1]["json"]
+        assert body["variables"] == {"e0": "a", "versionNumber": 2}
+
+    def test_get_cast_with_cast_args(anvil):
+        anvil.client.do_request.side_effect = None
+        anvil.client.do_request.return_value = _response({"data": {"cast": None}})
+        anvil.get_cast("a", cast_args=[("versionNumber", "-1")])
+        assert "variables" not in anvil.client.do_request.call_args[1]["json"]
+
+    def test_item_error(anvil):
+        with pytest.raises(TransportQueryError) as e:
+            anvil.get_signer("xa")
+        assert e.value.errors == [{"message": "Not found: xa", "path": ["r0"]}]
+
+    def test_request_options_not_coalesced(anvil):
+        with mock.patch.object(anvil.loader, "load") as load:
+            anvil.get_signer("a", timeout=5)
+        load.assert_not_called()
+        assert anvil.client.do_request.call_args[1]["timeout"] == 5
+
+    def test_without_loader():
+        anvil = Anvil(api_key="my_key")
+        with mock.patch.object(anvil.client, "do_request", side_effect=_answer):
+            assert anvil.get_weld_data("a") == {"eid": "a"}
+            assert anvil.get_etch_packet("b") == {"eid": "b"}
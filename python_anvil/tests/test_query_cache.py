@@ -0,0 +1,181 @@
+# pylint: disable=redefined-outer-name,unused-variable,protected-access
+import asyncio
+import httpx
+import io
+import json
+import os
+import pytest
+import requests
+from gql import gql
+from gql.transport.exceptions import TransportServerError
+from graphql import GraphQLError, print_ast
+from unittest import mock
+
+from python_anvil.api import CURRENT_USER_QUERY, Anvil
+from python_anvil.api_resources.mutations import CreateEtchPacket
+from python_anvil.gql_transport import HTTPClientTransport
+from python_anvil.http import HTTPClient
+from python_anvil.query_cache import QueryCache, parse_query, print_query
+
+
+QUERY = """
+query Weld($eid: String!) {
+  # A comment
+  weld(eid: $eid) {
+    eid
+    name
+  }
+}
+"""
+
+
+def _response(status_code=200, body=None):
+    res = requests.Response()
+    res.status_code = status_code
+    res._content = json.dumps({"data": {}} if body is None else body).encode()
+    return res
+
+
+def describe_query_cache():
+    def test_parses_once():
+        cache = QueryCache()
+        document = cache.parse(QUERY)
+        assert cache.parse(QUERY) is document
+        assert len(cache) == 1
+
+    def test_printed():
+        cache = QueryCache()
+        document = cache.parse(QUERY)
+        printed = cache.printed(document)
+        assert printed == "query Weld($eid:String!){weld(eid:$eid){eid name}}"
+        # Same operation as the original.
+        assert print_ast(gql(printed)) == print_ast(document)
+
+    def test_not_cached():
+        assert QueryCache().printed(gql(QUERY)) is None
+
+    def test_evicts_least_recently_used():
+        cache = QueryCache(maxsize=2)
+        first = cache.parse("{ a }")
+        cache.parse("{ b }")
+        cache.parse("{ a }")
+        cache.parse("{ c }")
+
+        assert cache.parse("{ a }") is first
+        assert len(cache) == 2
+        assert len(cache._by_id) == 2
+
+    def test_evicted_document():
+        cache = QueryCache(maxsize=1)
+        document = cache.parse("{ a }")
+        cache.parse("{ b }")
+        assert cache.printed(document) is None
+
+    def test_invalid():
+        cache = QueryCache()
+        with pytest.raises(GraphQLError):
+            cache.parse("{ a ")
+        assert len(cache) == 0
+
+    @pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+    def test_reset_in_child():
+        cache = QueryCache()
+        cache.parse("{ a }")
+        # Forked while the lock is held.
+        with cache._lock:
+            pid = os.fork()
+            if pid == 0:
+                ok = len(cache) == 0 and cache.parse("{ a }") is not None
+                os._exit(0 if ok else 1)
+            _, status = os.waitpid(pid, 0)
+        assert os.waitstatus_to_exitcode(status) == 0
+        assert len(cache) == 1
+
+    def test_print_query():
+        assert print_query(parse_query(QUERY)).startswith("query Weld($eid:String!)")
+        document = gql(QUERY)
+        assert print_query(document) == print_ast(document)
+
+
+def describe_transport():
+    @pytest.fixture
+    def client():
+        client = HTTPClient(api_key="my_key")
+        with mock.patch.object(client, "do_request") as do_request:
+            do_request.return_value = _response()
+            yield client
+
+    @pytest.fixture
+    def transport(client):
+        transport = HTTPClientTransport(client, url="https://graphql.useanvil.com")
+        transport.connect()
+        return transport
+
+    def test_sends_minified_query(client, transport):
+        transport.execute(parse_query(QUERY), variable_values={"eid": "abc"})
+        kwargs = client.do_request.call_args[1]
+        assert kwargs["json"] == {
+            "query": "query Weld($eid:String!){weld(eid:$eid){eid name}}",
+            "variables": {"eid": "abc"},
+        }
+        assert kwargs["idempotent"] is True
+
+    def test_uploads(client, transport):
+        document = parse_query(CreateEtchPacket.mutation.format(query="{ eid }"))
+        file = io.BytesIO(b"%PDF-1.7")
+        file.name = "contract.pdf"
+
+        transport.execute(
+            document, variable_values={"file": file, "name": "x"}, upload_files=True
+        )
+
+        kwargs = client.do_request.call_args[1]
+        body = kwargs["data"].to_string().decode()
+        assert kwargs["headers"]["Content-Type"].startswith("multipart/form-data")
+        assert json.dumps(print_query(document))[1:-1] in body
+        assert '"variables": {"file": null, "name": "x"}' in body
+        assert '{"0": ["variables.file"]}' in body
+        assert "%PDF-1.7" in body
+
+    def test_server_error(client, transport):
+        client.do_request.return_value = _response(502, "Bad gateway")
+        with pytest.raises(TransportServerError):
+            transport.execute(parse_query(QUERY))
+
+    def test_graphql_errors(client, transport):
+        client.do_request.return_value = _response(
+            body={"errors": [{"message": "Nope"}]}
+        )
+        result = transport.execute(parse_query(QUERY))
+        assert result.errors == [{"message": "Nope"}]
+
+    @mock.patch("python_anvil.api.GQLClient")
+    def test_static_queries_parsed_once(gql_client):
+        anvil = Anvil(api_key="my_key")
+        anvil.get_current_user()
+        anvil.get_current_user()
+        calls = gql_client.get_client.return_value.execute.call_args_list
+        assert calls[0][0][0] is calls[1][0][0]
+        assert calls[0][0][0] is parse_query(CURRENT_USER_QUERY)
+
+    def test_async():
+        from python_anvil.async_http import AsyncHTTPClient, AsyncHTTPClientTransport
+
+        requests_sent = []
+
+        async def handler(request):
+            requests_sent.append(request)
+            return httpx.Response(200, json={"data": {"weld": None}})
+
+        async def run():
+            client = AsyncHTTPClient(api_key="my_key")
+            client._session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            transport = AsyncHTTPClientTransport(client, url="https://x.example")
+            await transport.connect()
+            return await transport.execute(parse_query(QUERY), {"eid": "abc"})
+
+        assert asyncio.run(run()).data == {"weld": None}
+        assert json.loads(requests_sent[0].content) == {
+            "query": "query Weld($eid:String!){weld(eid:$eid){eid name}}",
+            "variables": {"eid": "abc"},
+        }
@@ -0,0 +1,58 @@
+# pylint: disable=redefined-outer-name,unused-variable,expression-not-assigned
+import pytest
+from unittest import mock
+
+from python_anvil.retry import RetryBudget, RetryPolicy
+
+
+def describe_retry_budget():
+    def test_starts_with_min_retries():
+        budget = RetryBudget(ratio=0.1, min_retries=2)
+        assert budget.try_spend()
+        assert budget.try_spend()
+        assert not budget.try_spend()
+
+    def test_requests_deposit_ratio():
+        budget = RetryBudget(ratio=0.5, min_retries=0)
+        assert not budget.try_spend()
+        budget.record_request()
+        assert not budget.try_spend()
+        budget.record_request()
+        assert budget.try_spend()
+
+    def test_balance_is_capped():
+        budget = RetryBudget(ratio=1, min_retries=3)
+        for _ in range(100):
+            budget.record_request()
+        assert budget.balance == 3
+
+    def test_invalid():
+        with pytest.raises(ValueError):
+            RetryBudget(ratio=-1)
+
+
+def describe_retry_policy():
+    def test_backoff_without_jitter():
+        policy = RetryPolicy(backoff_base=0.5, backoff_max=3, jitter=False)
+        assert [policy.backoff(i) for i in range(4)] == [0.5, 1, 2, 3]
+
+    @mock.patch("python_anvil.retry.random.uniform")
+    def test_backoff_with_jitter(uniform):
+        uniform.return_value = 0.25
+        policy = RetryPolicy(backoff_base=0.5)
+        assert policy.backoff(2) == 0.25
+        uniform.assert_called_once_with(0, 2)
+
+    def test_should_retry_limit():
+        policy = RetryPolicy(max_retries=2)
+        assert policy.should_retry(0)
+        assert policy.should_retry(1)
+        assert not policy.should_retry(2)
+
+    def test_should_retry_budget():
+        policy = RetryPolicy(max_retries=5, budget=RetryBudget(min_retries=1))
+        assert policy.should_retry(0)
+        assert not policy.should_retry(1)
+
+    def test_disabled():
+        assert not RetryPolicy.disabled().should_retry(0)
@@ -0,0 +1,242 @@
+# pylint: disable=redefined-outer-name,unused-variable,protected-access
+import os
+import pytest
+from graphql import (
+    ExecutionResult,
+    GraphQLError,
+    GraphQLSchema,
+    build_schema,
+    introspection_from_schema,
+)
+from unittest import mock
+
+from python_anvil import schema as schema_module
+from python_anvil.api import Anvil
+from python_anvil.query_cache import parse_query
+from python_anvil.schema import (
+    LazySchemaClient,
+    SchemaCache,
+    ValidationCache,
+    create_client,
+    default_cache_dir,
+    skip_validation,
+)
+
+
+URL = "https://graphql.useanvil.com"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = SchemaCache(cache_dir=str(tmp_path))
+    with mock.patch.object(schema_module, "_cache", cache):
+        yield cache
+
+
+def describe_schema_cache():
+    def test_builds_once(cache):
+        schema = cache.local_schema()
+        assert isinstance(schema, GraphQLSchema)
+        assert cache.local_schema() is schema
+
+    def test_loads_from_disk(cache, tmp_path):
+        cache.local_schema()
+        assert len(list(tmp_path.glob("schema-*.pickle"))) == 1
+
+        with mock.patch.object(schema_module, "build_ast_schema") as build:
+            schema = SchemaCache(cache_dir=str(tmp_path)).local_schema()
+        build.assert_not_called()
+        assert schema.query_type.fields.keys() == (
+            cache.local_schema().query_type.fields.keys()
+        )
+
+    def test_keyed_by_source(cache, tmp_path):
+        cache.local_schema()
+        source = tmp_path / "schema.graphql"
+        source.write_text("type Query { a: String }")
+        with mock.patch.object(schema_module, "SCHEMA_PATH", str(source)):
+            schema = SchemaCache(cache_dir=str(tmp_path)).local_schema()
+        assert list(schema.query_type.fields) == ["a"]
+        assert len(list(tmp_path.glob("schema-*.pickle"))) == 2
+
+    def test_corrupt_cache(cache, tmp_path):
+        cache.local_schema()
+        (path,) = tmp_path.glob("schema-*.pickle")
+        path.write_bytes(b"nope")
+
+        assert SchemaCache(cache_dir=str(tmp_path)).local_schema() is not None
+        # Rewritten with a good copy.
+        assert SchemaCache(cache_dir=str(tmp_path)).local_schema() is not None
+        assert path.read_bytes() != b"nope"
+
+    def test_not_loaded_if_writable_by_others(cache, tmp_path):
+        cache.local_schema()
+        (path,) = tmp_path.glob("schema-*.pickle")
+        path.chmod(0o666)
+        with mock.patch.object(schema_module, "build_ast_schema") as build:
+            SchemaCache(cache_dir=str(tmp_path)).local_schema()
+        build.assert_called_once()
+
+        path.chmod(0o600)
+        tmp_path.chmod(0o777)
+        with mock.patch.object(schema_module, "build_ast_schema") as build:
+            SchemaCache(cache_dir=str(tmp_path)).local_schema()
+        build.assert_called_once()
+        assert path.stat().st_mode & 0o777 == 0o600
+
+    def test_not_loaded_if_owned_by_others(cache, tmp_path):
+        cache.local_schema()
+        with mock.patch.object(os, "getuid", return_value=os.getuid() + 1):
+            with mock.patch.object(schema_module, "build_ast_schema") as build:
+                SchemaCache(cache_dir=str(tmp_path)).local_schema()
+        build.assert_called_once()
+
+    def test_private_dir(tmp_path):
+        cache_dir = tmp_path / "cache"
+        SchemaCache(cache_dir=str(cache_dir)).local_schema()
+        assert cache_dir.stat().st_mode & 0o777 == 0o700
+        (path,) = cache_dir.glob("schema-*.pickle")
+        assert path.stat().st_mode & 0o777 == 0o600
+
+    def test_no_cache_dir(tmp_path):
+        cache = SchemaCache(cache_dir=None)
+        assert cache.local_schema() is not None
+        assert not list(tmp_path.iterdir())
+
+    def test_missing_schema(tmp_path):
+        with mock.patch.object(schema_module, "SCHEMA_PATH", str(tmp_path / "x")):
+            assert SchemaCache(cache_dir=str(tmp_path)).local_schema() is None
+
+    def test_introspected(cache, tmp_path):
+        schema = cache.local_schema()
+        assert cache.introspected_schema(URL) is None
+        cache.store_introspection(URL, schema)
+        assert cache.introspected_schema(URL) is schema
+
+        other = SchemaCache(cache_dir=str(tmp_path))
+        assert other.introspected_schema(URL) is not None
+        assert other.introspected_schema(URL, ttl=0) is None
+        assert other.introspected_schema("https://other.example") is None
+
+    def test_clear(cache, tmp_path):
+        cache.store_introspection(URL, cache.local_schema())
+        (tmp_path / "unrelated.pickle").write_bytes(b"")
+        cache.clear()
+        assert sorted(os.listdir(tmp_path)) == ["unrelated.pickle"]
+        assert cache.introspected_schema(URL) is None
+
+    def test_default_cache_dir(monkeypatch):
+        monkeypatch.setenv("ANVIL_CACHE_DIR", "/tmp/anvil")
+        assert default_cache_dir() == "/tmp/anvil"
+        monkeypatch.setenv("ANVIL_CACHE_DIR", "")
+        assert default_cache_dir() is None
+        monkeypatch.delenv("ANVIL_CACHE_DIR")
+        assert default_cache_dir() is None
+
+
+def describe_lazy_schema_client():
+    def test_loads_on_first_use():
+        loader = mock.Mock(return_value="schema")
+        client = LazySchemaClient(loader)
+        loader.assert_not_called()
+        assert client.schema == "schema"
+        assert client.schema == "schema"
+        loader.assert_called_once()
+
+    def test_set_schema():
+        loader = mock.Mock()
+        client = LazySchemaClient(loader)
+        client.schema = None
+        assert client.schema is None
+        loader.assert_not_called()
+
+    def test_clients_share_schema(cache):
+        with mock.patch.object(cache, "_load_local", wraps=cache._load_local) as load:
+            first = Anvil(api_key="my_key")
+            second = Anvil(api_key="my_key")
+            load.assert_not_called()
+            assert first.gql_client.schema is second.gql_client.schema
+            load.assert_called_once()
+
+    def test_introspection(cache):
+        schema = cache.local_schema()
+        client = create_client(mock.Mock(), url=URL, fetch_schema_from_transport=True)
+        assert client.schema is None
+        client._build_schema_from_introspection(
+            ExecutionResult(data=introspection_from_schema(schema))
+        )
+        assert cache.introspected_schema(URL) is client.schema
+
+        # Other clients use it instead of fetching it again.
+        other = create_client(mock.Mock(), url=URL, fetch_schema_from_transport=True)
+        assert other.schema is client.schema
+
+
+def describe_validation():
+    @pytest.fixture
+    def schema():
+        return build_schema("type Query { a: String b: String }")
+
+    @pytest.fixture
+    def client(schema):
+        with mock.patch.object(schema_module, "_validations", ValidationCache()):
+            yield LazySchemaClient(lambda: schema)
+
+    def test_validates_once(client):
+        document = parse_query("{ a }")
+        with mock.patch.object(
+            schema_module, "validate", wraps=schema_module.validate
+        ) as validate:
+            client.validate(document)
+            client.validate(document)
+        validate.assert_called_once()
+        assert client.validation_stats.validated == 1
+        assert client.validation_stats.cached == 1
+
+    def test_invalid_document(client):
+        document = parse_query("{ c }")
+        for _ in range(2):
+            with pytest.raises(GraphQLError):
+                client.validate(document)
+        assert client.validation_stats.validated == 1
+        assert client.validation_stats.cached == 1
+
+    def test_per_schema(client):
+        document = parse_query("{ a }")
+        client.validate(document)
+        client.schema = build_schema("type Query { a: String }")
+        client.validate(document)
+        assert client.validation_stats.validated == 2
+
+    def test_evicts(schema):
+        cache = ValidationCache(maxsize=1)
+        first, second = parse_query("{ a }"), parse_query("{ b }")
+        cache.put(schema, first, [])
+        cache.put(schema, second, [])
+        assert cache.get(schema, first) is None
+        assert cache.get(schema, second) == []
+        assert len(cache) == 1
+
+    def test_skip_validation(client):
+        with skip_validation():
+            client.validate(parse_query("{ c }"))
+        assert client.validation_stats.skipped == 1
+        with pytest.raises(GraphQLError):
+            client.validate(parse_query("{ c }"))
+
+    def test_validate_queries_off():
+        loader = mock.Mock()
+        with mock.patch.object(schema_module._cache, "local_schema", loader):
+            anvil = Anvil(api_key="my_key", validate_queries=False)
+            assert anvil.gql_client.schema is None
+        loader.assert_not_called()
+
+    def test_per_call_opt_out():
+        anvil = Anvil(api_key="my_key")
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {"data": {}}
+        with mock.patch.object(anvil.client, "do_request", return_value=response):
+            assert anvil.query("{ nope }", validate=False) == {}
+            with pytest.raises(GraphQLError):
+                anvil.query("{ nope }")
+        assert anvil.gql_client.validation_stats.skipped == 1
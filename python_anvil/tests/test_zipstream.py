@@ -0,0 +1,160 @@
+# pylint: disable=redefined-outer-name,unused-variable,protected-access
+import asyncio
+import io
+import pytest
+import requests
+import zipfile
+from unittest import mock
+
+from python_anvil.api import Anvil
+from python_anvil.http import StreamedContent
+from python_anvil.zipstream import aiter_zip_members, iter_zip_members
+
+
+FILES = {
+    "one.pdf": b"%PDF-1.7 " + bytes(range(256)) * 300,
+    "two.pdf": b"%PDF-1.7 " * 5000,
+    "empty.txt": b"",
+}
+
+
+class _Unseekable(io.RawIOBase):
+    """Output that makes `zipfile` write data descriptors."""
+
+    def __init__(self):
+        super().__init__()
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.data += b
+        return len(b)
+
+
+def _zip(compression=zipfile.ZIP_DEFLATED, zip64=False, seekable=True) -> bytes:
+    out = io.BytesIO() if seekable else _Unseekable()
+    with zipfile.ZipFile(out, "w", compression) as archive:
+        for name, data in FILES.items():
+            with archive.open(name, "w", force_zip64=zip64) as file:
+                file.write(data)
+    if isinstance(out, _Unseekable):
+        return bytes(out.data)
+    return out.getvalue()
+
+
+def _chunks(data: bytes, size: int = 1000):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def describe_iter_zip_members():
+    @pytest.mark.parametrize(
+        "archive",
+        [
+            _zip(zipfile.ZIP_STORED),
+            _zip(zipfile.ZIP_DEFLATED),
+            _zip(zipfile.ZIP_STORED, zip64=True),
+            _zip(zipfile.ZIP_DEFLATED, zip64=True),
+            _zip(zipfile.ZIP_DEFLATED, seekable=False),
+        ],
+    )
+    @pytest.mark.parametrize("chunk_size", [1, 7, 1000, 10**6])
+    def test_extracts(archive, chunk_size):
+        members = iter_zip_members(_chunks(archive, chunk_size))
+        assert {member.name: member.read() for member in members} == FILES
+
+    def test_yields_before_archive_is_complete():
+        received = []
+
+        def chunks():
+            for chunk in _chunks(_zip()):
+                received.append(chunk)
+                yield chunk
+
+        member = next(iter_zip_members(chunks()))
+        assert member.name == "one.pdf"
+        assert len(received) == 1
+
+    def test_skips_unread_data():
+        members = iter_zip_members(_chunks(_zip()))
+        first = next(members)
+        assert FILES["one.pdf"].startswith(next(iter(first)))
+        second = next(members)
+        assert (second.name, second.read()) == ("two.pdf", FILES["two.pdf"])
+
+    def test_write_to(tmp_path):
+        for member in iter_zip_members(_chunks(_zip())):
+            assert member.write_to(tmp_path / member.name) == len(FILES[member.name])
+        assert (tmp_path / "two.pdf").read_bytes() == FILES["two.pdf"]
+
+    def test_bad_crc():
+        archive = bytearray(_zip(zipfile.ZIP_STORED))
+        archive[100] ^= 0xFF
+        with pytest.raises(zipfile.BadZipFile, match="CRC"):
+            for member in iter_zip_members([bytes(archive)]):
+                member.read()
+
+    def test_truncated():
+        archive = _zip(zipfile.ZIP_STORED)
+        with pytest.raises(zipfile.BadZipFile):
+            for member in iter_zip_members([archive[:5000]]):
+                member.read()
+
+    def test_read_after_failure():
+        member = next(iter_zip_members([_zip(zipfile.ZIP_STORED)[:5000]]))
+        with pytest.raises(zipfile.BadZipFile):
+            member.read()
+        with pytest.raises(zipfile.BadZipFile, match="ended unexpectedly"):
+            member.read()
+
+    def test_not_a_zip():
+        with pytest.raises(zipfile.BadZipFile):
+            list(iter_zip_members([b"<html>nope</html>"]))
+
+    def test_stored_with_data_descriptor():
+        with pytest.raises(zipfile.BadZipFile, match="unknown size"):
+            list(iter_zip_members([_zip(zipfile.ZIP_STORED, seekable=False)]))
+
+    def test_async():
+        async def chunks():
+            for chunk in _chunks(_zip(), 300):
+                yield chunk
+
+        async def run():
+            return {
+                member.name: await member.read()
+                async for member in aiter_zip_members(chunks())
+            }
+
+        assert asyncio.run(run()) == FILES
+
+
+def describe_extract_documents():
+    @mock.patch("python_anvil.api_resources.requests.AnvilRequest._request")
+    def test_extract_documents(mock_request):
+        res = requests.Response()
+        res.status_code = 200
+        res.raw = io.BytesIO(_zip())
+        mock_request.return_value = (StreamedContent(res, chunk_size=500), 200, {})
+
+        anvil = Anvil(api_key="my_key")
+        documents = {
+            name: member.read() for name, member in anvil.extract_documents("eid")
+        }
+
+        assert documents == FILES
+        assert mock_request.call_args[0] == ("GET", "document-group/eid.zip")
+        assert mock_request.call_args[1]["stream"] is True
+
+    @mock.patch("python_anvil.api_resources.requests.AnvilRequest._request")
+    def test_download_options_ignored(mock_request):
+        res = requests.Response()
+        res.status_code = 200
+        res.raw = io.BytesIO(_zip())
+        mock_request.return_value = (StreamedContent(res), 200, {})
+
+        anvil = Anvil(api_key="my_key")
+        documents = anvil.extract_documents("eid", output="docs.zip", resume=True)
+        assert len(list(documents)) == len(FILES)
+        assert "resume" not in mock_request.call_args[1]
@@ -0,0 +1,360 @@
+"""Extract files from a zip archive while it is still being downloaded.
+
+`zipfile` needs the central directory at the end of the archive, so it
+can't read a zip until it's complete. This reads the local header in front
+of each file instead, and hands out each file's contents as they arrive.
+"""
+
+import struct
+import zlib
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Union,
+)
+from zipfile import BadZipFile
+
+from .http import Output, _open_output
+
+
+LOCAL_HEADER = b"PK\x03\x04"
+DATA_DESCRIPTOR = b"PK\x07\x08"
+# Any of these means there are no more files.
+END_SIGNATURES = (b"PK\x01\x02", b"PK\x05\x06", b"PK\x06\x06")
+
+STORED = 0
+DEFLATED = 8
+
+_LOCAL_HEADER = struct.Struct("<4s5H3I2H")
+_ZIP64_EXTRA = 0x0001
+_FLAG_ENCRYPTED = 0x1
+_FLAG_DATA_DESCRIPTOR = 0x8
+_FLAG_UTF8 = 0x800
+
+
+class _MemberStart(NamedTuple):
+    name: str
+    size: Optional[int]
+
+
+# Marks the end of a member's data in the parser's events.
+_MEMBER_END = object()
+
+Event = Union[_MemberStart, bytes, object]
+
+
+class _ZipStreamParser:
+    """Incremental zip parser: bytes go in with `feed()`, events come out.
+
+    The events of each member are a `_MemberStart`, its decompressed data
+    as `bytes` and `_MEMBER_END`.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._state = self._header
+        self._events: List[Event] = []
+        self._done = False
+
+    def feed(self, data: bytes) -> List[Event]:
+        self._buffer += data
+        while not self._done and self._state():
+            pass
+        events, self._events = self._events, []
+        return events
+
+    def close(self):
+        if not self._done:
+            raise BadZipFile("Zip archive ended unexpectedly")
+
+    def _take(self, size: int) -> bytes:
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    # Each state returns whether it made progress.
+
+    def _header(self) -> bool:
+        if len(self._buffer) < 4:
+            return False
+        signature = bytes(self._buffer[:4])
+        if signature in END_SIGNATURES:
+            self._done = True
+            return False
+        if signature != LOCAL_HEADER:
+            raise BadZipFile(f"Bad zip signature {signature!r}")
+        if len(self._buffer) < _LOCAL_HEADER.size:
+            return False
+
+        (
+            _,
+            _,
+            flags,
+            method,
+            _,
+            _,
+            crc,
+            compressed_size,
+            size,
+            name_length,
+            extra_length,
+        ) = _LOCAL_HEADER.unpack_from(self._buffer)
+        header_size = _LOCAL_HEADER.size + name_length + extra_length
+        if len(self._buffer) < header_size:
+            return False
+
+        header = self._take(header_size)
+        raw_name = header[_LOCAL_HEADER.size : _LOCAL_HEADER.size + name_length]
+        name = raw_name.decode("utf-8" if flags & _FLAG_UTF8 else "cp437")
+        extra = header[_LOCAL_HEADER.size + name_length :]
+
+        if flags & _FLAG_ENCRYPTED:
+            raise BadZipFile(f"{name} is encrypted")
+        if method not in (STORED, DEFLATED):
+            raise BadZipFile(f"{name} uses unsupported compression method {method}")
+
+        zip64 = _extra_fields(extra).get(_ZIP64_EXTRA)
+        # Data descriptors have 8 byte sizes when there is a zip64 field.
+        self._zip64 = zip64 is not None
+        if 0xFFFFFFFF in (size, compressed_size):
+            if zip64 is None:
+                raise BadZipFile(f"{name}: missing zip64 extra field")
+            values = iter(struct.unpack(f"<{len(zip64) // 8}Q", zip64))
+            if size == 0xFFFFFFFF:
+                size = next(values)
+            if compressed_size == 0xFFFFFFFF:
+                compressed_size = next(values)
+
+        self._name = name
+        self._crc = crc
+        self._size = size
+        self._actual_crc = 0
+        self._actual_size = 0
+        self._decompressor = (
+            zlib.decompressobj(-zlib.MAX_WBITS) if method == DEFLATED else None
+        )
+        self._has_descriptor = bool(flags & _FLAG_DATA_DESCRIPTOR)
+
+        if not self._has_descriptor:
+            self._remaining = compressed_size
+            self._state = self._sized_data
+        elif method == DEFLATED:
+            # The sizes follow the data, but deflate streams mark their end.
+            self._state = self._deflate_data
+        else:
+            raise BadZipFile(f"Can't stream {name}: stored with unknown size")
+
+        self._events.append(_MemberStart(name, None if self._has_descriptor else size))
+        return True
+
+    def _emit(self, data: bytes):
+        if data:
+            self._actual_crc = zlib.crc32(data, self._actual_crc)
+            self._actual_size += len(data)
+            self._events.append(data)
+
+    def _sized_data(self) -> bool:
+        if self._remaining and not self._buffer:
+            return False
+        data = self._take(self._remaining)
+        self._remaining -= len(data)
+        self._emit(self._decompressor.decompress(data) if self._decompressor else data)
+        if self._remaining:
+            return True
+        if self._decompressor:
+            self._emit(self._decompressor.flush())
+        self._end_member()
+        return True
+
+    def _deflate_data(self) -> bool:
+        if not self._buffer:
+            return False
+        self._emit(self._decompressor.decompress(self._take(len(self._buffer))))
+        if self._decompressor.eof:
+            self._buffer[:0] = self._decompressor.unused_data
+            self._state = self._data_descriptor
+        return True
+
+    def _data_descriptor(self) -> bool:
+        size_format = "<IQQ" if self._zip64 else "<III"
+        length = struct.calcsize(size_format)
+        if len(self._buffer) < 4 + length:
+            # The signature is optional, so wait for the longest case.
+            return False
+        if self._buffer[:4] == DATA_DESCRIPTOR:
+            del self._buffer[:4]
+        self._crc, _, self._size = struct.unpack(size_format, self._take(length))
+        self._end_member()
+        return True
+
+    def _end_member(self):
+        if self._actual_size != self._size:
+            raise BadZipFile(
+                f"{self._name}: expected {self._size} bytes, got {self._actual_size}"
+            )
+        if self._actual_crc != self._crc:
+            raise BadZipFile(f"Bad CRC-32 for {self._name}")
+        self._events.append(_MEMBER_END)
+        self._state = self._header
+
+
+def _extra_fields(extra: bytes) -> Dict[int, bytes]:
+    """Split the extra field of a header into its fields, by header ID."""
+    fields = {}
+    while len(extra) >= 4:
+        header_id, length = struct.unpack_from("<HH", extra)
+        fields[header_id] = extra[4 : 4 + length]
+        extra = extra[4 + length :]
+    return fields
+
+
+class ZipMember:
+    """One file in a zip archive being streamed by `iter_zip_members`.
+
+    Its contents must be read before moving on to the next file. Any part
+    that isn't read is skipped.
+
+    :param name: The file name in the archive.
+    :param size: The uncompressed size, or `None` if the archive doesn't
+        include it up front.
+    """
+
+    def __init__(self, name: str, size: Optional[int], events: Iterator[Event]):
+        self.name = name
+        self.size = size
+        self._events = events
+        self._done = False
+
+    def __repr__(self):
+        return f"<ZipMember {self.name!r}>"
+
+    def __iter__(self) -> Iterator[bytes]:
+        while not self._done:
+            event = next(self._events, None)
+            if event is None:
+                # The archive was already read to the end, or failed.
+                raise BadZipFile("Zip archive ended unexpectedly")
+            if event is _MEMBER_END:
+                self._done = True
+            else:
+                yield event  # type: ignore
+
+    def read(self) -> bytes:
+        """Read the whole file into memory."""
+        return b"".join(self)
+
+    def write_to(self, output: Output) -> int:
+        """Write the file to a path or a binary file object.
+
+        :return: The number of bytes written.
+        """
+        written = 0
+        with _open_output(output) as file:
+            for chunk in self:
+                file.write(chunk)
+                written += len(chunk)
+        return written
+
+    def _skip(self):
+        for _ in self:
+            pass
+
+
+def _events(chunks: Iterable[bytes]) -> Iterator[Event]:
+    parser = _ZipStreamParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    parser.close()
+
+
+def iter_zip_members(chunks: Iterable[bytes]) -> Iterator[ZipMember]:
+    """Yield each file of a zip archive as soon as its data starts arriving.
+
+    Raises `zipfile.BadZipFile` if the archive is invalid, or a file doesn't
+    match its CRC-32.
+
+    Usage:
+        >> for member in iter_zip_members(response.iter_content(65536)):
+        >>     member.write_to(member.name)
+
+    :param chunks: The archive, in chunks of any size.
+    """
+    events = _events(chunks)
+    for event in events:
+        if isinstance(event, _MemberStart):
+            member = ZipMember(event.name, event.size, events)
+            yield member
+            member._skip()  # pylint: disable=protected-access
+
+
+class AsyncZipMember:
+    """One file in a zip archive being streamed by `aiter_zip_members`.
+
+    Like `ZipMember`, but read with `async for`.
+    """
+
+    def __init__(self, name: str, size: Optional[int], events: AsyncIterator[Event]):
+        self.name = name
+        self.size = size
+        self._events = events
+        self._done = False
+
+    def __repr__(self):
+        return f"<AsyncZipMember {self.name!r}>"
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        while not self._done:
+            try:
+                event = await self._events.__anext__()
+            except StopAsyncIteration:
+                raise BadZipFile("Zip archive ended unexpectedly") from None
+            if event is _MEMBER_END:
+                self._done = True
+            else:
+                yield event  # type: ignore
+
+    async def read(self) -> bytes:
+        """Read the whole file into memory."""
+        return b"".join([chunk async for chunk in self])
+
+    async def write_to(self, output: Output) -> int:
+        """Write the file to a path or a binary file object.
+
+        :return: The number of bytes written.
+        """
+        written = 0
+        with _open_output(output) as file:
+            async for chunk in self:
+                file.write(chunk)
+                written += len(chunk)
+        return written
+
+    async def _skip(self):
+        async for _ in self:
+            pass
+
+
+async def _aevents(chunks: AsyncIterable[bytes]) -> AsyncIterator[Event]:
+    parser = _ZipStreamParser()
+    async for chunk in chunks:
+        for event in parser.feed(chunk):
+            yield event
+    parser.close()
+
+
+async def aiter_zip_members(
+    chunks: AsyncIterable[bytes],
+) -> AsyncIterator[AsyncZipMember]:
+    """asyncio version of `iter_zip_members`."""
+    events = _aevents(chunks)
+    async for event in events:
+        if isinstance(event, _MemberStart):
+            member = AsyncZipMember(event.name, event.size, events)
+            yield member
+            await member._skip()  # pylint: disable=protected-access